@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+disk_index.py
+Index the disk space used by each project and stage of the workspace.
+
+Finding which projects' caches/json, caches/text_files_clean, caches/model or
+browser/json use the space took a `du` over millions of files. This module
+keeps the sizes in a small SQLite database (projects/.disk_index.db):
+
+    1. the projects folder is walked once; for every folder the database
+       keeps its modification time, its sub-folders, and the number, size
+       and newest time of the files directly in it;
+    2. a refresh only lists the folders whose modification time changed
+       (files were added, removed or renamed in them) and reuses the rest,
+       so it takes one stat per unchanged folder;
+    3. each folder is counted in its project (a folder with a settings.py)
+       and stage (caches/json, caches/model, browser/json, ...); large model
+       files (topic-state.gz, *.mallet, ...) are listed on their own.
+
+Files rewritten in place, without a change to their folder, are not seen
+until their folder changes or the index is rebuilt (--rebuild). Files with
+more than one link (shared template files, source cache articles) are
+counted in every project, and their total is also given as shared.
+
+v1.0 first version: SQLite folder index refreshed by modification time
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import sqlite3
+import time
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+projects_dir    = 'projects'
+index_file      = '.disk_index.db'
+stages          = ('caches/json', 'caches/text_files_clean', 'caches/text_files', 'caches/model', 'caches/metadata',
+                   'caches/articles', 'caches', 'browser/json', 'browser', 'scripts', '.trash', '.pipeline')
+large_files     = ('topic-state.gz', '*.mallet', 'composition.txt', 'topic-words.txt', '*.pack', 'browser.zip', 'browser.html')
+stale_days      = 90
+schema          = """
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, project TEXT, stage TEXT, is_project INTEGER,
+                                 mtime_ns INTEGER, files INTEGER, bytes INTEGER, shared_bytes INTEGER,
+                                 newest_ns INTEGER, subdirs TEXT);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, project TEXT, bytes INTEGER, mtime_ns INTEGER, shared_bytes INTEGER);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS scans (finished TEXT, seconds REAL, dirs INTEGER, listed INTEGER);
+"""
+
+
+## INDEX
+
+def connect(root=projects_dir, path=None):
+    """Open (and create) the index of a projects folder."""
+    db = sqlite3.connect(path or os.path.join(root, index_file))
+    columns = [row[1] for row in db.execute('PRAGMA table_info(files)')]
+    if columns and 'shared_bytes' not in columns:
+        ## an index from before shared_bytes: list everything again
+        db.executescript('DROP TABLE files; DROP TABLE IF EXISTS dirs;')
+    db.executescript(schema)
+    return db
+
+
+def stage_of(rel):
+    """Return the stage of a folder, given its path inside its project."""
+    for stage in stages:
+        if rel == stage or rel.startswith(stage + '/'):
+            return stage
+    return 'other'
+
+
+def list_dir(path):
+    """List a folder: its sub-folders, file totals and large files.
+
+    Returns:
+        tuple: (subdirs, files, bytes, shared_bytes, newest_ns, has_settings, large)
+    """
+    subdirs, files, total, shared, newest, has_settings, large = [], 0, 0, 0, 0, False, []
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+                continue
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            continue
+        files += 1
+        total += stat.st_size
+        if stat.st_nlink > 1:
+            shared += stat.st_size
+        newest = max(newest, stat.st_mtime_ns)
+        if entry.name == 'settings.py':
+            has_settings = True
+        if any(fnmatch.fnmatch(entry.name, pattern) for pattern in large_files):
+            large.append((entry.name, stat.st_size, stat.st_mtime_ns, stat.st_size if stat.st_nlink > 1 else 0))
+    return sorted(subdirs), files, total, shared, newest, has_settings, large
+
+
+def refresh(root=projects_dir, db=None, rebuild=False, verbose=True):
+    """Bring the index of a projects folder up to date.
+
+    Args:
+        root (str): projects folder.
+        db (sqlite3.Connection): index; defaults to root/.disk_index.db.
+        rebuild (bool): list every folder, even unchanged ones.
+    Returns:
+        dict: folders 'seen' and 'listed', and 'seconds' taken.
+    """
+    start = time.time()
+    db = db or connect(root)
+    known = {row[0]: row for row in db.execute('SELECT path, mtime_ns, subdirs, is_project, project, stage FROM dirs')}
+    seen, listed = set(), 0
+    ## (folder relative to root, its project, the folder relative to the project)
+    stack = [('.', '', '')]
+    with db:
+        while stack:
+            rel, project, in_project = stack.pop()
+            path = os.path.join(root, rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            seen.add(rel)
+            row = known.get(rel)
+            if row and row[1] == mtime and not rebuild:
+                subdirs, is_project = json.loads(row[2]), row[3]
+            else:
+                subdirs, files, total, shared, newest, is_project, large = list_dir(path)
+                listed += 1
+            top = rel.split('/')[0]
+            if is_project and rel != '.' and not top.startswith('.'):
+                project, in_project = rel, ''
+            if project:
+                stage = stage_of(in_project)
+            else:
+                ## the trash and the object store of the projects folder
+                stage = top if top.startswith('.') and top != '.' else 'other'
+            if row and row[1] == mtime and not rebuild:
+                if (row[4], row[5]) != (project, stage):
+                    ## e.g. a settings.py was added above the folder
+                    db.execute('UPDATE dirs SET project = ?, stage = ? WHERE path = ?', (project, stage, rel))
+                    db.execute('UPDATE files SET project = ? WHERE dir = ?', (project, rel))
+            else:
+                db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (rel, project, stage, int(is_project), mtime,
+                            files, total, shared, newest, json.dumps(subdirs)))
+                db.execute('DELETE FROM files WHERE dir = ?', (rel,))
+                db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                               [(rel + '/' + name, rel, project, size, file_mtime, file_shared) for name, size, file_mtime, file_shared in large])
+            for name in subdirs:
+                child = name if rel == '.' else rel + '/' + name
+                stack.append((child, project, ((in_project + '/' + name) if in_project else name) if project else ''))
+        gone = [(path,) for path in known if path not in seen]
+        db.executemany('DELETE FROM dirs WHERE path = ?', gone)
+        db.executemany('DELETE FROM files WHERE dir = ?', gone)
+        seconds = time.time() - start
+        db.execute('INSERT INTO scans VALUES (?, ?, ?, ?)', (datetime.datetime.now().isoformat(timespec='seconds'), seconds, len(seen), listed))
+    if verbose:
+        print('Indexed {} folders under {} ({} listed, {} removed) in {:.1f} seconds'.format(len(seen), root, listed, len(gone), seconds))
+    return {'seen': len(seen), 'listed': listed, 'seconds': seconds}
+
+
+## QUERIES
+
+def usage_by_project(db):
+    """Return (project, files, bytes, shared bytes, newest file time) for each project, largest first."""
+    return db.execute('SELECT project, SUM(files), SUM(bytes), SUM(shared_bytes), MAX(newest_ns) FROM dirs '
+                      'GROUP BY project ORDER BY SUM(bytes) DESC').fetchall()
+
+
+def usage_by_stage(db, project=None):
+    """Return (stage, files, bytes, shared bytes) for all projects or one, largest first."""
+    where, args = ('WHERE project = ?', (project,)) if project is not None else ("WHERE project != ''", ())
+    return db.execute('SELECT stage, SUM(files), SUM(bytes), SUM(shared_bytes) FROM dirs {} '
+                      'GROUP BY stage ORDER BY SUM(bytes) DESC'.format(where), args).fetchall()
+
+
+def reclaimable(db, days=stale_days):
+    """List the space that could be freed.
+
+    Returns:
+        list: (project, item, bytes, newest time) -- the intermediate caches
+        and large model files of projects unchanged for `days` days, and
+        every project's trash -- largest first. Files linked from
+        elsewhere are left out, as they free no space, and so are large
+        files already counted in a trash.
+    """
+    limit = int((time.time() - days * 86400) * 1e9)
+    rows = db.execute("SELECT project, stage, SUM(bytes - shared_bytes), MAX(newest_ns) FROM dirs WHERE project != '' "
+                      "AND stage IN ('caches/json', 'caches/text_files', 'caches/text_files_clean', '.trash', '.pipeline') "
+                      'GROUP BY project, stage').fetchall()
+    newest = dict((row[0], row[4]) for row in usage_by_project(db))
+    items = [(project, stage, size, when) for project, stage, size, when in rows
+             if size and (stage == '.trash' or (newest.get(project) or 0) < limit)]
+    items += db.execute('SELECT files.project, files.path, files.bytes - files.shared_bytes, files.mtime_ns FROM files '
+                        'JOIN dirs ON files.dir = dirs.path '
+                        "WHERE dirs.stage NOT IN ('.trash', '.Trash') AND files.mtime_ns < ? AND files.bytes > files.shared_bytes",
+                        (limit,)).fetchall()
+    trash = db.execute("SELECT SUM(bytes - shared_bytes), MAX(newest_ns) FROM dirs WHERE stage = '.Trash'").fetchone()
+    if trash[0]:
+        items.append(('', '.Trash', trash[0], trash[1]))
+    return sorted(items, key=lambda item: -item[2])
+
+
+def human_size(size):
+    """Return a size in bytes as e.g. '1.5 GB'."""
+    size = float(size or 0)
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{:.0f} {}'.format(size, unit) if unit == 'bytes' else '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return None
+
+
+def when(ns):
+    """Return a time in nanoseconds as a date."""
+    return datetime.datetime.fromtimestamp(ns / 1e9).strftime('%Y-%m-%d') if ns else ''
+
+
+def report(db, days=stale_days, top=20):
+    """Print the largest projects and stages, and the space that could be freed."""
+    print('\nPROJECTS')
+    for project, files, size, shared, newest in usage_by_project(db)[:top]:
+        print('{:>10}  {:>10} shared  {:>10,} files  {:10}  {}'.format(human_size(size), human_size(shared), files or 0, when(newest), project or '(outside projects)'))
+    print('\nSTAGES')
+    for stage, files, size, shared in usage_by_stage(db):
+        print('{:>10}  {:>10} shared  {:>10,} files  {}'.format(human_size(size), human_size(shared), files or 0, stage))
+    items = reclaimable(db, days)
+    print('\nRECLAIMABLE (unchanged for {} days, or in a trash): {}'.format(days, human_size(sum(item[2] for item in items))))
+    for project, item, size, newest in items[:top]:
+        print('{:>10}  {:10}  {}  {}'.format(human_size(size), when(newest), project, item))
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Index the disk space of the projects folder in SQLite and report it by project and stage.', epilog='EXAMPLE:\n  disk_index.py -p projects\n  disk_index.py -p projects --no-refresh --days 30\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-p', '--projects', default=projects_dir, help='projects folder')
+    PARSER.add_argument('-d', '--db', default=None, help='index file (default: <projects>/.disk_index.db)')
+    PARSER.add_argument('--days', type=int, default=stale_days, help='projects unchanged for this many days count as reclaimable')
+    PARSER.add_argument('--rebuild', action='store_true', help='list every folder again')
+    PARSER.add_argument('--no-refresh', action='store_true', help='report from the index as it is')
+
+    CL_ARGS = PARSER.parse_args()
+
+    DB = connect(CL_ARGS.projects, CL_ARGS.db)
+    if not CL_ARGS.no_refresh:
+        refresh(CL_ARGS.projects, DB, CL_ARGS.rebuild)
+    report(DB, CL_ARGS.days)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+"""
+pipeline.py
+Run the numbered notebooks of projects headlessly, many projects at a time.
+
+Projects used to be built one at a time from a browser tab: the RUN ALL
+button of 1_import_data.ipynb clicks #run_all_cells and uses JavaScript to
+give the kernel the notebook port and URLs (port, url_9999, url_10000). This
+module runs a project's stages (its numbered notebooks, 0_clear_caches.ipynb
+to 7_browser_topic_bubbles.ipynb) without a browser:
+
+    1. each stage is executed by a Jupyter kernel in the project folder,
+       with a first cell setting the parameters the JavaScript used to set
+       (port, url_9999, url_10000, and any others given); the executed
+       notebook is kept in the project's .pipeline folder;
+    2. projects wait in a queue and run concurrently, each on its own share
+       of the cores (the kernels inherit the CPU affinity, so MALLET and the
+       numerical libraries size their threads to it); a project is only
+       started when the memory set aside for a job is available;
+    3. each project records in .pipeline/state.json which stages finished,
+       with a hash of the notebook, settings.py and the parameters; a stage
+       that finished with the same hash is skipped, so an interrupted or
+       failed batch resumes where it stopped. After a stage runs again, all
+       the stages after it run again too.
+
+Executing notebooks needs the nbclient and nbformat packages (installed with
+Jupyter).
+
+v1.0 first version: headless stages, concurrent projects, resumable state
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import collections
+import datetime
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+stage_pattern   = re.compile(r'^\d+_.*\.ipynb$')
+state_dir       = '.pipeline'
+state_file      = 'state.json'
+default_params  = {'port': 10000}
+base_url        = 'http://localhost'
+notebook_root   = '.'   ## the folder Jupyter serves, for the notebook URLs
+cpus_per_job    = 1
+mem_per_job_mb  = 2048
+poll_seconds    = 5
+kernel_name     = 'python3'
+thread_vars     = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+## RESOURCES
+
+def available_cpus():
+    """Return the cores this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def available_memory_mb():
+    """Return the memory available for new processes, in megabytes."""
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError):
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+def cpu_slots(cpus_per_job=cpus_per_job, workers=None):
+    """Split the available cores into one group per concurrent job.
+
+    Args:
+        cpus_per_job (int): cores for each project.
+        workers (int): concurrent projects; defaults to as many as the cores
+            and memory allow.
+    Returns:
+        list: a list of cores for each job slot.
+    """
+    cpus = available_cpus()
+    cpus_per_job = max(1, min(int(cpus_per_job), len(cpus)))
+    slots = [cpus[i:i + cpus_per_job] for i in range(0, len(cpus) - cpus_per_job + 1, cpus_per_job)]
+    limit = max(1, available_memory_mb() // max(1, mem_per_job_mb))
+    return slots[:max(1, min(workers or limit, len(slots)))]
+
+
+## STAGES
+
+def project_stages(project_dir, stages=None):
+    """Return a project's stage notebooks, in order.
+
+    Args:
+        stages (list): stage numbers or notebook names to run (e.g. [1, 4] or
+            ['1_import_data.ipynb']); defaults to every numbered notebook.
+    """
+    names = sorted((name for name in os.listdir(project_dir) if stage_pattern.match(name)),
+                   key=lambda name: (int(name.split('_')[0]), name))
+    if stages is None:
+        return names
+    wanted = set(str(stage) for stage in stages)
+    return [name for name in names if name in wanted or name.split('_')[0] in wanted]
+
+
+def notebook_urls(project_dir, server=None, root=None):
+    """Return the url_9999 and url_10000 the notebooks would get in a browser.
+
+    Args:
+        server (str): defaults to base_url.
+        root (str): the folder Jupyter serves; defaults to notebook_root.
+    """
+    rel = os.path.relpath(os.path.abspath(project_dir), os.path.abspath(root or notebook_root)).replace(os.sep, '/')
+    return {'url_{}'.format(port): '{}:{}/notebooks/{}'.format(server or base_url, port, rel) for port in (9999, 10000)}
+
+
+def stage_params(project_dir, params=None):
+    """Return the parameters set before each stage runs."""
+    values = dict(default_params)
+    values.update(notebook_urls(project_dir))
+    values.update(params or {})
+    return values
+
+
+def parameter_cell(params):
+    """Return the source of the cell that sets the parameters."""
+    return '## parameters (scripts/workspace/pipeline.py)\n' + ''.join('{} = {!r}\n'.format(key, value) for key, value in sorted(params.items()))
+
+
+def stage_hash(project_dir, notebook, params):
+    """Return the hash of a stage's notebook, the project's settings.py and the parameters."""
+    digest = hashlib.sha1()
+    for name in (notebook, 'settings.py'):
+        path = os.path.join(project_dir, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as fin:
+                digest.update(fin.read())
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+## STATE
+
+def read_state(project_dir):
+    """Return a project's pipeline state."""
+    path = os.path.join(project_dir, state_dir, state_file)
+    if not os.path.isfile(path):
+        return {'stages': {}}
+    with io.open(path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def write_state(project_dir, state):
+    """Write a project's pipeline state atomically."""
+    path = os.path.join(project_dir, state_dir, state_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as out:
+        out.write(json.dumps(state, indent=1, sort_keys=True))
+    os.replace(path + '.tmp', path)
+
+
+def now():
+    """Return the time as an ISO string."""
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+## EXECUTION
+
+def execute_notebook(notebook, output, params, timeout=None, kernel=kernel_name):
+    """Execute a notebook in its folder with a parameter cell first, and save it to output.
+
+    Raises:
+        nbclient.exceptions.CellExecutionError: if a cell fails; the notebook
+            is saved up to the failing cell.
+    """
+    import nbformat
+    from nbclient import NotebookClient
+    nb = nbformat.read(notebook, as_version=4)
+    nb.cells.insert(0, nbformat.v4.new_code_cell(parameter_cell(params), metadata={'tags': ['injected-parameters']}))
+    client = NotebookClient(nb, timeout=timeout, kernel_name=kernel,
+                            resources={'metadata': {'path': os.path.dirname(os.path.abspath(notebook))}})
+    try:
+        client.execute()
+    finally:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        nbformat.write(nb, output)
+
+
+def run_stage(project_dir, notebook, params, cpus=None, timeout=None, kernel=kernel_name):
+    """Run one stage in a child process pinned to cpus.
+
+    Returns:
+        tuple: (ok, the end of the child's error output)
+    """
+    output = os.path.join(state_dir, notebook)
+    command = [sys.executable, os.path.abspath(__file__), '--execute', notebook, '--output', output,
+               '--params', json.dumps(params), '--kernel', kernel]
+    if timeout:
+        command += ['--timeout', str(timeout)]
+    env = dict(os.environ)
+    if cpus:
+        env.update({name: str(len(cpus)) for name in thread_vars})
+    child = subprocess.Popen(command, cwd=project_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        ## set before the child starts its kernel, which inherits it
+        os.sched_setaffinity(child.pid, cpus)
+    _out, error = child.communicate()
+    return child.returncode == 0, error.decode('utf-8', 'replace').strip()[-2000:]
+
+
+def run_project(project_dir, stages=None, params=None, cpus=None, force=False, timeout=None, kernel=kernel_name, log=print):
+    """Run a project's stages in order, skipping those already done.
+
+    Args:
+        project_dir (str): project folder.
+        stages (list): stages to run (see project_stages).
+        params (dict): parameters set before each stage (see stage_params).
+        cpus (list): cores the stages may use.
+        force (bool): run every stage, even if it is done.
+        timeout (int): seconds a cell may run; None for no limit.
+    Returns:
+        dict: the project's state.
+    """
+    params = stage_params(project_dir, params)
+    state = read_state(project_dir)
+    rerun = force
+    for notebook in project_stages(project_dir, stages):
+        key = stage_hash(project_dir, notebook, params)
+        done = state['stages'].get(notebook, {})
+        if not rerun and done.get('status') == 'done' and done.get('hash') == key:
+            log('{}: {} already done'.format(project_dir, notebook))
+            continue
+        rerun = True
+        state['stages'][notebook] = {'status': 'running', 'hash': key, 'started': now()}
+        write_state(project_dir, state)
+        log('{}: running {}'.format(project_dir, notebook))
+        ok, error = run_stage(project_dir, notebook, params, cpus, timeout, kernel)
+        state['stages'][notebook].update({'status': 'done' if ok else 'failed', 'finished': now()})
+        if not ok:
+            state['stages'][notebook]['error'] = error
+        write_state(project_dir, state)
+        if not ok:
+            log('{}: {} failed -- see {}\n{}'.format(project_dir, notebook, os.path.join(project_dir, state_dir, notebook), error.splitlines()[-1] if error else ''))
+            break
+    return state
+
+
+def run_projects(projects, stages=None, params=None, workers=None, cpus_per_job=cpus_per_job, force=False, timeout=None, kernel=kernel_name, verbose=True):
+    """Run many projects' stages concurrently.
+
+    Projects wait in a queue and start when a job slot (a share of the
+    cores) is free and mem_per_job_mb of memory is available.
+
+    Args:
+        projects (list): project folders.
+        workers (int): concurrent projects; defaults to as many as the cores
+            and memory allow.
+        cpus_per_job (int): cores for each project.
+        Other arguments as for run_project.
+    Returns:
+        dict: project folder -> True if all its stages are done.
+    """
+    lock = threading.Lock()
+
+    def log(message):
+        if verbose:
+            with lock:
+                print('[{}] {}'.format(datetime.datetime.now().strftime('%H:%M:%S'), message))
+
+    def job(project_dir, cpus):
+        state = run_project(project_dir, stages, params, cpus, force, timeout, kernel, log)
+        return all(state['stages'].get(name, {}).get('status') == 'done' for name in project_stages(project_dir, stages))
+
+    queue = collections.deque(projects)
+    free = cpu_slots(cpus_per_job, workers)
+    running, results = {}, {}
+    with ThreadPoolExecutor(max_workers=len(free)) as executor:
+        while queue or running:
+            while queue and free and (not running or available_memory_mb() >= mem_per_job_mb):
+                project_dir = queue.popleft()
+                cpus = free.pop(0)
+                running[executor.submit(job, project_dir, cpus)] = (project_dir, cpus)
+            finished, _pending = wait(running, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+            for future in finished:
+                project_dir, cpus = running.pop(future)
+                free.append(cpus)
+                try:
+                    results[project_dir] = future.result()
+                except Exception as error:  #pylint: disable=broad-except
+                    log('{}: {}'.format(project_dir, error))
+                    results[project_dir] = False
+    log('{} of {} projects done'.format(sum(results.values()), len(results)))
+    return results
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Run the numbered notebooks of projects headlessly, several projects at a time, resuming where the last run stopped.', epilog='EXAMPLE:\n  pipeline.py projects/20180101_0000_untitled\n  pipeline.py "projects/2018*" -s 1 4 -w 4 -c 2 -P port=10000 -P model_num_topics=50\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('projects', nargs='*', help='project folders (glob patterns allowed)')
+    PARSER.add_argument('-s', '--stages', nargs='+', default=None, help='stage numbers or notebooks to run (default: all numbered notebooks)')
+    PARSER.add_argument('-P', '--param', action='append', default=[], help='parameter set before each stage, as name=value (value read as Python/JSON if possible)')
+    PARSER.add_argument('-w', '--workers', type=int, default=None, help='concurrent projects (default: as many as cores and memory allow)')
+    PARSER.add_argument('-c', '--cpus', type=int, default=cpus_per_job, help='cores per project')
+    PARSER.add_argument('-m', '--memory', type=int, default=mem_per_job_mb, help='memory per project, in MB')
+    PARSER.add_argument('-f', '--force', action='store_true', help='run every stage, even those already done')
+    PARSER.add_argument('-t', '--timeout', type=int, default=None, help='seconds a cell may run (default: no limit)')
+    PARSER.add_argument('-k', '--kernel', default=kernel_name, help='Jupyter kernel')
+    PARSER.add_argument('--base-url', default=base_url, help='server for url_9999 and url_10000')
+    PARSER.add_argument('--root', default=notebook_root, help='folder the Jupyter server serves, for url_9999 and url_10000')
+    PARSER.add_argument('--execute', default=None, help=argparse.SUPPRESS)
+    PARSER.add_argument('--output', default=None, help=argparse.SUPPRESS)
+    PARSER.add_argument('--params', default='{}', help=argparse.SUPPRESS)
+
+    CL_ARGS = PARSER.parse_args()
+
+    if CL_ARGS.execute:
+        ## one stage, run by run_stage in the project folder
+        execute_notebook(CL_ARGS.execute, CL_ARGS.output, json.loads(CL_ARGS.params), CL_ARGS.timeout, CL_ARGS.kernel)
+        sys.exit(0)
+
+    PARAMS = {}
+    for PARAM in CL_ARGS.param:
+        NAME, _, VALUE = PARAM.partition('=')
+        try:
+            PARAMS[NAME] = json.loads(VALUE)
+        except ValueError:
+            PARAMS[NAME] = VALUE
+    base_url = CL_ARGS.base_url
+    notebook_root = CL_ARGS.root
+    mem_per_job_mb = CL_ARGS.memory
+    PROJECTS = sorted(set(path for pattern in CL_ARGS.projects for path in (glob.glob(pattern) or [pattern]) if os.path.isdir(path)))
+    if not PROJECTS:
+        PARSER.error('no project folders found')
+    RESULTS = run_projects(PROJECTS, CL_ARGS.stages, PARAMS, CL_ARGS.workers, CL_ARGS.cpus, CL_ARGS.force, CL_ARGS.timeout, CL_ARGS.kernel)
+    sys.exit(0 if all(RESULTS.values()) else 1)
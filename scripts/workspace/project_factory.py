@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""
+project_factory.py
+Create projects from a template without copying the whole template.
+
+new_topic_json_browser_project.ipynb used to create each project with
+shutil.copytree(template_directory, ...), so every timestamped project held
+its own copy of scripts/ (the topic bubbles libraries, the dfr-browser
+scripts, old notebooks, images). A project now only copies the files it is
+expected to edit, and shares the rest with the template:
+
+    1. the notebooks at the top of the template, settings.py,
+       scripts/scrub/config.py and the stop word lists are copied;
+    2. every other file is cloned (a copy-on-write reflink, where the file
+       system supports it) or hard-linked to a read-only copy kept once in
+       an object store next to the projects (projects/.objects), named by
+       its SHA-1; if neither works, it is copied;
+    3. the project records the template, its version (a hash of the
+       template's files) and how each file was made in .template.json, so
+       upgrade_project() can later bring the shared files up to date and add
+       new ones, without touching files the project has changed.
+
+Edit shared files by replacing them (save as a new file and rename), not in
+place: the store copies are read-only for that reason.
+
+v1.0 first version: copy-on-write project creation and upgrades
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import datetime
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+record_file     = '.template.json'
+objects_dir     = 'projects/.objects'
+editable_files  = ('*.ipynb', 'settings.py', 'scripts/scrub/config.py', 'scripts/scrub/*stopwords*', '*stopwords*')
+ignored_names   = ('.ipynb_checkpoints', '__pycache__', '.DS_Store', record_file)
+FICLONE         = 0x40049409  ## linux/fs.h: _IOW(0x94, 9, int)
+
+
+## TEMPLATE
+
+def file_digest(path, block_size=1 << 20):
+    """Return the SHA-1 of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_editable(rel, patterns=editable_files):
+    """Return True if a project copies this file rather than sharing it.
+
+    A pattern matches files at its own depth only: '*.ipynb' is the
+    notebooks at the top of the template, not the old ones under scripts/.
+    """
+    return any(fnmatch.fnmatch(rel, pattern) and rel.count('/') == pattern.count('/') for pattern in patterns)
+
+
+def scan_template(template_dir):
+    """List the files and folders of a template.
+
+    Returns:
+        tuple: (files, dirs) -- files maps each relative path (with '/') to
+        [sha1, executable]; dirs lists the relative folders.
+    """
+    files, dirs = {}, []
+    for dirpath, dirnames, filenames in os.walk(template_dir):
+        dirnames[:] = sorted(name for name in dirnames if name not in ignored_names)
+        rel_dir = os.path.relpath(dirpath, template_dir).replace(os.sep, '/')
+        if rel_dir != '.':
+            dirs.append(rel_dir)
+        for name in sorted(filenames):
+            if name in ignored_names:
+                continue
+            path = os.path.join(dirpath, name)
+            rel = name if rel_dir == '.' else rel_dir + '/' + name
+            files[rel] = [file_digest(path), bool(os.stat(path).st_mode & stat.S_IXUSR)]
+    return files, dirs
+
+
+def template_version(files):
+    """Return the version of a template: a short hash of its files and their hashes."""
+    digest = hashlib.sha1()
+    for rel in sorted(files):
+        digest.update('{} {}\n'.format(rel, files[rel][0]).encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+
+## FILES
+
+def reflink(source, target):
+    """Clone source to target, sharing its blocks until either is changed.
+
+    Returns:
+        bool: False if the file system (or platform) cannot clone files.
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except (IOError, OSError):
+        if os.path.lexists(target):
+            os.remove(target)
+        return False
+    shutil.copystat(source, target)
+    return True
+
+
+def store_object(store, source, digest, executable):
+    """Add a read-only copy of a file to the object store, if it is not there.
+
+    Returns:
+        str: the stored object.
+    """
+    obj = os.path.join(store, digest[:2], digest + ('.x' if executable else ''))
+    if not os.path.isfile(obj):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(obj, os.getpid())
+        shutil.copyfile(source, tmp)
+        os.chmod(tmp, 0o555 if executable else 0o444)
+        os.replace(tmp, obj)
+    return obj
+
+
+def place_file(source, target, digest, executable, store, method='auto'):
+    """Put a template file in a project, replacing any file already there.
+
+    Args:
+        method (str): 'auto' (reflink, else hard link, else copy), 'reflink',
+            'link' or 'copy'.
+    Returns:
+        str: how the file was made: 'reflinked', 'linked' or 'copied'.
+    """
+    tmp = '{}.{}.tmp'.format(target, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    how = 'copied'
+    if method in ('auto', 'reflink') and reflink(source, tmp):
+        how = 'reflinked'
+    elif method in ('auto', 'link'):
+        try:
+            os.link(store_object(store, source, digest, executable), tmp)
+            how = 'linked'
+        except OSError:
+            pass
+    if how == 'copied':
+        shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+    return how
+
+
+## RECORD
+
+def read_record(project_dir):
+    """Return a project's template record, or None for projects copied whole."""
+    path = os.path.join(project_dir, record_file)
+    if not os.path.isfile(path):
+        return None
+    with io.open(path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def write_record(project_dir, record):
+    """Write a project's template record atomically."""
+    path = os.path.join(project_dir, record_file)
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as out:
+        out.write(json.dumps(record, indent=1, sort_keys=True))
+    os.replace(path + '.tmp', path)
+
+
+## PROJECTS
+
+def create_project(template_dir, project_dir, store=objects_dir, method='auto', verbose=True):
+    """Create a project from a template, copying only the files it edits.
+
+    The project is built in a temporary folder next to project_dir and
+    renamed into place, so a failed run leaves no half-made project.
+
+    Args:
+        template_dir (str): template folder (e.g. templates/topic_browser_json_template).
+        project_dir (str): project folder to create; it must not exist.
+        store (str): object store for hard-linked files.
+        method (str): how shared files are made (see place_file); 'copy' to
+            copy the whole template as before.
+        verbose (bool): print a summary.
+    Returns:
+        dict: the project's template record.
+    """
+    if os.path.exists(project_dir):
+        raise FileExistsError('Project already exists: ' + project_dir)
+    files, dirs = scan_template(template_dir)
+    parent = os.path.dirname(os.path.abspath(project_dir))
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(project_dir) + '-', dir=parent)
+    os.chmod(build_dir, 0o775)
+    made = {}
+    try:
+        for rel in dirs:
+            os.makedirs(os.path.join(build_dir, rel), exist_ok=True)
+        for rel, (digest, executable) in files.items():
+            source, target = os.path.join(template_dir, rel), os.path.join(build_dir, rel)
+            if is_editable(rel):
+                shutil.copy2(source, target)
+                made[rel] = [digest, 'copied']
+            else:
+                made[rel] = [digest, place_file(source, target, digest, executable, store, method)]
+        record = {'template': os.path.normpath(template_dir),
+                  'version': template_version(files),
+                  'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'upgraded': None,
+                  'files': made}
+        write_record(build_dir, record)
+        os.rename(build_dir, project_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    if verbose:
+        counts = {how: sum(1 for _digest, made_how in made.values() if made_how == how) for how in ('copied', 'reflinked', 'linked')}
+        print('Created {} from {} (version {}): {copied} copied, {reflinked} reflinked, {linked} linked'.format(project_dir, template_dir, record['version'], **counts))
+    return record
+
+
+def upgrade_project(project_dir, template_dir=None, store=objects_dir, method='auto', verbose=True):
+    """Bring a project's template files up to date with its template.
+
+    Files the template changed are replaced, unless the project changed
+    them too; new template files are added; shared files the template no
+    longer has are removed. Files the project changed are kept and reported.
+
+    Args:
+        project_dir (str): project made by create_project.
+        template_dir (str): template to upgrade to; defaults to the recorded one.
+    Returns:
+        dict: relative paths 'updated', 'added', 'removed' and 'kept'.
+    """
+    record = read_record(project_dir)
+    if record is None:
+        raise ValueError('No {} in {}: the project was not made by project_factory.py'.format(record_file, project_dir))
+    template_dir = template_dir or record['template']
+    files, dirs = scan_template(template_dir)
+    made = record['files']
+    report = {'updated': [], 'added': [], 'removed': [], 'kept': []}
+
+    for rel in dirs:
+        os.makedirs(os.path.join(project_dir, rel), exist_ok=True)
+    for rel, (digest, executable) in files.items():
+        source, target = os.path.join(template_dir, rel), os.path.join(project_dir, rel)
+        exists = os.path.isfile(target)
+        current = file_digest(target) if exists else None
+        if rel in made and made[rel][0] == digest:
+            continue
+        if current == digest:
+            made[rel] = [digest, made.get(rel, [None, 'copied'])[1]]
+            continue
+        if exists and (rel not in made or current != made[rel][0]):
+            report['kept'].append(rel)
+            continue
+        if is_editable(rel):
+            shutil.copy2(source, target)
+            how = 'copied'
+        else:
+            how = place_file(source, target, digest, executable, store, method)
+        report['updated' if rel in made else 'added'].append(rel)
+        made[rel] = [digest, how]
+
+    for rel in sorted(set(made) - set(files)):
+        target = os.path.join(project_dir, rel)
+        if made[rel][1] != 'copied' and os.path.isfile(target) and file_digest(target) == made[rel][0]:
+            os.remove(target)
+            report['removed'].append(rel)
+        del made[rel]
+
+    record.update({'template': os.path.normpath(template_dir), 'version': template_version(files),
+                   'upgraded': datetime.datetime.now().isoformat(timespec='seconds'), 'files': made})
+    write_record(project_dir, record)
+    if verbose:
+        print('Upgraded {} to version {}: {} updated, {} added, {} removed, {} kept'.format(
+            project_dir, record['version'], *[len(report[key]) for key in ('updated', 'added', 'removed', 'kept')]))
+        for rel in report['kept']:
+            print('  kept (changed in the project): ' + rel)
+    return report
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Create a project from a template, copying only the files a project edits and sharing the rest.', epilog='EXAMPLE:\n  project_factory.py -t templates/topic_browser_json_template -p projects/20180101_0000_untitled\n  project_factory.py -p projects/20180101_0000_untitled --upgrade\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-t', '--template', default=None, help='template folder (default for --upgrade: the recorded template)')
+    PARSER.add_argument('-p', '--project', required=True, help='project folder')
+    PARSER.add_argument('-s', '--store', default=objects_dir, help='object store for hard-linked files')
+    PARSER.add_argument('-m', '--method', default='auto', choices=('auto', 'reflink', 'link', 'copy'), help='how shared files are made')
+    PARSER.add_argument('--upgrade', action='store_true', help='upgrade an existing project instead of creating one')
+
+    CL_ARGS = PARSER.parse_args()
+
+    if CL_ARGS.upgrade:
+        upgrade_project(CL_ARGS.project, CL_ARGS.template, CL_ARGS.store, CL_ARGS.method)
+    else:
+        create_project(CL_ARGS.template or 'templates/topic_browser_json_template', CL_ARGS.project, CL_ARGS.store, CL_ARGS.method)
@@ -3,3 +3,4 @@
 template_dir  = 'templates/topic_browser_template'
 projects_dir  = 'projects/'       # '../../write/projects'
 trash_dir     = 'projects/.Trash' # '../../write/projects/.Trash'
+objects_dir   = 'projects/.objects' # files shared by projects (scripts/workspace/project_factory.py)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+fingerprint.py
+Screen a corpus for exact and near-duplicate texts before scrubbing.
+
+1.  Accepts a list of one or more file paths. Within those paths (recursive):
+2.  All files matching pattern (*.json by default) are read -- for JSON the raw
+      'content' field is used, so this can run straight after import
+3.  Each text is normalized (case, punctuation, whitespace) and hashed;
+      files sharing a hash are exact duplicates
+4.  Optionally, MinHash signatures of word shingles are banded (LSH) to find
+      near-duplicate candidates, which are kept if their estimated Jaccard
+      similarity is above threshold
+5.  Duplicates are written to a csv outputfile in the corpus_compare.py format,
+      and optionally deleted (the first file of each group by name is kept)
+
+Unlike corpus_compare.py this never builds a pairwise matrix, so it is linear in
+the number of files and cheap enough to run before scrub.py and TF/IDF.
+
+v1.0 first version: normalized hash and MinHash/LSH screening
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+## argument parsing
+import argparse
+from argparse import RawDescriptionHelpFormatter
+## logging
+import logging
+## time the script
+from datetime import datetime
+## file handling, hashing, writing
+import os
+import re
+import csv
+import json
+import hashlib
+import zlib
+## working with arrays
+import numpy as np
+## share the csv sampler with the tf-idf comparison script
+try:
+    from scripts.deduplicate.corpus_compare import fpaths_to_fnamelist, str_sampler
+except ImportError:
+    from corpus_compare import fpaths_to_fnamelist, str_sampler
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## LOGGING
+
+#pylint: disable=logging-format-interpolation
+logger = logging.getLogger()  #pylint: disable=invalid-name
+
+## CONSTANTS
+
+MERSENNE_PRIME = np.uint64(4294967291)  ## largest prime below 2**32 -- keeps (a*x + b) inside uint64
+NONWORD = re.compile(r'[\W_]+', re.UNICODE)
+
+## FUNCTIONS
+
+def fname_to_rawstr(fname):
+    """
+    Filename to raw string:
+    Take file name, return the unscrubbed text.
+
+    For JSON, prefers 'content' and falls back to 'content_scrubbed' if the
+    original content has already been deleted.
+    """
+    with open(fname, 'r') as fhandle:
+        if fname.lower().endswith('.json'):
+            json_decoded = json.loads(fhandle.read())
+            fstr = json_decoded.get('content', json_decoded.get('content_scrubbed', ''))
+        else:
+            fstr = fhandle.read()
+    return fstr
+
+def str_normalize(fstr):
+    """
+    String normalize:
+    Lowercase, strip punctuation and collapse whitespace, so that texts differing
+    only in markup or spacing produce the same fingerprint.
+    """
+    return ' '.join(NONWORD.sub(' ', fstr.lower()).split())
+
+def str_to_hash(normstr):
+    """
+    String to hash:
+    Return a 128-bit hex digest of a normalized string.
+    """
+    return hashlib.blake2b(normstr.encode('utf-8'), digest_size=16).hexdigest()
+
+def str_to_shingles(normstr, shingle_size=5):
+    """
+    String to shingles:
+    Return the set of word n-grams in a normalized string, each hashed to 32 bits.
+
+    Texts shorter than shingle_size words become a single shingle.
+    """
+    words = normstr.split()
+    if len(words) <= shingle_size:
+        return {zlib.crc32(normstr.encode('utf-8'))}
+    return {zlib.crc32(' '.join(words[i:i+shingle_size]).encode('utf-8'))
+            for i in range(len(words) - shingle_size + 1)}
+
+def minhash_permutations(num_perm=128, seed=1):
+    """
+    MinHash permutations:
+    Return (a, b) arrays of uint64 coefficients for num_perm universal hash functions
+    h(x) = (a*x + b) mod p.
+    """
+    generator = np.random.RandomState(seed)
+    perm_a = generator.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    perm_b = generator.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    return perm_a, perm_b
+
+def shingles_to_minhash(shingles, permutations):
+    """
+    Shingles to MinHash:
+    Return a uint32 signature: the minimum of each permuted hash over all shingles.
+    """
+    perm_a, perm_b = permutations
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles)) % MERSENNE_PRIME
+    permuted = (np.outer(hashes, perm_a) + perm_b) % MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+def minhash_lsh_candidates(signatures, bands=32):
+    """
+    MinHash LSH candidates:
+    Split each signature into bands and bucket documents on each band.
+    Return a set of (i, j) index pairs, i < j, that share at least one bucket.
+
+    With 128 permutations and 32 bands of 4 rows, pairs with Jaccard
+    similarity 0.8 are found with probability > 0.99.
+    """
+    rows = signatures.shape[1] // bands
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        band_view = np.ascontiguousarray(signatures[:, band*rows:(band+1)*rows])
+        for idx, key in enumerate(band_view):
+            buckets.setdefault(key.tobytes(), []).append(idx)
+        for members in buckets.values():
+            if len(members) > 1:
+                for pos, i in enumerate(members):
+                    for j in members[pos+1:]:
+                        candidates.add((i, j))
+    return candidates
+
+def batch_exact_fingerprints(filelist, verbose=1):
+    """
+    Batch exact fingerprints:
+    Take a sorted filename list; yield (original, duplicate, normstr) for every file
+    whose normalized text hash was already seen.
+
+    Only one hash per unique file is held in memory.
+    """
+    if verbose == 1:
+        logger.info('Screen files for normalized hash equality (exact duplicates)...')
+        start_time = datetime.now().replace(microsecond=0)
+
+    seen = {}
+    for fname in filelist:
+        normstr = str_normalize(fname_to_rawstr(fname))
+        fhash = str_to_hash(normstr)
+        if fhash in seen:
+            yield seen[fhash], fname, normstr
+        else:
+            seen[fhash] = fname
+
+    if verbose == 1:
+        logger.info('  ...elapsed time: {}'.format(datetime.now().replace(microsecond=0) - start_time))
+
+def batch_minhash_fingerprints(filelist, threshold, num_perm=128, bands=32, shingle_size=5, verbose=1):
+    """
+    Batch MinHash fingerprints:
+    Take a sorted filename list; yield (original, duplicate, similarity) for every
+    file whose estimated Jaccard similarity to an earlier file is above threshold.
+
+    Duplicate chains (A~B, B~C) are grouped so each duplicate is reported once,
+    against the first file of its group.
+    """
+    if verbose == 1:
+        logger.info('Screen files for MinHash similarity (near duplicates)...')
+        start_time = datetime.now().replace(microsecond=0)
+
+    permutations = minhash_permutations(num_perm)
+    signatures = np.empty((len(filelist), num_perm), dtype=np.uint32)
+    for idx, fname in enumerate(filelist):
+        signatures[idx] = shingles_to_minhash(str_to_shingles(str_normalize(fname_to_rawstr(fname)), shingle_size), permutations)
+
+    ## union-find over confirmed pairs; the root is always the lowest (first sorted) index
+    parent = list(range(len(filelist)))
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    similarity = {}
+    for i, j in sorted(minhash_lsh_candidates(signatures, bands)):
+        estimate = float(np.mean(signatures[i] == signatures[j]))
+        if estimate >= threshold:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+            similarity[j] = max(similarity.get(j, 0.0), estimate)
+
+    for idx in sorted(similarity):
+        root = find(idx)
+        if root != idx:
+            yield filelist[root], filelist[idx], round(similarity[idx], 2)
+
+    if verbose == 1:
+        logger.info('  ...elapsed time: {}'.format(datetime.now().replace(microsecond=0) - start_time))
+
+def batch_fingerprint(filelist, threshold=0.9, minhash=True, verbose=1):
+    """
+    Batch fingerprint:
+    Run the exact screen, then (optionally) the MinHash screen on the survivors.
+    Yield result rows in the corpus_compare.py csv format:
+        identical, tf-idf, sequence, jaccard, file1, file2, str1, str2
+    """
+    duplicates = set()
+    for original, duplicate, normstr in batch_exact_fingerprints(filelist, verbose):
+        duplicates.add(duplicate)
+        yield [True, '', '', 1.0, original, duplicate, str_sampler(normstr)[0], '']  ## No second string because they are identical -- easier to read.
+
+    remaining = [fname for fname in filelist if fname not in duplicates]
+    if minhash and len(remaining) > 1:
+        for original, duplicate, similarity in batch_minhash_fingerprints(remaining, threshold, verbose=verbose):
+            yield [False, '', '', similarity, original, duplicate,
+                   str_sampler(' '.join(fname_to_rawstr(original).split()))[0],
+                   str_sampler(' '.join(fname_to_rawstr(duplicate).split()))[0]]
+
+def main_logging():
+    """
+    Configure global logger.
+    """
+    logger.setLevel(logging.INFO)
+    logger.propagate = 0
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(console_handler)
+
+def main(args):
+    """
+    Fingerprint all input paths as one batch, write the csv and optionally delete duplicates.
+    Returns the number of duplicates found.
+    """
+    main_logging()
+    logger.info('\n###  fingerprint.py  ###')
+    start_time = datetime.now().replace(microsecond=0)
+
+    filelist = fpaths_to_fnamelist(args.inputpaths, args.filepattern, 1)[0][1]
+    logger.info('  {} {} files found'.format(len(filelist), args.filepattern))
+
+    count_hits = 0
+    with open(args.outputfile, 'w') as csvfile:
+        resultwriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        resultwriter.writerow(['identical', 'tf-idf', 'sequence', 'jaccard', 'file1', 'file2', 'str1', 'str2', datetime.now()])
+        for row in batch_fingerprint(filelist, args.threshold, args.minhash):
+            count_hits += 1
+            resultwriter.writerow(row)
+            logger.info('  {0:<6} {1:30} {2} '.format(row[3], os.path.basename(row[4]), os.path.basename(row[5])))
+            if args.delete:
+                os.remove(row[5])
+
+    logger.info('\n' + 'Done.')
+    logger.info('Total: {} duplicates of {} files{}'.format(count_hits, len(filelist), ' (deleted)' if args.delete else ''))
+    logger.info('Elapsed time: {}'.format(datetime.now().replace(microsecond=0) - start_time))
+    logger.info('Output in: {}\n'.format(args.outputfile))
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    return count_hits
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    ## COMMAND LINE ARGUMENT PARSING
+
+    PARSER = argparse.ArgumentParser(description='Fast duplicate file screen. Hashes normalized raw text (and optionally MinHash signatures) to find exact and near duplicates in linear time, writing a corpus_compare.py format csv. Intended to run before scrubbing and tf-idf comparison.', epilog='EXAMPLE:\n  fingerprint.py -i ./caches/json/ -f "*.json" -t 0.9 -m -d -o ./fingerprint.csv\n \n', formatter_class=RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--inputpaths', nargs='*', default=['./'], help='input source paths for files to compare, default is current directory')
+    PARSER.add_argument('-f', '--filepattern', default="*.json", help='input source pattern for files to compare')
+    PARSER.add_argument('-o', '--outputfile', default='./fingerprint.csv', help='results output file')
+    PARSER.add_argument('-t', '--threshold', type=float, default=0.90, help='estimated jaccard threshold for near duplicates')
+    PARSER.add_argument('-m', '--minhash', action='store_true', help='also screen for near duplicates with minhash')
+    PARSER.add_argument('-d', '--delete', action='store_true', help='delete duplicates')
+
+    CL_ARGS = PARSER.parse_args()
+
+    main(CL_ARGS)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+article_pack.py
+Store the project's articles in one compressed, indexed pack for the browser.
+
+The browser's document view links to each article as json/<filename>, the id
+in metadata-dfrb.csv. Instead of copying every file of caches/json into
+browser/json, the articles are written once to a pack:
+
+    1. each article is gzip compressed; identical articles are stored once;
+    2. <key>.pack holds the compressed articles end to end, and <key>.json
+       maps every file name to the offset and length of its article;
+    3. <key> is a hash of the names and contents, so the same articles give
+       the same pack: the store (dfb_articles in settings.py; by default
+       article-packs next to the workspace's projects_dir) holds one pack for
+       all the projects built from the same data, and a pack is only built
+       once.
+
+link_articles() writes the articles of a pack out once, read-only, to
+<key>.files in the store, and hard-links them into browser/json, so any
+static web server (and browser.zip) finds json/<filename> without a copy per
+project. link_pack() instead puts only the pack and index into browser/json,
+as articles.pack and articles.json; scripts/server/data_server.py answers
+requests for json/<filename> from them (gzip encoded, without decompressing).
+
+v1.0 first version: content-addressed article packs
+v1.1 articles hard-linked as files by default; workspace store
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+try:
+    from scripts.scrub.source_cache import workspace_cache_dir
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scrub'))
+    from source_cache import workspace_cache_dir
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.1"
+
+## DEFAULTS
+
+store_name      = 'article-packs'     ## folder next to the workspace's projects_dir
+store_dir       = 'caches/articles'   ## outside a workspace
+pack_name       = 'articles'
+compress_level  = 6
+
+
+## BUILDING
+
+def default_store(setting='auto'):
+    """Return the pack store for dfb_articles: 'auto' is the workspace store, else store_dir outside a workspace."""
+    if setting != 'auto':
+        return setting
+    return workspace_cache_dir(name=store_name) or store_dir
+
+
+def iter_articles(json_dir):
+    """Yield (name, path) for the .json files of a directory, by name."""
+    for name in sorted(entry.name for entry in os.scandir(json_dir) if entry.is_file() and entry.name.endswith('.json')):
+        yield name, os.path.join(json_dir, name)
+
+
+def pack_key(digests):
+    """Return the key of a pack from its (name, content digest) pairs."""
+    key = hashlib.sha1()
+    for name, digest in digests:
+        key.update(u'{}\t{}\n'.format(name, digest).encode('utf-8'))
+    return key.hexdigest()
+
+
+def build_pack(json_dir, store=None, verbose=True):
+    """Write the articles of json_dir to a pack in store, unless it exists.
+
+    Args:
+        json_dir (str): directory of article files (caches/json).
+        store (str): pack store directory, possibly shared by projects;
+            defaults to default_store().
+        verbose (bool): print progress.
+    Returns:
+        str: path of the pack, without extension.
+    """
+    store = store or default_store()
+    paths, digests = [], []
+    for name, path in iter_articles(json_dir):
+        with open(path, 'rb') as article:
+            digests.append((name, hashlib.sha1(article.read()).hexdigest()))
+        paths.append(path)
+    key = pack_key(digests)
+    base = os.path.join(store, key)
+    if os.path.isfile(base + '.json'):
+        if verbose:
+            print('Using article pack {} ({} articles)'.format(base, len(digests)))
+        return base
+
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    tmp = '{}.{}.tmp'.format(base, os.getpid())
+    blobs, names = {}, {}
+    with open(tmp + '.pack', 'wb') as pack:
+        for (name, digest), path in zip(digests, paths):
+            if digest not in blobs:
+                with open(path, 'rb') as article:
+                    data = gzip.compress(article.read(), compress_level, mtime=0)
+                blobs[digest] = [pack.tell(), len(data)]
+                pack.write(data)
+            names[name] = blobs[digest]
+    with io.open(tmp + '.json', 'w', encoding='utf-8') as index:
+        index.write(json.dumps({'key': key, 'encoding': 'gzip', 'articles': names}, separators=(',', ':'), ensure_ascii=False))
+    ## the index is moved last: its presence marks a complete pack
+    os.replace(tmp + '.pack', base + '.pack')
+    os.replace(tmp + '.json', base + '.json')
+    if verbose:
+        print('Wrote article pack {}: {} articles, {} unique, {:,} bytes'.format(
+            base, len(names), len(blobs), os.path.getsize(base + '.pack')))
+    return base
+
+
+def link_file(source, target):
+    """Hard-link source to target, copying if a link is not possible."""
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def link_pack(base, out_dir):
+    """Put a pack into a browser directory (e.g. browser/json) as articles.pack and articles.json."""
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    for ext in ('.pack', '.json'):
+        link_file(base + ext, os.path.join(out_dir, pack_name + ext))
+
+
+def unpack_pack(base):
+    """Write the articles of a pack out once, as read-only files in <base>.files next to it.
+
+    Returns:
+        str: the folder of article files.
+    """
+    files_dir = base + '.files'
+    if os.path.isdir(files_dir):
+        return files_dir
+    build_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(files_dir) + '-', dir=os.path.dirname(base) or '.')
+    try:
+        unpack_articles(base, build_dir)
+        for name in os.listdir(build_dir):
+            os.chmod(os.path.join(build_dir, name), 0o444)
+        os.chmod(build_dir, 0o755)
+        os.rename(build_dir, files_dir)
+    except OSError:
+        ## another project unpacked the same pack first
+        shutil.rmtree(build_dir, ignore_errors=True)
+        if not os.path.isdir(files_dir):
+            raise
+    return files_dir
+
+
+def link_articles(base, out_dir):
+    """Hard-link the articles of a pack into a browser directory (e.g. browser/json) as files, for any web server.
+
+    Returns:
+        int: number of articles linked.
+    """
+    files_dir = unpack_pack(base)
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    names = os.listdir(files_dir)
+    for name in names:
+        link_file(os.path.join(files_dir, name), os.path.join(out_dir, name))
+    return len(names)
+
+
+def unpack_articles(pack_dir, out_dir=None):
+    """Write the articles of a pack (a directory holding one, or its path without extension) out as files.
+
+    Returns:
+        int: number of articles written.
+    """
+    pack = ArticlePack(pack_dir)
+    out_dir = out_dir or pack_dir
+    for name in pack.names():
+        with open(os.path.join(out_dir, name), 'wb') as article:
+            article.write(pack.get(name))
+    pack.close()
+    return len(pack.names())
+
+
+## READING
+
+class ArticlePack:
+    """Read the articles of a pack.
+
+    Args:
+        path (str): a directory holding articles.pack and articles.json, or
+            the path of a pack without its extension.
+    """
+
+    def __init__(self, path):
+        base = os.path.join(path, pack_name) if os.path.isdir(path) else path
+        with io.open(base + '.json', 'r', encoding='utf-8') as index:
+            meta = json.load(index)
+        self.key = meta['key']
+        self.articles = meta['articles']
+        self.pack_file = base + '.pack'
+        self.pack = open(self.pack_file, 'rb')
+
+    def names(self):
+        """Return the article names, by name."""
+        return sorted(self.articles)
+
+    def raw(self, name):
+        """Return the gzip compressed article, or None if it is not in the pack."""
+        if name not in self.articles:
+            return None
+        offset, length = self.articles[name]
+        return os.pread(self.pack.fileno(), length, offset)
+
+    def get(self, name):
+        """Return the article as bytes, or None if it is not in the pack."""
+        data = self.raw(name)
+        return gzip.decompress(data) if data is not None else None
+
+    def close(self):
+        """Close the pack file."""
+        self.pack.close()
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Pack the articles of a project into a shared, compressed article store and link it into the browser.', epilog='EXAMPLE:\n  article_pack.py -i caches/json -o browser/json\n  article_pack.py -i caches/json -o browser/json --pack-only\n  article_pack.py --unpack -o browser/json\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/json', help='directory of article files')
+    PARSER.add_argument('-s', '--store', default=None, help='pack store directory (default: article-packs next to the workspace projects_dir)')
+    PARSER.add_argument('-o', '--output', default='browser/json', help='browser article directory')
+    PARSER.add_argument('--pack-only', action='store_true', help='link only the pack, for scripts/server/data_server.py')
+    PARSER.add_argument('--unpack', action='store_true', help='write the articles of the linked pack out as files')
+
+    CL_ARGS = PARSER.parse_args()
+
+    if CL_ARGS.unpack:
+        print('Wrote {} articles to {}'.format(unpack_articles(CL_ARGS.output), CL_ARGS.output))
+    elif CL_ARGS.pack_only:
+        link_pack(build_pack(CL_ARGS.input, CL_ARGS.store), CL_ARGS.output)
+    else:
+        print('Linked {} articles into {}'.format(link_articles(build_pack(CL_ARGS.input, CL_ARGS.store), CL_ARGS.output), CL_ARGS.output))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+browser_bundle.py
+Bundle a browser into a single HTML file that opens without a web server.
+
+dfr-browser and topic bubbles both look for their data files in the page
+before fetching them: load_data reads an element with the id m__DATA__<name>
+(e.g. m__DATA__tw for data/tw.json), holding the file's text as a JSON
+string. This module writes one self-contained HTML file from a site folder:
+
+    1. the page's local scripts, stylesheets and images are inlined;
+    2. the data files (info.json, meta.csv.zip, dt.json.zip, tw.json,
+       topic_scaled.csv, clouds.json) are compacted -- JSON without
+       whitespace, topic coordinates rounded to 5 significant digits --
+       and embedded;
+    3. if the page loads JSZip (both browsers do), each data file is
+       embedded as a base64 zip and a small script expands it into its
+       m__DATA__ element as the page loads, so the file is a fraction of
+       the size of the browser folder; otherwise the text is embedded as is.
+
+The article files (browser/json) are not included: the bundle is for viewing
+the model offline.
+
+v1.0 first version: single-file browser bundles
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import base64
+import io
+import json
+import mimetypes
+import os
+import re
+import zipfile
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+data_files      = ('info.json', 'meta.csv.zip', 'dt.json.zip', 'tw.json', 'topic_scaled.csv', 'clouds.json')
+scaled_digits   = 5
+script_re       = re.compile(r'<script([^>]*?)\ssrc=["\']([^"\']+)["\']([^>]*)>\s*</script>', re.I)
+stylesheet_re   = re.compile(r'<link[^>]*?rel=["\']stylesheet["\'][^>]*>', re.I)
+href_re         = re.compile(r'href=["\']([^"\']+)["\']', re.I)
+image_re        = re.compile(r'(<img[^>]*?\ssrc=)(["\'])([^"\']+)\2', re.I)
+## expands the zipped data elements into the m__DATA__ elements load_data reads
+unzip_script    = ('<script>(function(){var z=document.querySelectorAll("script[id^=z__DATA__]");'
+                   'for(var k=0;k<z.length;k++){var e=z[k],f=new JSZip(e.textContent,{base64:true}),'
+                   'n=Object.keys(f.files)[0],d=document.createElement("script");d.type="application/json";'
+                   'd.id=e.id.replace("z__","m__");d.textContent=JSON.stringify(f.file(n).asText());'
+                   'e.parentNode.insertBefore(d,e);}})();</script>')
+
+
+## DATA
+
+def read_data_file(path):
+    """Return the text of a data file, unzipping .zip files."""
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as zfile:
+            return zfile.read(zfile.namelist()[0]).decode('utf-8')
+    with io.open(path, 'r', encoding='utf-8') as fin:
+        return fin.read()
+
+
+def compact(name, text):
+    """Return the compacted text of a data file."""
+    if name.endswith('.json') or name.endswith('.json.zip'):
+        return json.dumps(json.loads(text), separators=(',', ':'), ensure_ascii=False)
+    if name == 'topic_scaled.csv':
+        return ''.join(','.join(round_value(value) for value in line.split(',')) + '\n'
+                       for line in text.splitlines() if line.strip())
+    return text
+
+
+def element_id(name):
+    """Return the m__DATA__ name load_data looks for (the file name before its first dot)."""
+    return name.split('.')[0]
+
+
+def round_value(value):
+    """Round a number to scaled_digits significant digits; leave anything else as is."""
+    try:
+        return '{:.{}g}'.format(float(value), scaled_digits)
+    except ValueError:
+        return value
+
+
+def script_text(text, tag='script'):
+    """Escape the closing tags that would end a <script> (or <style>) element early."""
+    return re.sub(r'</({})'.format(tag), r'<\\/\1', text, flags=re.I)
+
+
+def data_elements(data_dir, zipped=True):
+    """Return the HTML elements embedding the data files of data_dir."""
+    elements = []
+    for name in data_files:
+        path = os.path.join(data_dir, name)
+        if not os.path.isfile(path):
+            continue
+        text = compact(name, read_data_file(path))
+        if zipped:
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zfile:
+                zfile.writestr(name.replace('.zip', ''), text.encode('utf-8'))
+            elements.append('<script type="text/plain" id="z__DATA__{}">{}</script>'.format(
+                element_id(name), base64.b64encode(buf.getvalue()).decode('ascii')))
+        else:
+            elements.append('<script type="application/json" id="m__DATA__{}">{}</script>'.format(
+                element_id(name), script_text(json.dumps(text, ensure_ascii=False))))
+    return '\n'.join(elements)
+
+
+## PAGE
+
+def local_file(site_dir, ref):
+    """Return the file a relative reference points to, or None for external ones."""
+    if re.match(r'^([a-z]+:|//|data:)', ref, re.I):
+        return None
+    path = os.path.join(site_dir, ref.split('?')[0].split('#')[0])
+    return path if os.path.isfile(path) else None
+
+
+def inline_assets(html, site_dir):
+    """Inline the local scripts, stylesheets and images of a page."""
+    def script(match):
+        path = local_file(site_dir, match.group(2))
+        if not path:
+            return match.group(0)
+        with io.open(path, 'r', encoding='utf-8') as fin:
+            return '<script{}{}>{}</script>'.format(match.group(1), match.group(3), script_text(fin.read()))
+
+    def stylesheet(match):
+        href = href_re.search(match.group(0))
+        path = local_file(site_dir, href.group(1)) if href else None
+        if not path:
+            return match.group(0)
+        with io.open(path, 'r', encoding='utf-8') as fin:
+            return '<style>{}</style>'.format(script_text(fin.read(), 'style'))
+
+    def image(match):
+        path = local_file(site_dir, match.group(3))
+        if not path:
+            return match.group(0)
+        with open(path, 'rb') as fin:
+            uri = 'data:{};base64,{}'.format(mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                                             base64.b64encode(fin.read()).decode('ascii'))
+        return '{}{}{}{}'.format(match.group(1), match.group(2), uri, match.group(2))
+
+    html = script_re.sub(script, html)
+    html = stylesheet_re.sub(stylesheet, html)
+    return image_re.sub(image, html)
+
+
+def bundle(site_dir, out_file, data_dir=None):
+    """Write a browser site as a single HTML file.
+
+    Args:
+        site_dir (str): site folder holding index.html (e.g. browser or
+            scripts/topic-bubbles).
+        out_file (str): HTML file to write.
+        data_dir (str): data folder; defaults to site_dir/data.
+    Returns:
+        int: size of the file written, in bytes.
+    """
+    data_dir = data_dir or os.path.join(site_dir, 'data')
+    with io.open(os.path.join(site_dir, 'index.html'), 'r', encoding='utf-8') as fin:
+        html = fin.read()
+    jszip = next((match for match in script_re.finditer(html) if 'jszip' in match.group(2).lower()), None)
+    if jszip:
+        ## the data and the script that expands it go right after JSZip
+        html = html[:jszip.end()] + '\n' + data_elements(data_dir, True) + '\n' + unzip_script + html[jszip.end():]
+    else:
+        head_end = html.lower().find('</head>')
+        html = html[:head_end] + data_elements(data_dir, False) + '\n' + html[head_end:]
+    html = inline_assets(html, site_dir)
+    with io.open(out_file + '.tmp', 'w', encoding='utf-8') as out:
+        out.write(html)
+    os.replace(out_file + '.tmp', out_file)
+    return os.path.getsize(out_file)
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Bundle a dfr-browser or topic bubbles site and its data into one HTML file.', epilog='EXAMPLE:\n  browser_bundle.py -s browser -o browser.html\n  browser_bundle.py -s scripts/topic-bubbles -d browser/data -o topic-bubbles.html\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-s', '--site', default='browser', help='site folder holding index.html')
+    PARSER.add_argument('-d', '--data', default=None, help='data folder (default: <site>/data)')
+    PARSER.add_argument('-o', '--output', default='browser.html', help='HTML file to write')
+
+    CL_ARGS = PARSER.parse_args()
+
+    print('Wrote {} ({:,} bytes)'.format(CL_ARGS.output, bundle(CL_ARGS.site, CL_ARGS.output, CL_ARGS.data)))
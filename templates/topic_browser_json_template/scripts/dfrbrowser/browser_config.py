@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+browser_config.py
+Keep browser customizations in a small overlay file.
+
+5_customize_browser.ipynb used to rewrite browser/data/info.json and run a
+regular expression over the minified dfb.min.js to set the label size. The
+customizations (title, about text, topic labels, sizes, VIS settings) are now
+kept in an overlay file (dfb_overlay in settings.py, browser-config.json):
+
+    1. update_overlay() merges changes into the overlay, writing it only if
+       something changed;
+    2. the overlay is merged into info.json when the browser is exported
+       (apply_overlay, called by browser_export.py) or served
+       (scripts/server/data_server.py merges it on each request); the
+       exported info.json is kept as info-base.json, and the overlay is
+       always merged onto it, never onto an info.json that already holds an
+       earlier overlay;
+    3. dfr-browser merges info.json's "VIS" into its defaults on load, so
+       settings such as VIS.model_view.plot.name_size (the label size) take
+       effect without editing dfb.min.js.
+
+Dicts are merged key by key and other values replaced, as dfr-browser's
+VIS.update does, except the keys the notebook sets as a whole (topic_labels,
+contributors, VIS.model_view.plot), which are replaced, so a label removed
+from the notebook is removed from the browser.
+
+v1.0 first version: overlay file merged into info.json
+v1.1 notebook keys replaced, not merged; overlay merged onto the exported info
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import copy
+import io
+import json
+import os
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.1"
+
+## DEFAULTS
+
+overlay_file    = 'browser-config.json'
+base_info_file  = 'info-base.json'  ## info.json as exported, without the overlay
+replaced_keys   = ('topic_labels', 'contributors', 'VIS.model_view.plot')
+
+
+## MERGING
+
+def deep_merge(base, overlay, replace=replaced_keys, prefix=''):
+    """Return base with overlay merged in: dicts key by key, other values replaced.
+
+    Args:
+        replace (tuple): dotted paths (e.g. 'VIS.model_view.plot') replaced
+            as a whole rather than merged.
+    """
+    merged = copy.deepcopy(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict) and prefix + key not in replace:
+            merged[key] = deep_merge(merged[key], value, replace, prefix + key + '.')
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def read_json(path):
+    """Return the contents of a JSON file, or {} if it does not exist."""
+    if not path or not os.path.isfile(path):
+        return {}
+    with io.open(path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def write_json(path, obj):
+    """Write a JSON file atomically, unless it already holds obj.
+
+    Returns:
+        bool: True if the file was written.
+    """
+    if os.path.isfile(path) and read_json(path) == obj:
+        return False
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as out:
+        out.write(json.dumps(obj, indent=2, ensure_ascii=False))
+    os.replace(path + '.tmp', path)
+    return True
+
+
+## OVERLAY
+
+def update_overlay(changes, path=overlay_file):
+    """Merge changes into the overlay file.
+
+    Returns:
+        dict: the overlay.
+    """
+    overlay = deep_merge(read_json(path), changes)
+    write_json(path, overlay)
+    return overlay
+
+
+def merged_info(info_file, path=overlay_file):
+    """Return the exported info.json (info-base.json next to it, if any) with the overlay merged in."""
+    base_file = os.path.join(os.path.dirname(info_file), base_info_file)
+    return deep_merge(read_json(base_file if os.path.isfile(base_file) else info_file), read_json(path))
+
+
+def apply_overlay(data_dir, path=overlay_file, exported=False):
+    """Merge the overlay into a browser's info.json.
+
+    Args:
+        exported (bool): info.json was just exported; keep it as info-base.json.
+    Returns:
+        bool: True if info.json changed.
+    """
+    info_file = os.path.join(data_dir, 'info.json')
+    base_file = os.path.join(data_dir, base_info_file)
+    if exported or not os.path.isfile(base_file):
+        write_json(base_file, read_json(info_file))
+    return write_json(info_file, merged_info(info_file, path))
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Merge the browser overlay file into info.json.', epilog='EXAMPLE:\n  browser_config.py -c browser-config.json -d browser/data\n  browser_config.py -c browser-config.json --set \'{"title": "My model"}\'\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-c', '--config', default=overlay_file, help='overlay file')
+    PARSER.add_argument('-d', '--data', default='browser/data', help='browser data directory')
+    PARSER.add_argument('--set', default=None, help='JSON object to merge into the overlay first')
+
+    CL_ARGS = PARSER.parse_args()
+
+    if CL_ARGS.set:
+        update_overlay(json.loads(CL_ARGS.set), CL_ARGS.config)
+    print('info.json updated' if apply_overlay(CL_ARGS.data, CL_ARGS.config) else 'info.json unchanged')
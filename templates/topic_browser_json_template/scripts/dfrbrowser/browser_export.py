@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+"""
+browser_export.py
+Write dfr-browser data files directly from a MALLET model.
+
+Replaces the R round trip through dfrtopics (load_from_mallet_state and
+export_browser_data), producing the same files in browser/data:
+
+    info.json           browser title, about text and VIS settings (kept if present)
+    meta.csv.zip        headerless document metadata, one row per model document
+    dt.json.zip         sparse document-topic counts, column-compressed: {i, p, x}
+    tw.json             alpha and the top words and weights of every topic
+    clouds.json         the word cloud layout of every topic, for topic bubbles
+                        (word_clouds.py)
+    topic_scaled.csv    2-D scaling of the topics by Jensen-Shannon divergence
+                        (scripts/mallet/topic_layout.py, shared with pyLDAvis)
+    shards/             optional: per-topic document pages, yearly totals and
+                        metadata chunks, listed in info.json (browser_shards.py)
+    aggregates/         topic token counts by year, month and publication, for
+                        the condition view (topic_aggregates.py)
+
+Counts come from the cached model artifacts (scripts/mallet/model_cache.py),
+so the state file is parsed at most once and no JVM, R or python2 is needed.
+Document order follows MALLET's instance order; when composition.txt is
+available its file names (e.g. 0012_.txt) are used to line up metadata rows.
+
+v1.0 first version: Python replacement for dfrtopics export_browser_data
+v1.1 topic scaling from the cached topic_layout.py layout
+v1.2 document names from the composition_reader.py cache
+v1.3 optional sharded data for large models (browser_shards.py)
+v1.4 topic totals by year, month and publication (topic_aggregates.py)
+v1.5 customizations merged into info.json from the overlay file (browser_config.py)
+v1.6 precomputed topic bubbles word clouds (word_clouds.py)
+v1.7 info.json exported again from info-base.json, without the customizations merged into it
+v1.8 document count from composition.txt, counting empty documents at the end
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import zipfile
+
+import numpy as np
+try:
+    from scripts.mallet.model_cache import load_model
+    from scripts.mallet.topic_layout import load_layout
+    from scripts.mallet.composition_reader import load_composition, pad_model
+    from scripts.dfrbrowser.browser_shards import export_shards
+    from scripts.dfrbrowser.topic_aggregates import export_aggregates
+    from scripts.dfrbrowser.browser_config import apply_overlay, base_info_file
+    from scripts.dfrbrowser.word_clouds import export_clouds
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mallet'))
+    from model_cache import load_model
+    from topic_layout import load_layout
+    from composition_reader import load_composition, pad_model
+    from browser_shards import export_shards
+    from topic_aggregates import export_aggregates
+    from browser_config import apply_overlay, base_info_file
+    from word_clouds import export_clouds
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+n_top_words       = 50
+n_scaled_words    = None  ## None compares all words, sharing pyLDAvis's layout
+layout_algorithm  = 'pcoa'
+default_info      = {
+    'title': 'Model browser',
+    'meta_info': '<h2>About this Model</h2>',
+    'VIS': {}
+}
+## dfr-browser's index.html, css, js and lib files, as installed with dfrtopics
+supporting_files_dir = '/opt/conda/lib/R/library/dfrtopics/dfr-browser'
+
+
+## METADATA
+
+def read_metadata(metadata_file):
+    """Read a dfr-browser metadata csv (e.g. metadata-dfrb.csv), dropping its header.
+
+    Returns:
+        list: metadata rows (lists of str).
+    """
+    csv.field_size_limit(100000000)
+    with io.open(metadata_file, 'r', encoding='utf-8', newline='') as fin:
+        rows = list(csv.reader(fin))
+    return rows[1:]
+
+
+def doc_order_from_composition(composition_file, num_docs):
+    """Map model documents to metadata rows using the names in composition.txt.
+
+    Text files are named by the metadata row they were written from (e.g.
+    0012_.txt is row 12), so the numeric prefix of each document name gives
+    its metadata row. The names are read from the composition cache
+    (scripts/mallet/composition_reader.py).
+
+    Args:
+        composition_file (str): MALLET --output-doc-topics file.
+        num_docs (int): number of documents in the model.
+    Returns:
+        ndarray: metadata row for each model document, or None if the names
+            cannot be read.
+    """
+    if not composition_file or not os.path.isfile(composition_file):
+        return None
+    order = []
+    for name in load_composition(composition_file).names:
+        match = re.match(r'([0-9]+)_', os.path.basename(name))
+        if not match:
+            return None
+        order.append(int(match.group(1)))
+    if len(order) != num_docs:
+        return None
+    return np.array(order)
+
+
+## FILES
+
+def write_zip(zip_path, member, text):
+    """Write text as the single member of a new zip file."""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zfile:
+        zfile.writestr(member, text.encode('utf-8'))
+
+
+def export_meta(rows, out_dir, doc_order=None):
+    """Write meta.csv.zip: headerless metadata rows in model document order.
+
+    Args:
+        rows (list): metadata rows.
+        out_dir (str): browser data directory.
+        doc_order (array): metadata row for each model document; defaults to
+            the rows in their given order.
+    """
+    if doc_order is not None:
+        rows = [rows[idx] for idx in doc_order]
+    text = io.StringIO()
+    csv.writer(text, lineterminator='\n').writerows(rows)
+    write_zip(os.path.join(out_dir, 'meta.csv.zip'), 'meta.csv', text.getvalue())
+
+
+def export_dt(doc_topic_counts, out_dir):
+    """Write dt.json.zip: document-topic counts as a column-compressed sparse matrix.
+
+    i holds document indices, p the start of each topic's entries in i and x,
+    and x the token counts.
+    """
+    dt = doc_topic_counts.tocsc()
+    dt.sort_indices()
+    text = json.dumps({'i': dt.indices.tolist(), 'p': dt.indptr.tolist(), 'x': dt.data.tolist()},
+                      separators=(',', ':'))
+    write_zip(os.path.join(out_dir, 'dt.json.zip'), 'dt.json', text)
+
+
+def top_words(topic_term_counts, vocab, n_words=n_top_words):
+    """Return the n most frequent words of every topic, with their counts.
+
+    Uses a partial sort of each topic row, so the cost is linear in the
+    number of nonzero counts rather than the vocabulary size.
+
+    Returns:
+        list: one {'words': [...], 'weights': [...]} dict per topic.
+    """
+    counts = topic_term_counts.tocsr()
+    topics = []
+    for topic in range(counts.shape[0]):
+        start, stop = counts.indptr[topic], counts.indptr[topic+1]
+        cols, weights = counts.indices[start:stop], counts.data[start:stop]
+        if len(weights) > n_words:
+            keep = np.argpartition(-weights, n_words - 1)[:n_words]
+            cols, weights = cols[keep], weights[keep]
+        order = np.lexsort((cols, -weights))
+        topics.append({'words': [vocab[col] for col in cols[order]],
+                       'weights': weights[order].tolist()})
+    return topics
+
+
+def export_tw(model, out_dir, n_words=n_top_words):
+    """Write tw.json: alpha and the top words of every topic."""
+    with io.open(os.path.join(out_dir, 'tw.json'), 'w', encoding='utf-8') as tw_file:
+        tw_file.write(json.dumps({'alpha': model.alpha, 'tw': top_words(model.topic_term_counts, model.vocab, n_words)},
+                                 ensure_ascii=False))
+
+
+def topic_scaling(model, n_words=n_scaled_words, algorithm=layout_algorithm):
+    """Scale the topics into 2-D by the divergence of their word distributions.
+
+    The layout comes from topic_layout.py and is cached with the model, so it
+    is computed once and shared with pyLDAvis. By default the full topic-term
+    distributions are compared; set n_words (e.g. 1000) to compare only the
+    most frequent words, as dfrtopics does.
+
+    Returns:
+        ndarray: (topics x 2) coordinates.
+    """
+    return load_layout(model, algorithm, n_words)
+
+
+def export_topic_scaled(model, out_dir, n_words=n_scaled_words, algorithm=layout_algorithm):
+    """Write topic_scaled.csv: one x,y row per topic."""
+    with open(os.path.join(out_dir, 'topic_scaled.csv'), 'w') as scaled_file:
+        for x, y in topic_scaling(model, n_words, algorithm):
+            scaled_file.write('{!r},{!r}\n'.format(float(x), float(y)))
+
+
+def export_info(out_dir, info=None, overwrite=False):
+    """Write info.json, keeping an existing file unless overwrite is set.
+
+    An existing info.json is restored from info-base.json, as it was exported
+    before the customizations were merged in (browser_config.py).
+    """
+    info_path = os.path.join(out_dir, 'info.json')
+    base_path = os.path.join(out_dir, base_info_file)
+    if os.path.isfile(base_path) and not overwrite:
+        shutil.copyfile(base_path, info_path)
+        return
+    if os.path.isfile(info_path) and not overwrite:
+        return
+    with open(info_path, 'w') as info_file:
+        info_file.write(json.dumps(info or default_info, indent=2))
+
+
+def copy_supporting_files(out_dir, source_dir=supporting_files_dir):
+    """Copy the dfr-browser site (index.html, css, js, lib, bin) into out_dir.
+
+    Returns:
+        bool: True if the files were copied.
+    """
+    if not source_dir or not os.path.isdir(source_dir):
+        return False
+    for name in os.listdir(source_dir):
+        if name == 'data':
+            continue
+        source = os.path.join(source_dir, name)
+        target = os.path.join(out_dir, name)
+        if os.path.isdir(source):
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            shutil.copytree(source, target)
+        else:
+            shutil.copy2(source, target)
+    return True
+
+
+## MAIN
+
+def export_browser_data(statefile, metadata_file, out_dir='browser', composition_file=None,
+                        supporting_files=supporting_files_dir, n_words=n_top_words,
+                        scaled_words=n_scaled_words, info=None, model=None, verbose=True,
+                        layout=layout_algorithm, shards=False, overlay=None):
+    """Write a dfr-browser site (or just its data) for a MALLET model.
+
+    Args:
+        statefile (str): MALLET topic-state.gz file.
+        metadata_file (str): metadata csv with a header row, one row per document.
+        out_dir (str): browser directory; data files go to out_dir/data.
+        composition_file (str): optional composition.txt used to align metadata.
+        supporting_files (str): dfr-browser source directory to copy, or None.
+        n_words (int): top words per topic in tw.json.
+        scaled_words (int): words compared when scaling topics; None for all.
+        info (dict): contents for a new info.json.
+        model (Model): already loaded model artifacts, instead of statefile.
+        verbose (bool): print progress.
+        layout (str): topic scaling algorithm: 'pcoa', 'mmds' or 'tsne'.
+        shards (bool): also write the sharded data of browser_shards.py and
+            its manifest in info.json.
+        overlay (str): browser customization file (browser_config.py) to
+            merge into info.json.
+    Returns:
+        str: the data directory.
+    """
+    def log(msg):
+        if verbose:
+            print(msg)
+
+    data_dir = os.path.join(out_dir, 'data')
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    if supporting_files:
+        if copy_supporting_files(out_dir, supporting_files):
+            log('Copied dfr-browser files from ' + supporting_files)
+        else:
+            log('dfr-browser files not found at {} -- writing data files only.'.format(supporting_files))
+
+    if model is None:
+        log('Loading model...')
+        model = load_model(statefile, verbose=verbose)
+    ## the state file leaves out empty documents at the end; composition.txt lists them
+    model = pad_model(model, composition_file)
+    num_docs = len(model.doc_lengths)
+
+    log('Writing meta.csv.zip...')
+    rows = read_metadata(metadata_file)
+    doc_order = doc_order_from_composition(composition_file, num_docs)
+    if doc_order is None and len(rows) != num_docs:
+        raise ValueError('{} has {} rows but the model has {} documents.'.format(metadata_file, len(rows), num_docs))
+    if doc_order is not None:
+        rows = [rows[idx] for idx in doc_order]
+    export_meta(rows, data_dir)
+
+    log('Writing dt.json.zip...')
+    export_dt(model.doc_topic_counts, data_dir)
+    log('Writing tw.json...')
+    export_tw(model, data_dir, n_words)
+    log('Writing clouds.json...')
+    export_clouds(data_dir)
+    log('Writing topic_scaled.csv...')
+    export_topic_scaled(model, data_dir, scaled_words, layout)
+    export_info(data_dir, info)
+    log('Writing aggregates...')
+    export_aggregates(model, rows, data_dir)
+    if shards:
+        log('Writing shards...')
+        export_shards(model, rows, data_dir)
+    if overlay and os.path.isfile(overlay):
+        log('Applying customizations from ' + overlay)
+    apply_overlay(data_dir, overlay, exported=True)
+    log('Browser data written to ' + data_dir)
+    return data_dir
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Write dfr-browser data files (info.json, meta.csv.zip, dt.json.zip, tw.json, topic_scaled.csv) from a MALLET model without R.', epilog='EXAMPLE:\n  browser_export.py -s caches/model/topic-state.gz -m caches/metadata/metadata-dfrb.csv -c caches/model/composition.txt -o browser\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-s', '--state', default='caches/model/topic-state.gz', help='MALLET state file')
+    PARSER.add_argument('-m', '--metadata', default='caches/metadata/metadata-dfrb.csv', help='metadata csv, with header')
+    PARSER.add_argument('-c', '--composition', default='caches/model/composition.txt', help='MALLET doc-topics file, used to align metadata')
+    PARSER.add_argument('-o', '--output', default='browser', help='browser output directory')
+    PARSER.add_argument('-f', '--supporting-files', default=supporting_files_dir, help='dfr-browser source directory to copy')
+    PARSER.add_argument('-n', '--top-words', type=int, default=n_top_words, help='top words per topic')
+    PARSER.add_argument('-l', '--layout', default=layout_algorithm, help="topic scaling algorithm: 'pcoa', 'mmds' or 'tsne'")
+    PARSER.add_argument('--shards', action='store_true', help='also write sharded data for large models')
+    PARSER.add_argument('--overlay', default=None, help='browser customization file to merge into info.json')
+
+    CL_ARGS = PARSER.parse_args()
+
+    export_browser_data(CL_ARGS.state, CL_ARGS.metadata, CL_ARGS.output, CL_ARGS.composition,
+                        CL_ARGS.supporting_files, CL_ARGS.top_words, layout=CL_ARGS.layout, shards=CL_ARGS.shards, overlay=CL_ARGS.overlay)
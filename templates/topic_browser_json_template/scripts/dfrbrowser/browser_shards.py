@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+browser_shards.py
+Write the browser data in small shards that can be loaded on demand.
+
+dt.json.zip and meta.csv.zip hold every document of the model, and browsers
+that load them up front stall on large (100k+ document) models. This module
+writes the same data split by what a view needs, under browser/data/shards:
+
+    topics/<topic>-<page>.json  the documents of a topic and their token counts,
+                                by decreasing count, page_size documents a page:
+                                {"topic": 3, "page": 0, "docs": [...], "counts": [...]}
+    years.json                  token counts of every topic by year, and the number
+                                of documents of each year:
+                                {"years": [...], "docs": [...], "counts": [[...], ...]}
+    meta/<chunk>.csv            headerless metadata rows, chunk_size documents a
+                                chunk (document d is in chunk d // chunk_size)
+
+and records a manifest of the files under the "shards" key of info.json, so a
+browser can find the first page of a topic or the metadata of a document
+without loading anything else. The shards are plain JSON and CSV so they can
+be served compressed (scripts/server/data_server.py).
+
+v1.0 first version: topic pages, yearly aggregates and metadata chunks
+v1.1 yearly totals and info.json update from topic_aggregates.py
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+try:
+    from scripts.mallet.model_cache import load_model
+    from scripts.mallet.composition_reader import pad_model
+    from scripts.dfrbrowser.topic_aggregates import aggregate, doc_year, update_info
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mallet'))
+    from model_cache import load_model
+    from composition_reader import pad_model
+    from topic_aggregates import aggregate, doc_year, update_info
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+page_size       = 5000
+chunk_size      = 5000
+date_column     = 6     ## pubdate, in dfr-browser's metadata column order
+shards_dir      = 'shards'
+shards_version  = 1
+
+
+## SHARDS
+
+def dump_json(path, obj):
+    """Write compact JSON."""
+    with io.open(path, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(obj, separators=(',', ':'), ensure_ascii=False))
+
+
+def write_topic_pages(doc_topic_counts, out_dir, page_size=page_size):
+    """Write each topic's documents, by decreasing token count, in pages.
+
+    Returns:
+        list: number of pages of each topic.
+    """
+    dt = doc_topic_counts.tocsc()
+    os.makedirs(os.path.join(out_dir, 'topics'))
+    pages = []
+    for topic in range(dt.shape[1]):
+        start, stop = dt.indptr[topic], dt.indptr[topic+1]
+        docs, counts = dt.indices[start:stop], dt.data[start:stop]
+        order = np.lexsort((docs, -counts))
+        docs, counts = docs[order], counts[order]
+        num_pages = max(1, -(-len(docs) // page_size))
+        for page in range(num_pages):
+            part = slice(page * page_size, (page + 1) * page_size)
+            dump_json(os.path.join(out_dir, 'topics', '{}-{}.json'.format(topic, page)),
+                      {'topic': topic, 'page': page, 'docs': docs[part].tolist(), 'counts': counts[part].tolist()})
+        pages.append(num_pages)
+    return pages
+
+
+def write_meta_chunks(rows, out_dir, chunk_size=chunk_size):
+    """Write the metadata rows in headerless csv chunks.
+
+    Returns:
+        int: number of chunks.
+    """
+    os.makedirs(os.path.join(out_dir, 'meta'))
+    num_chunks = max(1, -(-len(rows) // chunk_size))
+    for chunk in range(num_chunks):
+        with io.open(os.path.join(out_dir, 'meta', '{}.csv'.format(chunk)), 'w', encoding='utf-8', newline='') as out:
+            csv.writer(out, lineterminator='\n').writerows(rows[chunk * chunk_size:(chunk + 1) * chunk_size])
+    return num_chunks
+
+
+def export_shards(model, rows, data_dir, page_size=page_size, chunk_size=chunk_size, date_column=date_column):
+    """Write the shards of a model and add their manifest to info.json.
+
+    The shards are written to a temporary directory and swapped in when
+    complete, so a browser never sees a partial set.
+
+    Args:
+        model (Model): loaded model artifacts (model_cache.load_model).
+        rows (list): metadata rows, one per model document, in model order.
+        data_dir (str): browser data directory.
+        page_size (int): documents per topic page.
+        chunk_size (int): documents per metadata chunk.
+        date_column (int): metadata column holding the publication date.
+    Returns:
+        dict: the manifest.
+    """
+    num_docs, num_topics = model.doc_topic_counts.shape
+    if len(rows) != num_docs:
+        raise ValueError('{} metadata rows for {} documents.'.format(len(rows), num_docs))
+    build_dir = tempfile.mkdtemp(prefix='.' + shards_dir + '-', dir=data_dir)
+    os.chmod(build_dir, 0o755)
+    try:
+        pages = write_topic_pages(model.doc_topic_counts, build_dir, page_size)
+        years = aggregate(model.doc_topic_counts, [doc_year(row[date_column]) if len(row) > date_column else None for row in rows])
+        dump_json(os.path.join(build_dir, 'years.json'), {'years': years.labels, 'docs': years.docs.tolist(), 'counts': years.counts.tolist()})
+        num_chunks = write_meta_chunks(rows, build_dir, chunk_size)
+        target = os.path.join(data_dir, shards_dir)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.rename(build_dir, target)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    manifest = {'version': shards_version, 'docs': num_docs, 'topics': num_topics,
+                'topic_pages': {'path': shards_dir + '/topics/{topic}-{page}.json', 'page_size': page_size, 'pages': pages},
+                'years': shards_dir + '/years.json',
+                'meta': {'path': shards_dir + '/meta/{chunk}.csv', 'chunk_size': chunk_size, 'chunks': num_chunks}}
+    update_info(data_dir, 'shards', manifest)
+    return manifest
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Write sharded browser data (topic pages, yearly totals, metadata chunks) and add the manifest to info.json.', epilog='EXAMPLE:\n  browser_shards.py -s caches/model/topic-state.gz -c caches/model/composition.txt -d browser/data\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-s', '--state', default='caches/model/topic-state.gz', help='MALLET state file')
+    PARSER.add_argument('-c', '--composition', default='caches/model/composition.txt', help='MALLET composition file, listing every document')
+    PARSER.add_argument('-d', '--data', default='browser/data', help='browser data directory, holding meta.csv.zip')
+    PARSER.add_argument('-p', '--page-size', type=int, default=page_size, help='documents per topic page')
+    PARSER.add_argument('-k', '--chunk-size', type=int, default=chunk_size, help='documents per metadata chunk')
+
+    CL_ARGS = PARSER.parse_args()
+
+    with zipfile.ZipFile(os.path.join(CL_ARGS.data, 'meta.csv.zip')) as ZFILE:
+        ROWS = list(csv.reader(io.StringIO(ZFILE.read('meta.csv').decode('utf-8'))))
+    MANIFEST = export_shards(pad_model(load_model(CL_ARGS.state, verbose=True), CL_ARGS.composition), ROWS, CL_ARGS.data, CL_ARGS.page_size, CL_ARGS.chunk_size)
+    print('Wrote {} topic pages and {} metadata chunks to {}'.format(
+        sum(MANIFEST['topic_pages']['pages']), MANIFEST['meta']['chunks'], os.path.join(CL_ARGS.data, shards_dir)))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+topic_aggregates.py
+Precompute topic totals by year, month and publication for the browsers.
+
+dfr-browser's "condition" view (info['VIS']['condition'], set in
+5_customize_browser.ipynb) plots each topic over time by summing the
+document-topic counts of every document in the browser. This module does the
+sums once, at export time, for three conditions:
+
+    year            from the pubdate column (e.g. 2016)
+    month           from the pubdate column (e.g. 2016-10)
+    publication     the journaltitle column
+
+and writes them to browser/data/aggregates:
+
+    <condition>.bin     topics x labels token counts, row-major little-endian
+                        uint32 (a Uint32Array in the browser)
+    index.json          for each condition: its labels, documents and tokens
+                        per label, the file and the array shape
+
+The index is also recorded under the "aggregates" key of info.json. The same
+files are loaded in notebooks with load_aggregates(), and topic_table()
+returns them as a pandas DataFrame of counts or proportions.
+
+v1.0 first version: year, month and publication aggregates
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+try:
+    from scripts.mallet.model_cache import load_model
+    from scripts.mallet.composition_reader import pad_model
+    from scripts.dfrbrowser.browser_config import base_info_file
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mallet'))
+    from model_cache import load_model
+    from composition_reader import pad_model
+    from browser_config import base_info_file
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+date_column         = 6     ## pubdate, in dfr-browser's metadata column order
+publication_column  = 3     ## journaltitle
+aggregates_dir      = 'aggregates'
+index_file          = 'index.json'
+
+## The totals of one condition: its labels, the number of documents and
+## tokens of each label, and the topics x labels token counts.
+Aggregate = namedtuple('Aggregate', ['labels', 'docs', 'tokens', 'counts'])
+
+
+## CONDITIONS
+
+def doc_year(value):
+    """Return the year of a date string (e.g. 2016-10-18), or None."""
+    match = re.search(r'(?<![0-9])([0-9]{4})(?![0-9])', value or '')
+    return int(match.group(1)) if match else None
+
+
+def doc_month(value):
+    """Return the month of an ISO date string (e.g. 2016-10-18) as '2016-10', or None."""
+    match = re.search(r'(?<![0-9])([0-9]{4})-([0-9]{1,2})(?![0-9])', value or '')
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        return None
+    return '{}-{:02d}'.format(match.group(1), int(match.group(2)))
+
+
+def doc_conditions(rows, date_column=date_column, publication_column=publication_column):
+    """Return the year, month and publication of every document.
+
+    Args:
+        rows (list): metadata rows, one per model document, in model order.
+    Returns:
+        dict: condition name -> list of labels, None where unknown.
+    """
+    def column(row, idx):
+        return row[idx] if len(row) > idx else ''
+    return {'year': [doc_year(column(row, date_column)) for row in rows],
+            'month': [doc_month(column(row, date_column)) for row in rows],
+            'publication': [column(row, publication_column).strip() or None for row in rows]}
+
+
+def aggregate(doc_topic_counts, keys):
+    """Sum the token counts of every topic by a label of each document.
+
+    Documents whose label is None are left out; labels are sorted.
+
+    Args:
+        doc_topic_counts (sparse matrix): documents x topics token counts.
+        keys (list): a label for each document.
+    Returns:
+        Aggregate: labels, documents and tokens per label, and counts.
+    """
+    known = np.array([key is not None for key in keys], dtype=bool)
+    labels = sorted(set(key for key in keys if key is not None))
+    lookup = {label: idx for idx, label in enumerate(labels)}
+    label_idx = np.array([lookup[key] for key in keys if key is not None], dtype=np.intp)
+    counts = np.zeros((doc_topic_counts.shape[1], len(labels)), dtype=np.int64)
+    dt = doc_topic_counts.tocsr()[np.nonzero(known)[0]].tocoo()
+    np.add.at(counts, (dt.col, label_idx[dt.row]), dt.data)
+    return Aggregate(labels, np.bincount(label_idx, minlength=len(labels)), counts.sum(axis=0), counts)
+
+
+## FILES
+
+def update_info(data_dir, key, value):
+    """Set a key of info.json (and of info-base.json, if any), keeping the rest of the file."""
+    for name in ('info.json', base_info_file):
+        info_path = os.path.join(data_dir, name)
+        info = {}
+        if os.path.isfile(info_path):
+            with io.open(info_path, 'r', encoding='utf-8') as info_file:
+                info = json.load(info_file)
+        elif name == base_info_file:
+            continue
+        info[key] = value
+        tmp_path = info_path + '.tmp'
+        with io.open(tmp_path, 'w', encoding='utf-8') as info_file:
+            info_file.write(json.dumps(info, indent=2, ensure_ascii=False))
+        os.replace(tmp_path, info_path)
+
+
+def export_aggregates(model, rows, data_dir, date_column=date_column, publication_column=publication_column):
+    """Write the year, month and publication aggregates of a model.
+
+    Args:
+        model (Model): loaded model artifacts (model_cache.load_model).
+        rows (list): metadata rows, one per model document, in model order.
+        data_dir (str): browser data directory.
+        date_column (int): metadata column holding the publication date.
+        publication_column (int): metadata column holding the publication.
+    Returns:
+        dict: the index, as written to index.json and info.json.
+    """
+    num_docs = model.doc_topic_counts.shape[0]
+    if len(rows) != num_docs:
+        raise ValueError('{} metadata rows for {} documents.'.format(len(rows), num_docs))
+    index = {}
+    build_dir = tempfile.mkdtemp(prefix='.' + aggregates_dir + '-', dir=data_dir)
+    os.chmod(build_dir, 0o755)
+    try:
+        for name, keys in doc_conditions(rows, date_column, publication_column).items():
+            agg = aggregate(model.doc_topic_counts, keys)
+            agg.counts.astype('<u4').tofile(os.path.join(build_dir, name + '.bin'))
+            index[name] = {'file': '{}/{}.bin'.format(aggregates_dir, name), 'dtype': 'uint32',
+                           'shape': list(agg.counts.shape), 'labels': agg.labels,
+                           'docs': agg.docs.tolist(), 'tokens': agg.tokens.tolist()}
+        with io.open(os.path.join(build_dir, index_file), 'w', encoding='utf-8') as out:
+            out.write(json.dumps(index, separators=(',', ':'), ensure_ascii=False))
+        target = os.path.join(data_dir, aggregates_dir)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.rename(build_dir, target)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    update_info(data_dir, 'aggregates', '{}/{}'.format(aggregates_dir, index_file))
+    return index
+
+
+## QUERIES
+
+def load_aggregates(data_dir='browser/data'):
+    """Load the aggregates written by export_aggregates.
+
+    Returns:
+        dict: condition name -> Aggregate.
+    """
+    with io.open(os.path.join(data_dir, aggregates_dir, index_file), 'r', encoding='utf-8') as index:
+        entries = json.load(index)
+    return {name: Aggregate(entry['labels'], np.array(entry['docs']), np.array(entry['tokens']),
+                            np.fromfile(os.path.join(data_dir, entry['file']), dtype='<u4').reshape(entry['shape']))
+            for name, entry in entries.items()}
+
+
+def topic_table(agg, proportions=True, start_index=1):
+    """Return an aggregate as a DataFrame with one row per topic.
+
+    Args:
+        agg (Aggregate): one condition of load_aggregates.
+        proportions (bool): divide each column by its tokens, giving the
+            share of each topic in each year, month or publication.
+        start_index (int): number of the first topic.
+    Returns:
+        DataFrame: topics x labels.
+    """
+    values = agg.counts / np.maximum(agg.tokens, 1) if proportions else agg.counts
+    return pd.DataFrame(values, columns=agg.labels,
+                        index=pd.RangeIndex(start_index, start_index + agg.counts.shape[0], name='topic'))
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Precompute topic totals by year, month and publication for an exported browser.', epilog='EXAMPLE:\n  topic_aggregates.py -s caches/model/topic-state.gz -c caches/model/composition.txt -d browser/data\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-s', '--state', default='caches/model/topic-state.gz', help='MALLET state file')
+    PARSER.add_argument('-c', '--composition', default='caches/model/composition.txt', help='MALLET composition file, listing every document')
+    PARSER.add_argument('-d', '--data', default='browser/data', help='browser data directory, holding meta.csv.zip')
+
+    CL_ARGS = PARSER.parse_args()
+
+    with zipfile.ZipFile(os.path.join(CL_ARGS.data, 'meta.csv.zip')) as ZFILE:
+        ROWS = list(csv.reader(io.StringIO(ZFILE.read('meta.csv').decode('utf-8'))))
+    for NAME, ENTRY in export_aggregates(pad_model(load_model(CL_ARGS.state, verbose=True), CL_ARGS.composition), ROWS, CL_ARGS.data).items():
+        print('{}: {} labels'.format(NAME, len(ENTRY['labels'])))
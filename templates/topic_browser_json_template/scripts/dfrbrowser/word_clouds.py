@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+word_clouds.py
+Precompute the word cloud of every topic for topic bubbles.
+
+Topic bubbles (scripts/topic-bubbles) shows a word cloud when a bubble is
+clicked, and used to place its words with d3.layout.cloud in the browser, a
+random and slow layout for models with many topics. This module places the
+words of every topic once, at export time, from tw.json:
+
+    1. the top 50 words of a topic get the font sizes topic bubbles uses
+       (5px to 25px by the square root of the word's weight relative to the
+       topic's top word);
+    2. each word, largest first, is moved along a spiral out from the center
+       of the cloud until its box (estimated from the font size and the
+       letters of the word) overlaps no word already placed; words that do
+       not fit are left out, as d3.layout.cloud does;
+    3. the topics are laid out in parallel processes, and the result is
+       written to clouds.json next to tw.json:
+
+       {"width": 390, "height": 350, "topics": [[[word, x, y, size], ...], ...]}
+
+x and y are the center of each word relative to the center of the cloud. The
+layout is deterministic, and the browser scales it to the size of the bubble.
+
+v1.0 first version: deterministic spiral layout
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import io
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+cloud_width     = 390   ## the cloud box of topic bubbles for centerY = 400
+cloud_height    = 350
+cloud_words     = 50
+font_range      = (5, 25)
+padding         = 3
+spiral_step     = 0.1
+max_turns       = 2000
+## approximate character widths, as a fraction of the font size
+narrow_chars    = set('fijlrt.,:;!|\'"()[] ')
+wide_chars      = set('mwMW@%')
+
+
+## LAYOUT
+
+def font_sizes(weights, font_range=font_range):
+    """Return topic bubbles' font size for each weight (d3.scaleSqrt of weight / max weight)."""
+    top = float(weights[0]) if weights and weights[0] else 1.0
+    return [int(math.floor(font_range[0] + (font_range[1] - font_range[0]) * math.sqrt(max(weight, 0) / top)))
+            for weight in weights]
+
+
+def text_width(word, size):
+    """Estimate the width of a word in pixels."""
+    width = 0.0
+    for char in word:
+        if char in narrow_chars:
+            width += 0.32
+        elif char in wide_chars:
+            width += 0.85
+        elif char.isupper():
+            width += 0.68
+        else:
+            width += 0.56
+    return width * size
+
+
+def collision(box, boxes, last=None):
+    """Return a box of boxes that box (x0, y0, x1, y1) intersects, or None.
+
+    The last box hit is tried first: along a spiral, the next position
+    usually hits the same word.
+    """
+    for other in ([last] if last else []) + boxes:
+        if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+            return other
+    return None
+
+
+def layout_cloud(words, weights, width=cloud_width, height=cloud_height, n_words=cloud_words):
+    """Place the words of one topic.
+
+    Args:
+        words (list): the topic's words, by decreasing weight.
+        weights (list): their weights.
+        width, height (int): size of the cloud.
+        n_words (int): words placed.
+    Returns:
+        list: [word, x, y, size] for every word placed.
+    """
+    words, weights = list(words[:n_words]), list(weights[:n_words])
+    sizes = font_sizes(weights)
+    ratio = float(width) / height
+    placed, boxes = [], []
+    for word, size in sorted(zip(words, sizes), key=lambda item: -item[1]):
+        half_w = text_width(word, size) / 2 + padding
+        half_h = size / 2.0 + padding
+        if half_w * 2 > width or half_h * 2 > height:
+            continue
+        turn, last = 0.0, None
+        while turn < max_turns:
+            x = ratio * turn * math.cos(turn)
+            y = turn * math.sin(turn)
+            box = (x - half_w, y - half_h, x + half_w, y + half_h)
+            if abs(x) + half_w > width / 2.0 or abs(y) + half_h > height / 2.0:
+                if turn * min(ratio, 1) > max(width, height):
+                    break
+            else:
+                last = collision(box, boxes, last)
+                if last is None:
+                    boxes.append(box)
+                    placed.append([word, round(x, 1), round(y, 1), size])
+                    break
+            turn += spiral_step
+    return placed
+
+
+def layout_topic(args):
+    """Lay out one topic; args is (words, weights, width, height, n_words)."""
+    return layout_cloud(*args)
+
+
+def layout_clouds(tw, width=cloud_width, height=cloud_height, n_words=cloud_words, workers=None):
+    """Place the words of every topic, in parallel.
+
+    Args:
+        tw (list): tw.json's "tw": one {'words': [...], 'weights': [...]} per topic.
+        workers (int): processes; None for all CPUs.
+    Returns:
+        list: each topic's placed words.
+    """
+    jobs = [(topic['words'], topic['weights'], width, height, n_words) for topic in tw]
+    if workers == 1 or len(jobs) < 2:
+        return [layout_topic(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(layout_topic, jobs, chunksize=max(1, len(jobs) // 32)))
+
+
+def export_clouds(data_dir, workers=None):
+    """Write clouds.json for the tw.json of a browser data directory.
+
+    Returns:
+        str: the file written.
+    """
+    with io.open(os.path.join(data_dir, 'tw.json'), 'r', encoding='utf-8') as tw_file:
+        tw = json.load(tw_file)['tw']
+    clouds = {'width': cloud_width, 'height': cloud_height, 'topics': layout_clouds(tw, workers=workers)}
+    path = os.path.join(data_dir, 'clouds.json')
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as out:
+        out.write(json.dumps(clouds, separators=(',', ':'), ensure_ascii=False))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Precompute the topic bubbles word clouds (clouds.json) from tw.json.', epilog='EXAMPLE:\n  word_clouds.py -d browser/data\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-d', '--data', default='browser/data', help='browser data directory, holding tw.json')
+    PARSER.add_argument('-w', '--workers', type=int, default=None, help='processes (default: all CPUs)')
+
+    CL_ARGS = PARSER.parse_args()
+
+    print('Wrote ' + export_clouds(CL_ARGS.data, CL_ARGS.workers))
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+lifecycle.py
+Move projects and caches to a trash folder at once, and delete them in the background.
+
+remove_project.ipynb used to trash a project with `mv` and empty the trash
+with `rm -R`, and 0_clear_caches.ipynb deleted the caches with `rm -fr`;
+on caches of several GB these block the notebook for minutes. This module:
+
+    1. moves a folder to a trash folder with a single rename (instant and
+       atomic on the same file system), under its name and the time it was
+       trashed, e.g. .Trash/20180101_0000_untitled~20180302_101500;
+    2. deletes trashed folders in a detached process (lifecycle.py
+       --delete), a batch of files at a time with a pause between batches,
+       so the deletion does not starve the notebooks running next to it and
+       goes on after the kernel stops (e.g. when pipeline.py runs
+       0_clear_caches.ipynb headless); a background thread of the kernel
+       can be used instead (detached=False), and a folder it has not
+       finished when the kernel stops stays in the trash until the next
+       purge;
+    3. reports the size of the trash (files linked from elsewhere are
+       counted once) and purges the entries trashed more than a number of
+       days ago.
+
+v1.0 first version: rename to trash, background deletion, retention purge
+v1.1 deletion in a detached process that outlives the kernel
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import collections
+import datetime
+import errno
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.1"
+
+## DEFAULTS
+
+trash_name      = '.trash'      ## trash of a project, for its cleared caches
+stamp_separator = '~'
+stamp_format    = '%Y%m%d_%H%M%S'
+batch_size      = 500           ## files deleted between pauses
+batch_pause     = 0.05          ## seconds; 0 to delete as fast as possible
+
+TrashEntry = collections.namedtuple('TrashEntry', 'name path trashed bytes files')
+
+
+## SIZES
+
+def tree_size(path):
+    """Return the bytes and files under path, counting each hard-linked file once.
+
+    Returns:
+        tuple: (bytes, files)
+    """
+    total, files, seen = 0, 0, set()
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            files += 1
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total, files
+
+
+def human_size(size):
+    """Return a size in bytes as e.g. '1.5 GB'."""
+    for unit in ('bytes', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{:.0f} {}'.format(size, unit) if unit == 'bytes' else '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+    return None
+
+
+## TRASH
+
+def move_to_trash(path, trash_dir=trash_name):
+    """Rename a file or folder into trash_dir under its name and the time.
+
+    Returns:
+        str: the trashed path.
+    """
+    os.makedirs(trash_dir, exist_ok=True)
+    base = '{}{}{}'.format(os.path.basename(os.path.normpath(path)), stamp_separator, time.strftime(stamp_format))
+    target, count = os.path.join(trash_dir, base), 1
+    while os.path.lexists(target):
+        count += 1
+        target = os.path.join(trash_dir, '{}-{}'.format(base, count))
+    try:
+        os.rename(path, target)
+    except OSError as error:
+        if error.errno != errno.EXDEV:  ## the trash is on another file system
+            raise
+        shutil.move(path, target)
+    return target
+
+
+def trashed_time(path):
+    """Return when a trash entry was trashed: from its name, else its modification time."""
+    name = os.path.basename(path)
+    if stamp_separator in name:
+        try:
+            return datetime.datetime.strptime(name.rsplit(stamp_separator, 1)[1].split('-')[0], stamp_format)
+        except ValueError:
+            pass
+    return datetime.datetime.fromtimestamp(os.lstat(path).st_mtime)
+
+
+def original_name(path):
+    """Return the name a trash entry had before it was trashed."""
+    return os.path.basename(path).rsplit(stamp_separator, 1)[0]
+
+
+def restore(path, dest_dir):
+    """Move a trash entry back to dest_dir under its original name.
+
+    Returns:
+        str: the restored path.
+    """
+    target = os.path.join(dest_dir, original_name(path))
+    if os.path.lexists(target):
+        raise FileExistsError('Cannot restore over ' + target)
+    os.rename(path, target)
+    return target
+
+
+def trash_usage(trash_dir=trash_name):
+    """List the entries of a trash folder, oldest first.
+
+    Returns:
+        list: a TrashEntry for each entry.
+    """
+    if not os.path.isdir(trash_dir):
+        return []
+    entries = []
+    for name in os.listdir(trash_dir):
+        path = os.path.join(trash_dir, name)
+        size, files = tree_size(path) if os.path.isdir(path) else (os.lstat(path).st_size, 1)
+        entries.append(TrashEntry(name, path, trashed_time(path), size, files))
+    return sorted(entries, key=lambda entry: entry.trashed)
+
+
+## DELETION
+
+def delete_tree(path, batch=batch_size, pause=batch_pause, progress=None):
+    """Delete a file or folder bottom-up, pausing after every batch of files.
+
+    Args:
+        progress (function): called with the number of files deleted after each batch.
+    Returns:
+        int: files deleted.
+    """
+    if not os.path.isdir(path) or os.path.islink(path):
+        if os.path.lexists(path):
+            os.remove(path)
+            return 1
+        return 0
+    deleted = 0
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        for name in filenames + [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))]:
+            try:
+                os.remove(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            deleted += 1
+            if deleted % batch == 0:
+                if progress:
+                    progress(deleted)
+                if pause:
+                    time.sleep(pause)
+        try:
+            os.rmdir(dirpath)
+        except FileNotFoundError:
+            pass
+    return deleted
+
+
+class Deleter(object):
+    """Delete trashed folders one after the other in a background thread."""
+
+    def __init__(self, batch=batch_size, pause=batch_pause):
+        self.batch = batch
+        self.pause = pause
+        self.jobs = queue.Queue()
+        self.deleted = 0
+        self.errors = []
+        self.thread = threading.Thread(target=self.run, name='lifecycle-deleter', daemon=True)
+        self.thread.start()
+
+    def add(self, path):
+        """Queue a path for deletion."""
+        self.jobs.put(path)
+
+    def pending(self):
+        """Return the number of paths waiting or being deleted."""
+        return self.jobs.unfinished_tasks
+
+    def wait(self):
+        """Block until every queued path is deleted."""
+        self.jobs.join()
+
+    def run(self):
+        """Delete queued paths until the process ends."""
+        while True:
+            path = self.jobs.get()
+            try:
+                self.deleted += delete_tree(path, self.batch, self.pause)
+            except OSError as error:
+                self.errors.append((path, error))
+            finally:
+                self.jobs.task_done()
+
+
+_deleter = None
+_deleter_lock = threading.Lock()
+
+
+def deleter():
+    """Return the background Deleter of this process, starting it if needed."""
+    global _deleter  #pylint: disable=global-statement
+    with _deleter_lock:
+        if _deleter is None:
+            _deleter = Deleter()
+        return _deleter
+
+
+def delete_detached(paths):
+    """Delete paths in a new process, in its own session, that goes on after this one ends.
+
+    Returns:
+        subprocess.Popen: the deleting process.
+    """
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--delete'] + [os.path.abspath(path) for path in paths],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            close_fds=True, start_new_session=True)
+
+
+def delete_later(path, trash_dir=trash_name, detached=True):
+    """Move path to trash_dir at once and delete it in the background.
+
+    Args:
+        detached (bool): delete in a detached process, which outlives the
+            kernel; else in this process's background thread.
+    Returns:
+        str: the trashed path, or None if path did not exist.
+    """
+    if not os.path.lexists(path):
+        return None
+    trashed = move_to_trash(path, trash_dir)
+    if detached:
+        delete_detached([trashed])
+    else:
+        deleter().add(trashed)
+    return trashed
+
+
+def clear_dir(path, trash_dir=trash_name, detached=True):
+    """Empty a folder at once: trash it, recreate it, and delete the old one in the background."""
+    trashed = delete_later(path, trash_dir, detached)
+    os.makedirs(path, exist_ok=True)
+    return trashed
+
+
+def purge_trash(trash_dir=trash_name, older_than_days=None, background=True, verbose=True, detached=True):
+    """Delete the trash entries trashed more than older_than_days ago (all if None).
+
+    Args:
+        background (bool): delete in the background; else wait.
+        detached (bool): delete in the background in a detached process,
+            which outlives the kernel; else in this process's thread.
+    Returns:
+        list: the TrashEntry of each entry purged.
+    """
+    limit = datetime.datetime.now() - datetime.timedelta(days=older_than_days) if older_than_days is not None else None
+    purged = [entry for entry in trash_usage(trash_dir) if limit is None or entry.trashed < limit]
+    if background and detached and purged:
+        delete_detached([entry.path for entry in purged])
+    for entry in purged:
+        if background and not detached:
+            deleter().add(entry.path)
+        elif not background:
+            delete_tree(entry.path, pause=0)
+    if verbose:
+        print('Purging {} entries ({}) from {}{}'.format(len(purged), human_size(sum(entry.bytes for entry in purged)), trash_dir,
+                                                         ' in the background' if background and purged else ''))
+    return purged
+
+
+def print_usage(trash_dir=trash_name):
+    """Print the entries of a trash folder and their sizes, newest first."""
+    entries = trash_usage(trash_dir)
+    for entry in reversed(entries):
+        print('{:%Y-%m-%d %H:%M}  {:>10}  {:>9,} files  {}'.format(entry.trashed, human_size(entry.bytes), entry.files, entry.name))
+    print('{} entries, {} in {}'.format(len(entries), human_size(sum(entry.bytes for entry in entries)), trash_dir))
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Move folders to a trash folder, report its size, and purge old entries.', epilog='EXAMPLE:\n  lifecycle.py -t projects/.Trash --remove projects/20180101_0000_untitled\n  lifecycle.py -t projects/.Trash --purge --days 30\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-t', '--trash', default=trash_name, help='trash folder')
+    PARSER.add_argument('--remove', nargs='+', default=[], help='folders to move to the trash')
+    PARSER.add_argument('--purge', action='store_true', help='delete trash entries')
+    PARSER.add_argument('--days', type=float, default=None, help='only purge entries trashed more than this many days ago')
+    PARSER.add_argument('--delete', nargs='+', default=[], help='trashed folders to delete, a batch of files at a time (as delete_later does)')
+
+    CL_ARGS = PARSER.parse_args()
+
+    if CL_ARGS.delete:
+        for PATH in CL_ARGS.delete:
+            try:
+                delete_tree(PATH)
+            except OSError as error:
+                print('{}: {}'.format(PATH, error))
+        sys.exit(0)
+
+    for PATH in CL_ARGS.remove:
+        print('Trashed ' + move_to_trash(PATH, CL_ARGS.trash))
+    if CL_ARGS.purge:
+        purge_trash(CL_ARGS.trash, CL_ARGS.days, background=False)
+    print_usage(CL_ARGS.trash)
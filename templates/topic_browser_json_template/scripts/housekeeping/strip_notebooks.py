@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+strip_notebooks.py
+Strip the outputs of notebooks in parallel, skipping notebooks that are already clean.
+
+0_clear_caches.ipynb used to run `find ... -exec nbstripout {} +`, which starts
+nbstripout's interpreter for each batch and rewrites every notebook, even
+one without outputs. This module does it in one process:
+
+    1. notebooks are found under one or more folders (a project, or the
+       whole projects folder), leaving out checkpoints and hidden folders
+       such as .pipeline and .Trash;
+    2. each file is read and checked with a quick search of its bytes for
+       outputs, execution counts and the metadata nbstripout removes; a
+       notebook with none is left alone, unparsed;
+    3. the others are parsed (with orjson if it is installed), stripped of
+       outputs, execution counts and that metadata, and written back only
+       if something changed, in the format Jupyter writes, in parallel
+       processes.
+
+v1.0 first version: quick clean check, parallel stripping
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+cell_keys       = ('collapsed', 'scrolled', 'ExecuteTime', 'execution')
+notebook_keys   = ('signature', 'widgets')
+dirty_re        = re.compile(rb'"execution_count":\s*\d|"outputs":\s*\[\s*[^\s\]]|"(?:' + '|'.join(cell_keys + notebook_keys).encode('ascii') + rb')":')
+ignored_dirs    = ('.ipynb_checkpoints', '__pycache__')
+
+
+## FINDING
+
+def find_notebooks(roots, exclude=(), max_depth=None):
+    """List the notebooks under roots.
+
+    Args:
+        roots (list): folders (or notebooks) to search.
+        exclude (tuple): notebook names to leave out (e.g. the running one).
+        max_depth (int): folder levels below each root to search; None for all.
+    Returns:
+        list: notebook paths.
+    """
+    found = []
+    for root in roots:
+        if os.path.isfile(root):
+            found.append(root)
+            continue
+        depth0 = root.rstrip(os.sep).count(os.sep)
+        for dirpath, dirnames, filenames in os.walk(root):
+            depth = dirpath.rstrip(os.sep).count(os.sep) - depth0
+            dirnames[:] = [] if max_depth is not None and depth >= max_depth else \
+                sorted(name for name in dirnames if name not in ignored_dirs and not name.startswith('.'))
+            found.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                         if name.endswith('.ipynb') and name not in exclude)
+    return found
+
+
+## STRIPPING
+
+def strip(nb):
+    """Remove outputs, execution counts and volatile metadata from a notebook (in place).
+
+    Returns:
+        bool: True if anything was removed.
+    """
+    changed = False
+    for key in notebook_keys:
+        if key in nb.get('metadata', {}):
+            del nb['metadata'][key]
+            changed = True
+    for cell in nb.get('cells', []):
+        for key in cell_keys:
+            if key in cell.get('metadata', {}):
+                del cell['metadata'][key]
+                changed = True
+        if cell.get('cell_type') == 'code':
+            if cell.get('outputs'):
+                cell['outputs'] = []
+                changed = True
+            if cell.get('execution_count') is not None:
+                cell['execution_count'] = None
+                changed = True
+    return changed
+
+
+def strip_file(path):
+    """Strip a notebook file, if it needs it.
+
+    Returns:
+        str: 'clean' (left alone), 'stripped', or 'error: ...'.
+    """
+    try:
+        with open(path, 'rb') as fin:
+            data = fin.read()
+        if not dirty_re.search(data):
+            return 'clean'
+        nb = orjson.loads(data) if orjson is not None else json.loads(data.decode('utf-8'))
+        if not strip(nb):
+            return 'clean'
+        ## the format Jupyter (nbformat) writes
+        text = json.dumps(nb, indent=1, sort_keys=True, ensure_ascii=False) + '\n'
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with io.open(tmp, 'w', encoding='utf-8', newline='\n') as out:
+            out.write(text)
+        os.chmod(tmp, os.stat(path).st_mode & 0o7777 | 0o200)
+        os.replace(tmp, path)
+        return 'stripped'
+    except (IOError, OSError, ValueError) as error:
+        return 'error: {}'.format(error)
+
+
+def strip_notebooks(roots, exclude=(), max_depth=None, workers=None, verbose=True):
+    """Strip the outputs of every notebook under roots.
+
+    Args:
+        roots (list): folders (or notebooks); e.g. ['.'] in a project, or
+            ['projects'] for the workspace.
+        exclude (tuple): notebook names to leave out.
+        max_depth (int): folder levels to search; None for all.
+        workers (int): processes; None for all CPUs, 1 for none.
+    Returns:
+        dict: path -> result of strip_file.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    paths = find_notebooks(roots, exclude, max_depth)
+    if workers == 1 or len(paths) < 16:
+        results = [strip_file(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(strip_file, paths, chunksize=max(1, len(paths) // 64)))
+    results = dict(zip(paths, results))
+    if verbose:
+        stripped = [path for path, result in results.items() if result == 'stripped']
+        errors = [(path, result) for path, result in results.items() if result.startswith('error')]
+        for path in stripped:
+            print('Stripped ' + path)
+        for path, result in errors:
+            print('{}: {}'.format(path, result))
+        print('{} notebooks: {} stripped, {} already clean, {} errors'.format(len(results), len(stripped), len(results) - len(stripped) - len(errors), len(errors)))
+    return results
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Strip outputs from notebooks in parallel, skipping clean ones.', epilog='EXAMPLE:\n  strip_notebooks.py . -d 3 -x 0_clear_caches.ipynb\n  strip_notebooks.py projects\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('roots', nargs='*', default=['.'], help='folders or notebooks (default: .)')
+    PARSER.add_argument('-x', '--exclude', nargs='+', default=[], help='notebook names to leave out')
+    PARSER.add_argument('-d', '--depth', type=int, default=None, help='folder levels to search (default: all)')
+    PARSER.add_argument('-w', '--workers', type=int, default=None, help='processes (default: all CPUs)')
+
+    CL_ARGS = PARSER.parse_args()
+
+    strip_notebooks(CL_ARGS.roots, tuple(CL_ARGS.exclude), CL_ARGS.depth, CL_ARGS.workers)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+composition_reader.py
+Stream a MALLET composition.txt file into a memory-mapped document-topic matrix.
+
+MALLET's --output-doc-topics file has one line per document, either with one
+proportion per topic (MALLET 2.0.8 and later):
+
+    0   file:/.../caches/text_files_clean/0012_.txt   0.013   0.201   ...
+
+or, in older versions, with a "#doc name topic proportion ..." header and
+(topic, proportion) pairs in decreasing order. The file is read in chunks:
+
+    1. the proportions are written to a float32 .npy file, memory-mapped on load;
+    2. the document names are written to names.txt;
+    3. the top N documents of every topic are kept while streaming and saved
+       as a topics x N index, so "top documents for topic k" is a lookup of
+       N rows instead of a scan of the whole matrix.
+
+The files are cached under caches/model/cache/composition-<hash>/, where
+<hash> is a hash of composition.txt, like the model artifacts of
+model_cache.py.
+
+v1.0 first version: chunked reader, float32 memmap and top-document index
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+try:
+    from scripts.mallet.model_cache import state_key, with_num_docs
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from model_cache import state_key, with_num_docs
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+cache_root      = 'caches/model/cache'
+chunksize       = 50000
+top_n           = 100
+names_file      = 'names.txt'
+params_file     = 'params.json'
+
+## A loaded composition file: the documents x topics proportions (float32,
+## memory-mapped), the document names and the per-topic top-document index.
+Composition = namedtuple('Composition', ['path', 'theta', 'names', 'top_docs', 'top_weights'])
+
+
+## PARSING
+
+def composition_format(composition_file):
+    """Inspect the start of a composition file.
+
+    Returns:
+        tuple: (header lines to skip, True if the rows hold (topic, proportion)
+            pairs, number of topics, number of documents)
+    """
+    skip, pairs, num_topics, num_docs = 0, False, 0, 0
+    with io.open(composition_file, 'r', encoding='utf-8') as composition:
+        for line in composition:
+            if line.startswith('#'):
+                skip += 1
+                pairs = pairs or 'topic proportion' in line
+            elif line.strip():
+                if not num_docs:
+                    values = len(line.split()) - 2
+                    num_topics = values // 2 if pairs else values
+                num_docs += 1
+    return skip, pairs, num_topics, num_docs
+
+
+def iter_composition_chunks(composition_file, chunksize=chunksize, fmt=None):
+    """Stream the rows of a composition file.
+
+    Args:
+        composition_file (str): MALLET --output-doc-topics file.
+        chunksize (int): documents parsed at a time.
+        fmt (tuple): the file's composition_format, if already known.
+    Yields:
+        tuple: (names, proportions) for up to chunksize documents, where
+            proportions is a float32 documents x topics array.
+    """
+    skip, pairs, num_topics, _num_docs = fmt or composition_format(composition_file)
+    width = 2 + (2 * num_topics if pairs else num_topics)
+    reader = pd.read_csv(composition_file, sep=r'\s+', header=None, skiprows=skip, names=list(range(width)),
+                         usecols=list(range(1, width)), dtype={1: str}, chunksize=chunksize)
+    for chunk in reader:
+        values = chunk.iloc[:, 1:].values
+        if pairs:
+            proportions = np.zeros((len(chunk), num_topics), dtype=np.float32)
+            topics, weights = values[:, 0::2], values[:, 1::2]
+            rows, cols = np.nonzero(~np.isnan(topics))
+            proportions[rows, topics[rows, cols].astype(np.intp)] = weights[rows, cols]
+        else:
+            proportions = values.astype(np.float32)
+        yield chunk[1].tolist(), proportions
+
+
+def merge_top(top_weights, top_docs, weights, docs, n):
+    """Keep the n largest weights of each row of two candidate sets.
+
+    Args:
+        top_weights, top_docs (ndarray): topics x m current candidates.
+        weights, docs (ndarray): topics x c new candidates.
+        n (int): candidates to keep per topic.
+    Returns:
+        tuple: topics x min(n, m + c) weights and documents, unordered.
+    """
+    weights = np.concatenate([top_weights, weights], axis=1)
+    docs = np.concatenate([top_docs, docs], axis=1)
+    if weights.shape[1] > n:
+        keep = np.argpartition(-weights, n - 1, axis=1)[:, :n]
+        weights = np.take_along_axis(weights, keep, axis=1)
+        docs = np.take_along_axis(docs, keep, axis=1)
+    return weights, docs
+
+
+def build_composition(composition_file, cache_dir, n=top_n, chunksize=chunksize):
+    """Parse a composition file into cache_dir.
+
+    Args:
+        composition_file (str): MALLET --output-doc-topics file.
+        cache_dir (str): empty directory to write.
+        n (int): documents kept per topic in the index.
+        chunksize (int): documents parsed at a time.
+    """
+    fmt = composition_format(composition_file)
+    _skip, _pairs, num_topics, num_docs = fmt
+    theta = np.lib.format.open_memmap(os.path.join(cache_dir, 'theta.npy'), mode='w+',
+                                      dtype=np.float32, shape=(num_docs, num_topics))
+    top_weights = np.zeros((num_topics, 0), dtype=np.float32)
+    top_docs = np.zeros((num_topics, 0), dtype=np.int32)
+    start = 0
+    with io.open(os.path.join(cache_dir, names_file), 'w', encoding='utf-8') as names:
+        for chunk_names, proportions in iter_composition_chunks(composition_file, chunksize, fmt):
+            stop = start + len(chunk_names)
+            theta[start:stop] = proportions
+            names.write(u''.join(name + u'\n' for name in chunk_names))
+            docs = np.broadcast_to(np.arange(start, stop, dtype=np.int32), (num_topics, stop - start))
+            top_weights, top_docs = merge_top(top_weights, top_docs, proportions.T, docs, n)
+            start = stop
+    theta.flush()
+    del theta
+
+    ## order each topic's documents by decreasing weight, then by document
+    for topic in range(num_topics):
+        order = np.lexsort((top_docs[topic], -top_weights[topic]))
+        top_weights[topic], top_docs[topic] = top_weights[topic][order], top_docs[topic][order]
+    np.save(os.path.join(cache_dir, 'top_docs.npy'), top_docs)
+    np.save(os.path.join(cache_dir, 'top_weights.npy'), top_weights)
+    ## params.json is written last: its presence marks a complete cache entry
+    with open(os.path.join(cache_dir, params_file), 'w') as params:
+        json.dump({'num_docs': num_docs, 'num_topics': num_topics, 'top_n': n,
+                   'composition': os.path.abspath(composition_file)}, params)
+
+
+## LOADING
+
+def load_composition(composition_file, cache_root=cache_root, n=top_n, chunksize=chunksize, verbose=False):
+    """Load a composition file, building the cache entry on first use.
+
+    The entry is rebuilt if it holds fewer than n documents per topic.
+
+    Args:
+        composition_file (str): MALLET --output-doc-topics file.
+        cache_root (str): parent directory of cache entries.
+        n (int): documents kept per topic in the index.
+        chunksize (int): documents parsed at a time.
+        verbose (bool): print whether the cache was used.
+    Returns:
+        Composition: memory-mapped proportions, names and top-document index.
+    """
+    cache_dir = os.path.join(cache_root, 'composition-' + state_key(composition_file, cache_root))
+    params_path = os.path.join(cache_dir, params_file)
+    if os.path.isfile(params_path):
+        with open(params_path, 'r') as params:
+            cached_n = json.load(params)['top_n']
+    if not os.path.isfile(params_path) or cached_n < n:
+        if verbose:
+            print('Indexing {} into {}...'.format(composition_file, cache_dir))
+        build_dir = tempfile.mkdtemp(prefix='.composition-', dir=cache_root)
+        try:
+            build_composition(composition_file, build_dir, n, chunksize)
+            if os.path.isdir(cache_dir):
+                shutil.rmtree(cache_dir)
+            os.rename(build_dir, cache_dir)
+        except OSError:
+            ## another process finished the same entry first
+            shutil.rmtree(build_dir, ignore_errors=True)
+            if not os.path.isfile(params_path):
+                raise
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+    elif verbose:
+        print('Loading cached composition {}'.format(cache_dir))
+    with io.open(os.path.join(cache_dir, names_file), 'r', encoding='utf-8') as names:
+        doc_names = names.read().splitlines()
+    return Composition(cache_dir, np.load(os.path.join(cache_dir, 'theta.npy'), mmap_mode='r'), doc_names,
+                       np.load(os.path.join(cache_dir, 'top_docs.npy')),
+                       np.load(os.path.join(cache_dir, 'top_weights.npy')))
+
+
+def pad_model(model, composition_file):
+    """Return a model (model_cache.Model) with every document of a composition file.
+
+    The state file leaves out empty documents at the end of the corpus;
+    composition.txt lists them all, so the model's document arrays are
+    padded to its count (model_cache.with_num_docs). Without a composition
+    file the model is returned as it is.
+    """
+    if not composition_file or not os.path.isfile(composition_file):
+        return model
+    return with_num_docs(model, len(load_composition(composition_file).names))
+
+
+def top_documents(composition, topic, n=10):
+    """Return the n documents with the highest proportion of a topic.
+
+    Uses the index when it holds n documents per topic, and otherwise scans
+    the topic's column.
+
+    Args:
+        composition (Composition): loaded composition.
+        topic (int): topic number (from 0).
+        n (int): number of documents.
+    Returns:
+        DataFrame: doc, name and weight of each document, by decreasing weight.
+    """
+    if n <= composition.top_docs.shape[1]:
+        docs, weights = composition.top_docs[topic, :n], composition.top_weights[topic, :n]
+    else:
+        column = np.asarray(composition.theta[:, topic])
+        docs = np.lexsort((np.arange(len(column)), -column))[:n]
+        weights = column[docs]
+    return pd.DataFrame({'doc': docs, 'name': [composition.names[doc] for doc in docs], 'weight': weights})
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Index a MALLET composition.txt file: float32 document-topic matrix and top documents per topic.', epilog='EXAMPLE:\n  composition_reader.py -i caches/model/composition.txt -n 100 -t 0\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/model/composition.txt', help='MALLET doc-topics file')
+    PARSER.add_argument('-c', '--cache', default=cache_root, help='cache root directory')
+    PARSER.add_argument('-n', '--top', type=int, default=top_n, help='documents kept per topic')
+    PARSER.add_argument('-t', '--topic', type=int, default=None, help='print the top documents of a topic')
+
+    CL_ARGS = PARSER.parse_args()
+
+    COMPOSITION = load_composition(CL_ARGS.input, CL_ARGS.cache, CL_ARGS.top, verbose=True)
+    print('{} documents, {} topics in {}'.format(COMPOSITION.theta.shape[0], COMPOSITION.theta.shape[1], COMPOSITION.path))
+    if CL_ARGS.topic is not None:
+        print(top_documents(COMPOSITION, CL_ARGS.topic).to_string(index=False))
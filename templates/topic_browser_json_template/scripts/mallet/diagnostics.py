@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+diagnostics.py
+Summarize a MALLET diagnostics.xml file.
+
+MALLET's --diagnostics-file has one <topic> element per topic, with topic
+scores as attributes (tokens, coherence, exclusivity, word-length,
+document_entropy, ...) and one <word> element for each of its top words:
+
+    <topic id='0' tokens='1234.0' document_entropy='5.1' word-length='6.2' coherence='-210.5' ...>
+    <word rank='1' count='96' prob='0.078' ... word-length='10' coherence='0.0' exclusivity='0.61'>humanities</word>
+
+The file is parsed with iterparse, one topic at a time, so memory use does not
+grow with the number of topics. The result is:
+
+    1. a table with one row per topic: the topic scores, the number and mean,
+       min and max length of its top words, and its first few words -- cached
+       as caches/model/cache/diagnostics-<hash>.csv;
+    2. a JSON summary of the model (ranges of every score and the topics with
+       the lowest coherence and exclusivity) and an HTML page with the summary
+       and the table, written next to diagnostics.xml.
+
+v1.0 first version: streaming parser, cached table and summaries
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import html
+import io
+import json
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+try:
+    from scripts.mallet.model_cache import state_key
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from model_cache import state_key
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+cache_root      = 'caches/model/cache'
+label_words     = 5
+flagged_topics  = 10
+summary_scores  = ['tokens', 'coherence', 'exclusivity', 'document_entropy', 'word_length',
+                   'eff_num_words', 'uniform_dist', 'corpus_dist', 'token_doc_diff']
+
+
+## PARSING
+
+def number(value):
+    """Convert an attribute value to float, or NaN if it is not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def iter_topics(diagnostics_file, n_words=label_words):
+    """Stream the topics of a diagnostics file.
+
+    Args:
+        diagnostics_file (str): MALLET --diagnostics-file output.
+        n_words (int): top words kept for the label.
+    Yields:
+        dict: the topic's scores (attribute names with '-' replaced by '_'),
+            word statistics and label.
+    """
+    words = []
+    for _event, elem in ET.iterparse(diagnostics_file, events=('end',)):
+        if elem.tag == 'word':
+            words.append(elem.text or '')
+        elif elem.tag == 'topic':
+            row = {'topic': int(elem.get('id'))}
+            for name, value in elem.attrib.items():
+                if name != 'id':
+                    row[name.replace('-', '_')] = number(value)
+            lengths = [len(word) for word in words]
+            row['top_words'] = len(words)
+            row['top_word_length_mean'] = float(np.mean(lengths)) if lengths else np.nan
+            row['top_word_length_min'] = min(lengths) if lengths else np.nan
+            row['top_word_length_max'] = max(lengths) if lengths else np.nan
+            row['label'] = ' '.join(words[:n_words])
+            yield row
+            words = []
+            elem.clear()
+
+
+def read_diagnostics(diagnostics_file, n_words=label_words):
+    """Parse a diagnostics file into a table with one row per topic.
+
+    Returns:
+        DataFrame: topic scores, indexed by topic.
+    """
+    return pd.DataFrame(list(iter_topics(diagnostics_file, n_words))).set_index('topic').sort_index()
+
+
+def load_diagnostics(diagnostics_file, cache_root=cache_root, n_words=label_words):
+    """Return the topic table for a diagnostics file, cached by the file's hash.
+
+    Returns:
+        DataFrame: topic scores, indexed by topic.
+    """
+    cache_file = os.path.join(cache_root, 'diagnostics-{}.csv'.format(state_key(diagnostics_file, cache_root)))
+    if os.path.isfile(cache_file):
+        return pd.read_csv(cache_file, index_col='topic', keep_default_na=False, na_values=[''])
+    table = read_diagnostics(diagnostics_file, n_words)
+    tmp_file = cache_file + '.tmp'
+    table.to_csv(tmp_file)
+    os.replace(tmp_file, cache_file)
+    return table
+
+
+## SUMMARIES
+
+def summarize(table, n=flagged_topics):
+    """Summarize a topic table.
+
+    Args:
+        table (DataFrame): read_diagnostics output.
+        n (int): topics listed as lowest in coherence and exclusivity.
+    Returns:
+        dict: model totals, the range of every score and the flagged topics.
+    """
+    summary = {'topics': len(table),
+               'tokens': float(table['tokens'].sum()) if 'tokens' in table else None,
+               'scores': {}, 'lowest': {}}
+    for score in summary_scores:
+        if score in table:
+            values = table[score].dropna()
+            summary['scores'][score] = {'mean': float(values.mean()), 'min': float(values.min()),
+                                        'median': float(values.median()), 'max': float(values.max())}
+    for score in ('coherence', 'exclusivity'):
+        if score in table:
+            summary['lowest'][score] = [{'topic': int(topic), 'score': float(row[score]), 'label': row['label']}
+                                        for topic, row in table.nsmallest(n, score).iterrows()]
+    return summary
+
+
+def summary_html(table, summary):
+    """Return an HTML page with the summary and the topic table."""
+    rows = ''.join('<tr><th>{}</th><td>{:.4g}</td><td>{:.4g}</td><td>{:.4g}</td><td>{:.4g}</td></tr>'.format(
+        html.escape(score), values['mean'], values['min'], values['median'], values['max'])
+                   for score, values in summary['scores'].items())
+    lowest = ''.join('<h3>Lowest {}</h3><ol>{}</ol>'.format(html.escape(score), ''.join(
+        '<li>Topic {} ({:.4g}): {}</li>'.format(item['topic'], item['score'], html.escape(item['label']))
+        for item in items)) for score, items in summary['lowest'].items())
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Model diagnostics</title>'
+            '<style>table{{border-collapse:collapse}}td,th{{padding:2px 8px;text-align:right}}</style></head><body>'
+            '<h1>Model diagnostics</h1><p>{} topics, {:,.0f} tokens</p>'
+            '<table><tr><th></th><th>mean</th><th>min</th><th>median</th><th>max</th></tr>{}</table>{}'
+            '<h2>Topics</h2>{}</body></html>\n').format(
+                summary['topics'], summary['tokens'] or 0, rows, lowest,
+                table.to_html(float_format='{:.4g}'.format, na_rep=''))
+
+
+def write_summary(table, out_dir, n=flagged_topics):
+    """Write diagnostics.json and diagnostics.html to out_dir.
+
+    Returns:
+        tuple: paths of the JSON and HTML files.
+    """
+    summary = summarize(table, n)
+    json_file = os.path.join(out_dir, 'diagnostics.json')
+    html_file = os.path.join(out_dir, 'diagnostics.html')
+    with io.open(json_file, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(summary, indent=1, ensure_ascii=False))
+    with io.open(html_file, 'w', encoding='utf-8') as out:
+        out.write(summary_html(table, summary))
+    return json_file, html_file
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Summarize a MALLET diagnostics.xml file as a topic table, diagnostics.json and diagnostics.html.', epilog='EXAMPLE:\n  diagnostics.py -i caches/model/diagnostics.xml\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/model/diagnostics.xml', help='MALLET diagnostics file')
+    PARSER.add_argument('-c', '--cache', default=cache_root, help='cache root directory')
+    PARSER.add_argument('-o', '--output', default=None, help='directory for the summaries (default: next to the input)')
+    PARSER.add_argument('-n', '--lowest', type=int, default=flagged_topics, help='topics listed as lowest in coherence and exclusivity')
+
+    CL_ARGS = PARSER.parse_args()
+
+    TABLE = load_diagnostics(CL_ARGS.input, CL_ARGS.cache)
+    for path in write_summary(TABLE, CL_ARGS.output or os.path.dirname(os.path.abspath(CL_ARGS.input)), CL_ARGS.lowest):
+        print('Wrote ' + path)
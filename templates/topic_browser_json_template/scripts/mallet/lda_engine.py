@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+"""
+lda_engine.py
+Train an LDA topic model in-process and write MALLET-compatible output files.
+
+An alternative to mallet_runner.py that avoids starting the JVM and the
+import-dir round trip through topics.mallet:
+
+1.  The text files are tokenized in parallel processes the way MALLET's
+      import-dir does by default (lowercased, \\p{L}[\\p{L}\\p{P}]*\\p{L} tokens,
+      MALLET's English stoplist plus the extra stopwords), into int32 doc and
+      typeindex arrays.
+2.  The model is trained with one of two algorithms:
+          gibbs         a blocked (uncollapsed) Gibbs sampler: document-topic and
+                        topic-word distributions are drawn from their Dirichlet
+                        posteriors, then every token's topic is resampled, in
+                        chunks spread over threads. Alpha and beta are optimized
+                        as with MALLET's --optimize-interval.
+          variational   scikit-learn's batch variational Bayes, using all cores
+                        (requires scikit-learn); token topics are then sampled
+                        from the fitted distributions.
+3.  topic-state.gz, keys.txt, composition.txt and topic_counts.txt are written
+      in MALLET's formats, so the browser notebooks work unchanged.
+
+choose_engine() picks MALLET or the in-process engine by corpus size.
+
+v1.0 first version: in-process Gibbs and variational LDA
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import gzip
+import io
+import os
+import re
+import shutil
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy.special import digamma
+try:
+    from scripts.mallet.mallet_runner import available_cpus, model_state, model_keys, model_composition, model_counts
+    from scripts.mallet.model_counts import sparse_counts
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from mallet_runner import available_cpus, model_state, model_keys, model_composition, model_counts
+    from model_counts import sparse_counts
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS -- match MALLET's train-topics defaults
+
+engines           = ('mallet', 'gibbs', 'variational')
+num_iterations    = 1000
+vb_iterations     = 100
+optimize_interval = 10
+optimize_burn_in  = 200
+alpha_sum         = 5.0
+beta              = 0.01
+num_top_words     = 20
+chunksize         = 200000
+auto_max_mb       = 50
+
+## MALLET's default token pattern, \p{L}[\p{L}\p{P}]*\p{L}, with ASCII punctuation for \p{P}
+letter = r'[^\W\d_]'
+token_re = re.compile(letter + r"(?:" + letter + r"|[!\"#%&'()*,\-./:;?@\[\\\]_{}])*" + letter)
+
+## A tokenized corpus: document names, int32 doc and typeindex arrays with one
+## entry per token, and the vocabulary in order of first appearance.
+Corpus = namedtuple('Corpus', ['names', 'doc', 'typeindex', 'vocab'])
+
+
+## TOKENIZING
+
+def mallet_stoplist():
+    """Return the path of MALLET's English stoplist, if MALLET is installed."""
+    launcher = shutil.which('mallet')
+    if launcher:
+        path = os.path.join(os.path.dirname(os.path.realpath(launcher)), '..', 'stoplists', 'en.txt')
+        if os.path.isfile(path):
+            return os.path.normpath(path)
+    return None
+
+
+def read_stopwords(*stopwords_files):
+    """Read one or more stopword files into a set, skipping missing files."""
+    stopwords = set()
+    for path in stopwords_files:
+        if path and os.path.isfile(path):
+            with io.open(path, 'r', encoding='utf-8') as words:
+                stopwords.update(word.strip().lower() for word in words if word.strip())
+    return stopwords
+
+
+def tokenize_file(path):
+    """Return the lowercased tokens of a text file."""
+    with io.open(path, 'r', encoding='utf-8', errors='replace') as text:
+        return token_re.findall(text.read().lower())
+
+
+def read_corpus(input_dir, stopwords=(), workers=None):
+    """Tokenize a directory of text files, one document per file.
+
+    Args:
+        input_dir (str): directory of plain text files.
+        stopwords (set): words to remove.
+        workers (int): tokenizing processes; defaults to all available cores.
+    Returns:
+        Corpus: names (file: URIs), token arrays and vocabulary.
+    """
+    paths = sorted(os.path.join(input_dir, name) for name in os.listdir(input_dir)
+                   if os.path.isfile(os.path.join(input_dir, name)))
+    types, docs, typeindexes = {}, [], []
+    with ProcessPoolExecutor(max_workers=workers or available_cpus()) as executor:
+        for doc, tokens in enumerate(executor.map(tokenize_file, paths, chunksize=64)):
+            ids = [types.setdefault(token, len(types)) for token in tokens if token not in stopwords]
+            docs.append(np.full(len(ids), doc, dtype=np.int32))
+            typeindexes.append(np.array(ids, dtype=np.int32))
+    empty = np.zeros(0, dtype=np.int32)
+    return Corpus(['file:' + os.path.abspath(path) for path in paths],
+                  np.concatenate(docs) if docs else empty,
+                  np.concatenate(typeindexes) if typeindexes else empty,
+                  list(types))
+
+
+## SAMPLING
+
+def dirichlet_rows(rng, counts, prior):
+    """Draw one distribution per row from Dirichlet(counts + prior)."""
+    draws = rng.standard_gamma(counts + prior)
+    draws /= np.maximum(draws.sum(axis=1), np.finfo(draws.dtype).tiny)[:, np.newaxis]
+    return draws
+
+
+def sample_topics(theta, phi, doc, typeindex, seeds, workers, topic=None):
+    """Sample a topic for every token from theta[doc] * phi[:, typeindex].
+
+    Tokens are processed in chunks spread over threads, each chunk with its
+    own random generator.
+
+    Args:
+        theta (ndarray): documents x topics distributions.
+        phi (ndarray): topics x types distributions.
+        doc, typeindex (ndarray): token arrays.
+        seeds (SeedSequence): source of the per-chunk generators.
+        workers (int): threads.
+        topic (ndarray): optional output array.
+    Returns:
+        ndarray: int32 topic of each token.
+    """
+    if topic is None:
+        topic = np.empty(len(doc), dtype=np.int32)
+    phi_t = np.ascontiguousarray(phi.T)
+    starts = range(0, len(doc), chunksize)
+    rngs = [np.random.default_rng(seed) for seed in seeds.spawn(len(starts))]
+
+    def chunk(args):
+        start, rng = args
+        stop = min(start + chunksize, len(doc))
+        cumulative = np.cumsum(theta[doc[start:stop]] * phi_t[typeindex[start:stop]], axis=1)
+        draws = rng.random(stop - start) * cumulative[:, -1]
+        topic[start:stop] = (cumulative < draws[:, np.newaxis]).sum(axis=1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(chunk, zip(starts, rngs)))
+    return np.minimum(topic, theta.shape[1] - 1, out=topic)
+
+
+def optimize_alpha(alpha, doc_topic, doc_lengths):
+    """One Minka fixed-point update of an asymmetric Dirichlet prior (as MALLET's alpha optimization)."""
+    numerator = (digamma(doc_topic + alpha) - digamma(alpha)).sum(axis=0)
+    denominator = (digamma(doc_lengths + alpha.sum()) - digamma(alpha.sum())).sum()
+    return np.maximum(alpha * numerator / denominator, 1e-10)
+
+
+def optimize_beta(beta, topic_type, topic_lengths):
+    """One Minka fixed-point update of a symmetric Dirichlet prior."""
+    num_types = topic_type.shape[1]
+    numerator = (digamma(topic_type.data + beta) - digamma(beta)).sum()
+    denominator = num_types * (digamma(topic_lengths + num_types * beta) - digamma(num_types * beta)).sum()
+    return max(beta * numerator / denominator, 1e-10)
+
+
+def train_gibbs(corpus, num_topics, random_seed=None, num_threads=None, iterations=num_iterations,
+                optimize_interval=optimize_interval, optimize_burn_in=optimize_burn_in,
+                alpha_sum=alpha_sum, beta=beta, verbose=True):
+    """Train a model with the blocked Gibbs sampler.
+
+    Returns:
+        tuple: token topics (int32), alpha (array), beta (float)
+    """
+    workers = num_threads or available_cpus()
+    seeds = np.random.SeedSequence(random_seed)
+    rng = np.random.default_rng(seeds.spawn(1)[0])
+    num_docs, num_types = len(corpus.names), len(corpus.vocab)
+    alpha = np.full(num_topics, alpha_sum / num_topics)
+    doc_lengths = np.bincount(corpus.doc, minlength=num_docs)
+    topic = rng.integers(0, num_topics, len(corpus.doc), dtype=np.int32)
+    for iteration in range(1, iterations + 1):
+        doc_topic = sparse_counts(corpus.doc, topic, (num_docs, num_topics)).toarray()
+        topic_type = sparse_counts(topic, corpus.typeindex, (num_topics, num_types))
+        if optimize_interval and iteration > optimize_burn_in and iteration % optimize_interval == 0:
+            alpha = optimize_alpha(alpha, doc_topic, doc_lengths)
+            beta = optimize_beta(beta, topic_type, np.asarray(topic_type.sum(axis=1)).ravel())
+        theta = dirichlet_rows(rng, doc_topic, alpha)
+        phi = dirichlet_rows(rng, topic_type.toarray(), beta)
+        sample_topics(theta, phi, corpus.doc, corpus.typeindex, seeds.spawn(1)[0], workers, topic)
+        if verbose and iteration % 50 == 0:
+            print('<{}> alpha sum {:.4f}, beta {:.5f}'.format(iteration, alpha.sum(), beta))
+    return topic, alpha, beta
+
+
+def train_variational(corpus, num_topics, random_seed=None, num_threads=None, iterations=vb_iterations,
+                      alpha_sum=alpha_sum, beta=beta, verbose=True):
+    """Train a model with scikit-learn's batch variational Bayes.
+
+    Token topics are sampled from the fitted document-topic and topic-word
+    distributions, so the state file has the same form as the Gibbs sampler's.
+    scikit-learn takes priors of at most 1, so the per-topic alpha
+    (alpha_sum / num_topics, above 1 for fewer than alpha_sum topics) and
+    beta are capped at 1; the values used are returned.
+
+    Returns:
+        tuple: token topics (int32), alpha (array), beta (float)
+    """
+    from sklearn.decomposition import LatentDirichletAllocation
+    counts = sparse_counts(corpus.doc, corpus.typeindex, (len(corpus.names), len(corpus.vocab)))
+    doc_topic_prior, topic_word_prior = min(alpha_sum / num_topics, 1.0), min(beta, 1.0)
+    lda = LatentDirichletAllocation(n_components=num_topics, doc_topic_prior=doc_topic_prior,
+                                    topic_word_prior=topic_word_prior, learning_method='batch', max_iter=iterations,
+                                    n_jobs=num_threads or available_cpus(), random_state=random_seed,
+                                    verbose=1 if verbose else 0)
+    theta = lda.fit_transform(counts)
+    theta /= theta.sum(axis=1)[:, np.newaxis]
+    phi = lda.components_ / lda.components_.sum(axis=1)[:, np.newaxis]
+    topic = sample_topics(theta, phi, corpus.doc, corpus.typeindex, np.random.SeedSequence(random_seed),
+                          num_threads or available_cpus())
+    return topic, np.full(num_topics, doc_topic_prior), topic_word_prior
+
+
+## OUTPUT
+
+def write_state(path, corpus, topic, alpha, beta):
+    """Write a MALLET topic-state.gz file."""
+    ## tokens are stored document by document, so a token's position is its
+    ## offset from the first token of its document
+    doc_starts = np.cumsum(np.bincount(corpus.doc, minlength=len(corpus.names))) - np.bincount(corpus.doc, minlength=len(corpus.names))
+    positions = np.arange(len(corpus.doc)) - doc_starts[corpus.doc]
+    with gzip.open(path, 'wt', encoding='utf-8') as state:
+        state.write(u'#doc source pos typeindex type topic\n')
+        state.write(u'#alpha : ' + u''.join(u'{} '.format(value) for value in alpha) + u'\n')
+        state.write(u'#beta : {}\n'.format(beta))
+        for start in range(0, len(corpus.doc), chunksize):
+            stop = start + chunksize
+            state.write(u''.join(u'{} NA {} {} {} {}\n'.format(doc, pos, typeindex, corpus.vocab[typeindex], token_topic)
+                                 for doc, pos, typeindex, token_topic in zip(corpus.doc[start:stop].tolist(), positions[start:stop].tolist(),
+                                                                             corpus.typeindex[start:stop].tolist(), topic[start:stop].tolist())))
+
+
+def write_keys(path, topic_type, vocab, alpha, n_words=num_top_words):
+    """Write a MALLET keys.txt file: topic, alpha and top words by count."""
+    topic_type = topic_type.tocsr()
+    with io.open(path, 'w', encoding='utf-8') as keys:
+        for topic in range(topic_type.shape[0]):
+            start, stop = topic_type.indptr[topic], topic_type.indptr[topic+1]
+            cols, counts = topic_type.indices[start:stop], topic_type.data[start:stop]
+            order = np.lexsort((cols, -counts))[:n_words]
+            keys.write(u'{}\t{:f}\t{}\n'.format(topic, alpha[topic], u''.join(vocab[col] + u' ' for col in cols[order])))
+
+
+def write_composition(path, names, doc_topic, alpha):
+    """Write a MALLET (2.0.8+) composition.txt file: one proportion per topic."""
+    proportions = (doc_topic + alpha) / (doc_topic.sum(axis=1) + alpha.sum())[:, np.newaxis]
+    with io.open(path, 'w', encoding='utf-8') as composition:
+        for doc, name in enumerate(names):
+            composition.write(u'{}\t{}\t{}\n'.format(doc, name, u'\t'.join(repr(float(x)) for x in proportions[doc])))
+
+
+def write_counts(path, topic_type, vocab):
+    """Write a MALLET word-topic counts file: type index, type and topic:count pairs by count."""
+    type_topic = topic_type.T.tocsr()
+    with io.open(path, 'w', encoding='utf-8') as counts_file:
+        for typeindex, word in enumerate(vocab):
+            start, stop = type_topic.indptr[typeindex], type_topic.indptr[typeindex+1]
+            topics, counts = type_topic.indices[start:stop], type_topic.data[start:stop]
+            order = np.lexsort((topics, -counts))
+            counts_file.write(u'{} {} {}\n'.format(typeindex, word, u' '.join('{}:{}'.format(t, c) for t, c in zip(topics[order], counts[order]))))
+
+
+## PIPELINE
+
+def choose_engine(engine, input_dir, max_mb=auto_max_mb):
+    """Resolve 'auto' to 'gibbs' for corpora under max_mb of text, otherwise 'mallet'.
+
+    Returns:
+        str: 'mallet', 'gibbs' or 'variational'.
+    """
+    if engine != 'auto':
+        if engine not in engines:
+            raise ValueError('Unknown engine {!r}; use one of {} or auto.'.format(engine, ', '.join(engines)))
+        return engine
+    size = sum(entry.stat().st_size for entry in os.scandir(input_dir) if entry.is_file())
+    return 'gibbs' if size < max_mb * 1024 * 1024 else 'mallet'
+
+
+def train(input_dir, output_dir, num_topics, random_seed=None, num_threads=None, algorithm='gibbs',
+          stopwords_file=None, iterations=None, optimize_interval=optimize_interval, verbose=True):
+    """Tokenize a directory, train a model and write MALLET-format output.
+
+    Args:
+        input_dir (str): directory of plain text files, one document per file.
+        output_dir (str): model directory; created if missing.
+        num_topics (int): number of topics.
+        random_seed (int): optional random seed.
+        num_threads (int): threads and processes; defaults to all available cores.
+        algorithm (str): 'gibbs' or 'variational'.
+        stopwords_file (str): extra stopwords, added to MALLET's stoplist if found.
+        iterations (int): sampling (or variational) iterations.
+        optimize_interval (int): hyperparameter optimization interval (gibbs).
+        verbose (bool): print progress.
+    Returns:
+        str: summary of the run.
+    """
+    start_time = time.time()
+    num_topics = int(num_topics)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    corpus = read_corpus(input_dir, read_stopwords(mallet_stoplist(), stopwords_file), num_threads)
+    if verbose:
+        print('{} documents, {} tokens, {} types'.format(len(corpus.names), len(corpus.doc), len(corpus.vocab)))
+    if algorithm == 'gibbs':
+        topic, alpha, beta_value = train_gibbs(corpus, num_topics, random_seed, num_threads,
+                                               iterations or num_iterations, optimize_interval,
+                                               verbose=verbose)
+    elif algorithm == 'variational':
+        topic, alpha, beta_value = train_variational(corpus, num_topics, random_seed, num_threads,
+                                                     iterations or vb_iterations, verbose=verbose)
+    else:
+        raise ValueError('Unknown algorithm {!r}; use gibbs or variational.'.format(algorithm))
+
+    doc_topic = sparse_counts(corpus.doc, topic, (len(corpus.names), num_topics)).toarray()
+    topic_type = sparse_counts(topic, corpus.typeindex, (num_topics, len(corpus.vocab)))
+    write_state(os.path.join(output_dir, model_state), corpus, topic, alpha, beta_value)
+    write_keys(os.path.join(output_dir, model_keys), topic_type, corpus.vocab, alpha)
+    write_composition(os.path.join(output_dir, model_composition), corpus.names, doc_topic, alpha)
+    write_counts(os.path.join(output_dir, model_counts), topic_type, corpus.vocab)
+    return '{} model: {} topics, {} documents, {} tokens in {:.1f} seconds.'.format(
+        algorithm, num_topics, len(corpus.names), len(corpus.doc), time.time() - start_time)
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Train an LDA topic model in-process and write MALLET-compatible topic-state.gz, keys.txt, composition.txt and topic_counts.txt.', epilog='EXAMPLE:\n  lda_engine.py -i caches/text_files_clean -o caches/model -k 50 -s 10 -a gibbs\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/text_files_clean', help='directory of text files')
+    PARSER.add_argument('-o', '--output', default='caches/model', help='model directory')
+    PARSER.add_argument('-k', '--num-topics', type=int, default=50, help='number of topics')
+    PARSER.add_argument('-s', '--random-seed', type=int, default=None, help='random seed')
+    PARSER.add_argument('-t', '--threads', type=int, default=None, help='threads, default all cores')
+    PARSER.add_argument('-a', '--algorithm', default='gibbs', choices=['gibbs', 'variational'], help='training algorithm')
+    PARSER.add_argument('-n', '--iterations', type=int, default=None, help='iterations')
+    PARSER.add_argument('-w', '--stopwords', default='scripts/scrub/stopwords.txt', help='extra stopwords file')
+
+    CL_ARGS = PARSER.parse_args()
+
+    print(train(CL_ARGS.input, CL_ARGS.output, CL_ARGS.num_topics, CL_ARGS.random_seed, CL_ARGS.threads,
+                CL_ARGS.algorithm, CL_ARGS.stopwords, CL_ARGS.iterations))
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+mallet_runner.py
+Run MALLET import-dir and train-topics from Python.
+
+1.  Commands are built as argument lists rather than concatenated strings.
+2.  The number of training threads (--num-threads) and the JVM heap
+      (MALLET_MEMORY, read by the bin/mallet launcher) are sized from the
+      cores and memory available to the container.
+3.  Sweeps over topic counts and random seeds run concurrently inside a CPU
+      budget, each run writing its own model directory under caches/model/,
+      e.g. caches/model/topics50_seed10/.
+
+It can be imported from project notebooks or used from the command line.
+
+v1.0 first version: threaded training and parameter sweeps
+v1.1 MALLET output streamed line by line, as the notebook's !mallet did
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import itertools
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.1"
+
+## DEFAULTS -- match the model resource names in settings.py
+
+mallet_path       = 'mallet'
+model_file        = 'topics.mallet'
+model_state       = 'topic-state.gz'
+model_keys        = 'keys.txt'
+model_composition = 'composition.txt'
+model_counts      = 'topic_counts.txt'
+model_diagnostics = 'diagnostics.xml'
+model_log         = 'mallet.log'
+min_heap_mb       = 1024
+memory_fraction   = 0.75
+
+
+## RESOURCES
+
+def available_cpus():
+    """Return the number of cores this process may run on.
+
+    Returns:
+        int: cores in the CPU affinity mask, falling back to os.cpu_count().
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_mb():
+    """Return the memory available for new processes, in megabytes.
+
+    Reads MemAvailable from /proc/meminfo, falling back to total physical memory.
+
+    Returns:
+        int: available memory in MB.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError):
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+def resource_plan(num_runs=1, cpu_budget=None, threads_per_run=None):
+    """Share cores and memory between concurrent MALLET runs.
+
+    Args:
+        num_runs (int): number of runs to schedule.
+        cpu_budget (int): total cores to use; defaults to all available cores.
+        threads_per_run (int): training threads for each run; defaults to an even
+            share of the budget.
+    Returns:
+        tuple: concurrent runs (int), threads per run (int), heap per run in MB (int)
+    """
+    cpu_budget = max(1, min(int(cpu_budget or available_cpus()), available_cpus()))
+    if threads_per_run is None:
+        threads_per_run = max(1, cpu_budget // max(1, num_runs))
+    threads_per_run = max(1, min(int(threads_per_run), cpu_budget))
+    workers = max(1, min(num_runs, cpu_budget // threads_per_run))
+    heap_mb = max(min_heap_mb, int(available_memory_mb() * memory_fraction) // workers)
+    return workers, threads_per_run, heap_mb
+
+
+## COMMANDS
+
+def import_dir_args(input_dir, output_file, stopwords_file=None, extra_args=None):
+    """Build the argument list for `mallet import-dir`.
+
+    Args:
+        input_dir (str): directory of plain text files, one document per file.
+        output_file (str): path of the .mallet instance file to write.
+        stopwords_file (str): optional extra stopwords file.
+        extra_args (list): any further MALLET arguments.
+    Returns:
+        list: command arguments.
+    """
+    args = [mallet_path, 'import-dir',
+            '--input', input_dir,
+            '--output', output_file,
+            '--keep-sequence',
+            '--remove-stopwords']
+    if stopwords_file:
+        args += ['--extra-stopwords', stopwords_file]
+    return args + list(extra_args or [])
+
+
+def train_topics_args(input_file, output_dir, num_topics, random_seed=None, num_threads=1,
+                      optimize_interval=10, diagnostics=False, extra_args=None):
+    """Build the argument list for `mallet train-topics`.
+
+    Output file names follow settings.py, written inside output_dir.
+
+    Args:
+        input_file (str): .mallet instance file produced by import-dir.
+        output_dir (str): model directory for the state, keys, composition and counts files.
+        num_topics (int): number of topics.
+        random_seed (int): optional random seed.
+        num_threads (int): number of sampling threads.
+        optimize_interval (int): hyperparameter optimization interval.
+        diagnostics (bool): also write diagnostics.xml.
+        extra_args (list): any further MALLET arguments.
+    Returns:
+        list: command arguments.
+    """
+    args = [mallet_path, 'train-topics',
+            '--input', input_file,
+            '--num-topics', str(num_topics),
+            '--num-threads', str(num_threads),
+            '--optimize-interval', str(optimize_interval),
+            '--output-state', os.path.join(output_dir, model_state),
+            '--output-topic-keys', os.path.join(output_dir, model_keys),
+            '--output-doc-topics', os.path.join(output_dir, model_composition),
+            '--word-topic-counts-file', os.path.join(output_dir, model_counts)]
+    if random_seed is not None:
+        args += ['--random-seed', str(random_seed)]
+    if diagnostics:
+        args += ['--diagnostics-file', os.path.join(output_dir, model_diagnostics)]
+    return args + list(extra_args or [])
+
+
+def run_mallet(args, heap_mb=None, log_file=None, echo=True):
+    """Run a MALLET command with a sized JVM heap, showing its output as it runs.
+
+    Args:
+        args (list): command arguments, e.g. from train_topics_args().
+        heap_mb (int): JVM heap in MB, passed through MALLET_MEMORY.
+        log_file (str): optional file for the combined stdout/stderr, written
+            line by line.
+        echo (bool): print each line of output as it arrives (e.g. the
+            training progress in a notebook).
+    Returns:
+        str: command output.
+    Raises:
+        subprocess.CalledProcessError: if MALLET exits with an error.
+    """
+    env = dict(os.environ)
+    if heap_mb:
+        env['MALLET_MEMORY'] = '{}m'.format(int(heap_mb))
+    lines = []
+    log = open(log_file, 'w') if log_file else None
+    proc = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True, bufsize=1)
+    try:
+        for line in proc.stdout:
+            lines.append(line)
+            if echo:
+                print(line, end='', flush=True)
+            if log:
+                log.write(line)
+                log.flush()
+    finally:
+        proc.stdout.close()
+        if log:
+            log.close()
+    if proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, args, output=''.join(lines))
+    return ''.join(lines)
+
+
+## PIPELINE
+
+def import_dir(input_dir, output_file, stopwords_file=None, heap_mb=None):
+    """Import a directory of text files into a MALLET instance file.
+
+    Returns:
+        str: MALLET output.
+    """
+    if heap_mb is None:
+        heap_mb = resource_plan()[2]
+    return run_mallet(import_dir_args(input_dir, output_file, stopwords_file), heap_mb)
+
+
+def train_topics(input_file, output_dir, num_topics, random_seed=None, num_threads=None,
+                 heap_mb=None, diagnostics=False, log_file=None):
+    """Train one topic model, using every available core by default.
+
+    Args:
+        input_file (str): .mallet instance file.
+        output_dir (str): model directory; created if missing.
+        num_topics (int): number of topics.
+        random_seed (int): optional random seed.
+        num_threads (int): training threads; defaults to all available cores.
+        heap_mb (int): JVM heap in MB; defaults to a share of available memory.
+        diagnostics (bool): also write diagnostics.xml.
+        log_file (str): optional log file for MALLET output.
+    Returns:
+        str: MALLET output (also printed as it runs).
+    """
+    _workers, threads, heap = resource_plan(1, threads_per_run=num_threads)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    args = train_topics_args(input_file, output_dir, num_topics, random_seed, threads,
+                             diagnostics=diagnostics)
+    return run_mallet(args, heap_mb or heap, log_file)
+
+
+def sweep_dir(model_root, num_topics, random_seed):
+    """Return the model directory for one sweep run, e.g. caches/model/topics50_seed10."""
+    if random_seed is None:
+        return os.path.join(model_root, 'topics{}'.format(num_topics))
+    return os.path.join(model_root, 'topics{}_seed{}'.format(num_topics, random_seed))
+
+
+def sweep(input_file, model_root, topic_counts, random_seeds, cpu_budget=None,
+          threads_per_run=None, diagnostics=False, verbose=True):
+    """Train models over every combination of topic count and seed, concurrently.
+
+    Runs share the CPU budget: each gets threads_per_run sampling threads and as
+    many run at once as the budget allows. Each run writes to its own directory
+    (see sweep_dir) with its MALLET output in mallet.log.
+
+    Args:
+        input_file (str): .mallet instance file shared by all runs.
+        model_root (str): parent directory for run directories, e.g. caches/model.
+        topic_counts (list): numbers of topics.
+        random_seeds (list): random seeds.
+        cpu_budget (int): total cores to use; defaults to all available cores.
+        threads_per_run (int): training threads per run; defaults to an even share.
+        diagnostics (bool): also write diagnostics.xml for each run.
+        verbose (bool): print progress.
+    Returns:
+        list: (num_topics, random_seed, model directory, error or None) for each run.
+    """
+    runs = list(itertools.product(topic_counts, random_seeds))
+    workers, threads, heap = resource_plan(len(runs), cpu_budget, threads_per_run)
+    if verbose:
+        print('Sweep: {} runs, {} at a time, {} threads and {} MB heap each.'.format(len(runs), workers, threads, heap))
+
+    def run(params):
+        num_topics, random_seed = params
+        output_dir = sweep_dir(model_root, num_topics, random_seed)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        args = train_topics_args(input_file, output_dir, num_topics, random_seed, threads,
+                                 diagnostics=diagnostics)
+        try:
+            ## concurrent runs would mix their output; each keeps its own log
+            run_mallet(args, heap, os.path.join(output_dir, model_log), echo=False)
+            error = None
+        except subprocess.CalledProcessError as err:
+            error = err
+        if verbose:
+            print('  {} {}'.format('failed:' if error else 'done:  ', output_dir))
+        return num_topics, random_seed, output_dir, error
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, runs))
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Train MALLET topic models with threads and JVM heap sized to this machine. Several topic counts or seeds run as a concurrent sweep, one model directory per run.', epilog='EXAMPLE:\n  mallet_runner.py -i caches/model/topics.mallet -o caches/model -k 25 50 100 -s 10 11 -c 8\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', required=True, help='mallet instance file from import-dir')
+    PARSER.add_argument('-o', '--output', default='caches/model', help='model directory (single run) or parent of sweep directories')
+    PARSER.add_argument('-k', '--num-topics', nargs='+', type=int, default=[50], help='number(s) of topics')
+    PARSER.add_argument('-s', '--random-seed', nargs='+', type=int, default=[None], help='random seed(s)')
+    PARSER.add_argument('-c', '--cpu-budget', type=int, help='total cores to use, default all')
+    PARSER.add_argument('-t', '--threads-per-run', type=int, help='training threads per run')
+    PARSER.add_argument('-d', '--diagnostics', action='store_true', help='write diagnostics.xml')
+
+    CL_ARGS = PARSER.parse_args()
+
+    if len(CL_ARGS.num_topics) == 1 and len(CL_ARGS.random_seed) == 1:
+        train_topics(CL_ARGS.input, CL_ARGS.output, CL_ARGS.num_topics[0], CL_ARGS.random_seed[0],
+                     CL_ARGS.threads_per_run, diagnostics=CL_ARGS.diagnostics)
+    else:
+        sweep(CL_ARGS.input, CL_ARGS.output, CL_ARGS.num_topics, CL_ARGS.random_seed,
+              CL_ARGS.cpu_budget, CL_ARGS.threads_per_run, CL_ARGS.diagnostics)
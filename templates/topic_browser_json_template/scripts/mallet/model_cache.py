@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+model_cache.py
+Cache the artifacts derived from a MALLET topic-state.gz file.
+
+The first load parses the state file (state_reader.py), aggregates the counts
+(model_counts.py) and saves in a binary format:
+
+    doc_lengths.npy          tokens per document, up to the last document with a token
+    vocab.txt                types with at least one token, in alphabetical order
+    term_freq.npy            tokens per type, in vocab order
+    topic_term_counts.npz    sparse topics x vocab counts
+    doc_topic_counts.npz     sparse documents x topics counts
+    phi.npy                  smoothed topics x vocab distributions (beta)
+    theta.npy                smoothed documents x topics distributions (alpha)
+    params.json              alpha, beta and the cache key
+    state/                   the state arrays themselves (state_reader.py), with
+                             their own vocab.txt in typeindex order
+
+The cache directory is named by a hash of the state file's contents, e.g.
+caches/model/cache/3f2a.../, so a retrained model never reuses stale
+artifacts, and every browser generator loads the same files in milliseconds
+after the first parse. Arrays are memory-mapped on load.
+
+v1.0 first version: hash-keyed artifact cache
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse
+try:
+    from scripts.mallet.state_reader import read_state, save_state_arrays, load_state_arrays
+    from scripts.mallet.model_counts import topic_term_counts, doc_topic_counts, smooth_and_normalize
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from state_reader import read_state, save_state_arrays, load_state_arrays
+    from model_counts import topic_term_counts, doc_topic_counts, smooth_and_normalize
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+cache_root      = 'caches/model/cache'
+hash_memo_file  = 'state_hashes.json'
+vocab_file      = 'vocab.txt'
+params_file     = 'params.json'
+state_dir       = 'state'
+
+## The cached artifacts of one model. Arrays are memory-mapped read-only.
+Model = namedtuple('Model', ['key', 'path', 'doc_lengths', 'vocab', 'term_freq',
+                             'topic_term_counts', 'doc_topic_counts', 'phi', 'theta',
+                             'alpha', 'beta'])
+
+
+## KEYS
+
+def file_hash(path, blocksize=1 << 20):
+    """Return the hex digest of a file's contents.
+
+    Args:
+        path (str): file to hash.
+        blocksize (int): bytes read at a time.
+    Returns:
+        str: 32 character blake2b digest.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fhandle:
+        for block in iter(lambda: fhandle.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def state_key(statefile, cache_root=cache_root):
+    """Return the cache key for a state file.
+
+    Hashes are remembered by path, size and modification time in
+    state_hashes.json, so an unchanged file is only hashed once.
+
+    Args:
+        statefile (str): path to a topic-state.gz file.
+        cache_root (str): cache directory holding the memo.
+    Returns:
+        str: hash of the state file.
+    """
+    memo_path = os.path.join(cache_root, hash_memo_file)
+    stat = os.stat(statefile)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    memo = {}
+    if os.path.isfile(memo_path):
+        with open(memo_path, 'r') as memo_file:
+            memo = json.load(memo_file)
+    entry = memo.get(os.path.abspath(statefile))
+    if entry and entry['stamp'] == stamp:
+        return entry['hash']
+    key = file_hash(statefile)
+    memo[os.path.abspath(statefile)] = {'stamp': stamp, 'hash': key}
+    if not os.path.isdir(cache_root):
+        os.makedirs(cache_root)
+    with open(memo_path, 'w') as memo_file:
+        json.dump(memo, memo_file, indent=1)
+    return key
+
+
+## BUILD
+
+def build_artifacts(statefile, cache_dir, key=None):
+    """Parse a state file and write every artifact into cache_dir.
+
+    Args:
+        statefile (str): path to a topic-state.gz file.
+        cache_dir (str): empty directory to write.
+        key (str): cache key recorded in params.json.
+    """
+    state = read_state(statefile)
+    num_topics = len(state.alpha)
+    types = np.array([x if x is not None else '' for x in state.vocab], dtype=object)
+
+    ## number types by alphabetical rank, then drop types with no tokens
+    type_order = np.argsort(types, kind='stable')
+    type_rank = np.empty(len(types), dtype=np.int32)
+    type_rank[type_order] = np.arange(len(types), dtype=np.int32)
+    token_types = type_rank[state.typeindex]
+    term_freq = np.bincount(token_types, minlength=len(types))
+    present = term_freq > 0
+    doc_lengths = np.bincount(state.doc).astype(np.int32)
+
+    phi_counts = topic_term_counts(state.topic, token_types, num_topics, len(types))[:, present]
+    theta_counts = doc_topic_counts(state.doc, state.topic, len(doc_lengths), num_topics)
+
+    save_state_arrays(state, os.path.join(cache_dir, state_dir))
+    np.save(os.path.join(cache_dir, 'doc_lengths.npy'), doc_lengths)
+    np.save(os.path.join(cache_dir, 'term_freq.npy'), term_freq[present].astype(np.int32))
+    with io.open(os.path.join(cache_dir, vocab_file), 'w', encoding='utf-8') as vocab:
+        vocab.write(u'\n'.join(types[type_order][present]))
+    scipy.sparse.save_npz(os.path.join(cache_dir, 'topic_term_counts.npz'), phi_counts)
+    scipy.sparse.save_npz(os.path.join(cache_dir, 'doc_topic_counts.npz'), theta_counts)
+    np.save(os.path.join(cache_dir, 'phi.npy'), smooth_and_normalize(phi_counts, state.beta))
+    np.save(os.path.join(cache_dir, 'theta.npy'), smooth_and_normalize(theta_counts, state.alpha))
+    ## params.json is written last: its presence marks a complete cache entry
+    with open(os.path.join(cache_dir, params_file), 'w') as params:
+        json.dump({'alpha': state.alpha, 'beta': state.beta, 'key': key,
+                   'statefile': os.path.abspath(statefile)}, params)
+
+
+## LOAD
+
+def load_artifacts(cache_dir, mmap_mode='r'):
+    """Load the artifacts in a cache directory.
+
+    Args:
+        cache_dir (str): directory written by build_artifacts.
+        mmap_mode (str): passed to np.load.
+    Returns:
+        Model: the cached artifacts.
+    """
+    def array(name):
+        return np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode=mmap_mode)
+    with io.open(os.path.join(cache_dir, vocab_file), 'r', encoding='utf-8') as vocab:
+        words = vocab.read().split(u'\n')
+    with open(os.path.join(cache_dir, params_file), 'r') as params:
+        params = json.load(params)
+    return Model(params['key'], cache_dir, array('doc_lengths'), words, array('term_freq'),
+                 scipy.sparse.load_npz(os.path.join(cache_dir, 'topic_term_counts.npz')),
+                 scipy.sparse.load_npz(os.path.join(cache_dir, 'doc_topic_counts.npz')),
+                 array('phi'), array('theta'), params['alpha'], params['beta'])
+
+
+def is_complete(cache_dir):
+    """Return True if cache_dir holds a finished entry (entries from before the state/ folder are not)."""
+    return os.path.isfile(os.path.join(cache_dir, params_file)) and os.path.isfile(os.path.join(cache_dir, state_dir, params_file))
+
+
+def cache_dir_for(statefile, cache_root=cache_root):
+    """Return the cache directory for a state file, whether or not it exists yet."""
+    return os.path.join(cache_root, state_key(statefile, cache_root))
+
+
+def load_model(statefile, cache_root=cache_root, mmap_mode='r', verbose=False):
+    """Load the artifacts for a state file, building the cache entry on first use.
+
+    The entry is built in a temporary directory and renamed into place, so an
+    interrupted or concurrent build never leaves a partial entry behind.
+
+    Args:
+        statefile (str): path to a topic-state.gz file.
+        cache_root (str): parent directory of cache entries.
+        mmap_mode (str): passed to np.load.
+        verbose (bool): print whether the cache was used.
+    Returns:
+        Model: the cached artifacts.
+    """
+    key = state_key(statefile, cache_root)
+    cache_dir = os.path.join(cache_root, key)
+    if not is_complete(cache_dir):
+        if verbose:
+            print('Parsing {} into {}...'.format(statefile, cache_dir))
+        build_dir = tempfile.mkdtemp(prefix='.' + key + '-', dir=cache_root)
+        try:
+            build_artifacts(statefile, build_dir, key)
+            if os.path.isdir(cache_dir):
+                shutil.rmtree(cache_dir)
+            os.rename(build_dir, cache_dir)
+        except OSError:
+            ## another process finished the same entry first
+            shutil.rmtree(build_dir, ignore_errors=True)
+            if not is_complete(cache_dir):
+                raise
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+    elif verbose:
+        print('Loading cached model {}'.format(cache_dir))
+    return load_artifacts(cache_dir, mmap_mode)
+
+
+def with_num_docs(model, num_docs):
+    """Return a model with its document arrays padded to num_docs documents.
+
+    The state file has no line for a document without tokens (e.g. a text
+    that is all stop words), so documents after the last one with a token
+    are missing from doc_lengths, doc_topic_counts and theta. The
+    composition file lists every document; its count is passed here.
+
+    Args:
+        model (Model): cached artifacts.
+        num_docs (int): number of documents in the model.
+    Returns:
+        Model: the model, with empty documents added at the end if needed.
+    """
+    extra = num_docs - len(model.doc_lengths)
+    if extra <= 0:
+        return model
+    empty = scipy.sparse.csr_matrix((extra, model.doc_topic_counts.shape[1]), dtype=model.doc_topic_counts.dtype)
+    return model._replace(doc_lengths=np.concatenate([model.doc_lengths, np.zeros(extra, dtype=model.doc_lengths.dtype)]),
+                          doc_topic_counts=scipy.sparse.vstack([model.doc_topic_counts, empty], format=model.doc_topic_counts.format),
+                          theta=np.concatenate([model.theta, smooth_and_normalize(empty, model.alpha, model.theta.dtype)]))
+
+
+def load_model_state(model, mmap_mode='r'):
+    """Return the state arrays (state_reader.State) stored with a cached model."""
+    return load_state_arrays(os.path.join(model.path, state_dir), mmap_mode)
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Build (or check) the cached artifacts for a MALLET state file.', epilog='EXAMPLE:\n  model_cache.py -i caches/model/topic-state.gz -o caches/model/cache\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/model/topic-state.gz', help='MALLET state file')
+    PARSER.add_argument('-o', '--output', default=cache_root, help='cache root directory')
+
+    CL_ARGS = PARSER.parse_args()
+
+    MODEL = load_model(CL_ARGS.input, CL_ARGS.output, verbose=True)
+    print('{} documents, {} terms, {} topics in {}'.format(len(MODEL.doc_lengths), len(MODEL.vocab), len(MODEL.alpha), MODEL.path))
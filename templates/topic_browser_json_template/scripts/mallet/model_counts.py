@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+model_counts.py
+Aggregate MALLET state arrays into topic-term and document-topic matrices.
+
+Counts are accumulated as scipy sparse matrices straight from the int32
+arrays produced by state_reader.py, a chunk of tokens at a time, so no
+token-level DataFrame, groupby or pivot is needed. Smoothing with the alpha
+or beta prior and row normalization are applied directly to the output
+array, giving the phi (topics x terms) and theta (documents x topics)
+distributions used by pyLDAvis and the topic browsers.
+
+v1.0 first version: sparse counts, smoothing and normalization
+"""
+
+## IMPORT
+
+import numpy as np
+import scipy.sparse
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+chunksize = 10000000
+
+
+## COUNTS
+
+def sparse_counts(rows, cols, shape, chunksize=chunksize):
+    """Count (row, col) pairs into a sparse matrix.
+
+    Args:
+        rows (array): row index for each token.
+        cols (array): column index for each token.
+        shape (tuple): (number of rows, number of columns).
+        chunksize (int): tokens converted at a time, to bound temporary memory.
+    Returns:
+        csr_matrix: int32 counts.
+    """
+    counts = scipy.sparse.csr_matrix(shape, dtype=np.int32)
+    for start in range(0, len(rows), chunksize):
+        chunk_rows = np.asarray(rows[start:start+chunksize])
+        chunk_cols = np.asarray(cols[start:start+chunksize])
+        ones = np.ones(len(chunk_rows), dtype=np.int32)
+        counts = counts + scipy.sparse.coo_matrix((ones, (chunk_rows, chunk_cols)), shape=shape).tocsr()
+    counts.sum_duplicates()
+    return counts
+
+
+def topic_term_counts(topic, typeindex, num_topics, num_types, chunksize=chunksize):
+    """Return the topics x types token counts.
+
+    Args:
+        topic (array): topic assignment for each token.
+        typeindex (array): type (column) index for each token.
+        num_topics (int): number of topics.
+        num_types (int): number of types.
+        chunksize (int): tokens converted at a time.
+    Returns:
+        csr_matrix: int32 counts.
+    """
+    return sparse_counts(topic, typeindex, (num_topics, num_types), chunksize)
+
+
+def doc_topic_counts(doc, topic, num_docs, num_topics, chunksize=chunksize):
+    """Return the documents x topics token counts.
+
+    Args:
+        doc (array): document index for each token.
+        topic (array): topic assignment for each token.
+        num_docs (int): number of documents.
+        num_topics (int): number of topics.
+        chunksize (int): tokens converted at a time.
+    Returns:
+        csr_matrix: int32 counts.
+    """
+    return sparse_counts(doc, topic, (num_docs, num_topics), chunksize)
+
+
+def smooth_and_normalize(counts, prior, dtype=np.float64):
+    """Add a prior to sparse counts and normalize each row to sum to 1.
+
+    Equivalent to pivoting the counts, filling missing cells with 0, adding the
+    prior and applying an l1 row normalization, but written into a single
+    output array.
+
+    Args:
+        counts (csr_matrix): token counts.
+        prior (float or list): smoothing value -- beta for topic-term counts, or
+            one alpha per topic (column) for document-topic counts.
+        dtype (type): output float type.
+    Returns:
+        ndarray: dense matrix of row distributions.
+    """
+    counts = scipy.sparse.csr_matrix(counts)
+    counts.sum_duplicates()
+    normed = np.empty(counts.shape, dtype=dtype)
+    normed[:] = np.asarray(prior, dtype=dtype)
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    normed[rows, counts.indices] += counts.data
+    normed /= normed.sum(axis=1)[:, np.newaxis]
+    return normed
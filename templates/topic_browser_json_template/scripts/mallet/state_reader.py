@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+state_reader.py
+Read a MALLET topic-state.gz file into compact NumPy arrays.
+
+The state file has one line per token:
+
+    #doc source pos typeindex type topic
+    #alpha : 0.1 0.1 ...
+    #beta : 0.01
+    0 NA 0 0 humanities 12
+
+The file is decompressed once and parsed in chunks, keeping only three int32
+arrays (doc, typeindex, topic) and the vocabulary, interned once per type in
+typeindex order. The hyperparameters come from the same pass. Parsed arrays can
+be saved as .npy files and memory-mapped back almost instantly.
+
+v1.0 first version: chunked parsing and .npy caching
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+chunksize       = 1000000
+state_arrays    = ('doc', 'typeindex', 'topic')
+vocab_file      = 'vocab.txt'
+params_file     = 'params.json'
+
+## A parsed state file: int32 arrays with one entry per token, the vocabulary
+## indexed by typeindex, alpha (one value per topic) and beta.
+State = namedtuple('State', ['doc', 'typeindex', 'topic', 'vocab', 'alpha', 'beta'])
+
+
+## PARSING
+
+def read_params(state):
+    """Read the three header lines from an open, decompressed state file.
+
+    Args:
+        state (file): text-mode handle positioned at the start of the file.
+    Returns:
+        tuple: alpha (list of float), beta (float)
+    """
+    state.readline()  ## column names
+    alpha = [float(x) for x in state.readline().split(':')[1].split()]
+    beta = float(state.readline().split(':')[1])
+    return alpha, beta
+
+
+def iter_state_chunks(statefile, chunksize=chunksize):
+    """Stream a state file in chunks of tokens.
+
+    The first item yielded is the hyperparameters; each following item holds the
+    arrays for up to chunksize tokens, plus the types seen for the first time in
+    that chunk.
+
+    Args:
+        statefile (str): path to a topic-state.gz file produced by MALLET.
+        chunksize (int): number of tokens per chunk.
+    Yields:
+        tuple: (alpha, beta), then (doc, typeindex, topic, new_types) where the
+            arrays are int32 and new_types maps typeindex (int) to type (str).
+    """
+    with gzip.open(statefile, 'rt', encoding='utf-8') as state:
+        yield read_params(state)
+        seen = np.zeros(0, dtype=bool)
+        reader = pd.read_csv(state, sep=' ', header=None, usecols=[0, 3, 4, 5],
+                             names=['doc', 'source', 'pos', 'typeindex', 'type', 'topic'],
+                             dtype={'doc': np.int32, 'typeindex': np.int32, 'type': str, 'topic': np.int32},
+                             na_filter=False, quoting=csv.QUOTE_NONE, chunksize=chunksize)
+        for chunk in reader:
+            typeindex = chunk['typeindex'].values
+            if typeindex.size and typeindex.max() >= seen.size:
+                seen = np.concatenate([seen, np.zeros(typeindex.max() + 1 - seen.size, dtype=bool)])
+            uniq, first = np.unique(typeindex, return_index=True)
+            unseen = ~seen[uniq]
+            types = chunk['type'].values
+            new_types = {int(idx): types[pos] for idx, pos in zip(uniq[unseen], first[unseen])}
+            seen[uniq] = True
+            yield chunk['doc'].values, typeindex, chunk['topic'].values, new_types
+
+
+def read_state(statefile, chunksize=chunksize):
+    """Parse a whole state file into a State of compact arrays.
+
+    Args:
+        statefile (str): path to a topic-state.gz file produced by MALLET.
+        chunksize (int): number of tokens parsed at a time.
+    Returns:
+        State: doc, typeindex and topic arrays, vocab, alpha and beta.
+    """
+    chunks = iter_state_chunks(statefile, chunksize)
+    alpha, beta = next(chunks)
+    docs, typeindexes, topics, vocab = [], [], [], {}
+    for doc, typeindex, topic, new_types in chunks:
+        docs.append(doc)
+        typeindexes.append(typeindex)
+        topics.append(topic)
+        vocab.update(new_types)
+    empty = np.zeros(0, dtype=np.int32)
+    vocab = [vocab.get(idx) for idx in range(max(vocab) + 1)] if vocab else []
+    return State(np.concatenate(docs) if docs else empty,
+                 np.concatenate(typeindexes) if typeindexes else empty,
+                 np.concatenate(topics) if topics else empty,
+                 vocab, alpha, beta)
+
+
+## CACHING
+
+def save_state_arrays(state, cache_dir):
+    """Save a parsed State as doc.npy, typeindex.npy, topic.npy, vocab.txt and params.json.
+
+    Args:
+        state (State): parsed state.
+        cache_dir (str): directory to write; created if missing.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    for name in state_arrays:
+        np.save(os.path.join(cache_dir, name + '.npy'), getattr(state, name))
+    with io.open(os.path.join(cache_dir, vocab_file), 'w', encoding='utf-8') as vocab:
+        vocab.write(u'\n'.join(u'' if word is None else word for word in state.vocab))
+    with open(os.path.join(cache_dir, params_file), 'w') as params:
+        json.dump({'alpha': state.alpha, 'beta': state.beta}, params)
+
+
+def load_state_arrays(cache_dir, mmap_mode='r'):
+    """Load a State saved by save_state_arrays.
+
+    Args:
+        cache_dir (str): directory written by save_state_arrays.
+        mmap_mode (str): passed to np.load; 'r' maps the arrays without reading them.
+    Returns:
+        State: the cached state.
+    """
+    arrays = [np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode=mmap_mode) for name in state_arrays]
+    with io.open(os.path.join(cache_dir, vocab_file), 'r', encoding='utf-8') as vocab:
+        words = vocab.read().split(u'\n')
+    with open(os.path.join(cache_dir, params_file), 'r') as params:
+        params = json.load(params)
+    return State(arrays[0], arrays[1], arrays[2], words, params['alpha'], params['beta'])
+
+
+def load_state(statefile, cache_dir=None, chunksize=chunksize):
+    """Load a state file, using the .npy cache in cache_dir when it is up to date.
+
+    Args:
+        statefile (str): path to a topic-state.gz file produced by MALLET.
+        cache_dir (str): optional cache directory; refreshed if older than statefile.
+        chunksize (int): number of tokens parsed at a time.
+    Returns:
+        State: the parsed state.
+    """
+    if cache_dir:
+        marker = os.path.join(cache_dir, params_file)
+        if os.path.isfile(marker) and os.path.getmtime(marker) >= os.path.getmtime(statefile):
+            return load_state_arrays(cache_dir)
+    state = read_state(statefile, chunksize)
+    if cache_dir:
+        save_state_arrays(state, cache_dir)
+    return state
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Parse a MALLET topic-state.gz file into .npy arrays (doc, typeindex, topic), vocab.txt and params.json.', epilog='EXAMPLE:\n  state_reader.py -i caches/model/topic-state.gz -o caches/model/state\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/model/topic-state.gz', help='MALLET state file')
+    PARSER.add_argument('-o', '--output', default='caches/model/state', help='cache directory for the arrays')
+    PARSER.add_argument('-c', '--chunksize', type=int, default=chunksize, help='tokens parsed at a time')
+
+    CL_ARGS = PARSER.parse_args()
+
+    STATE = read_state(CL_ARGS.input, CL_ARGS.chunksize)
+    save_state_arrays(STATE, CL_ARGS.output)
+    print('{} tokens, {} documents, {} types, {} topics saved to {}'.format(
+        STATE.doc.size, int(STATE.doc.max()) + 1 if STATE.doc.size else 0, len(STATE.vocab), len(STATE.alpha), CL_ARGS.output))
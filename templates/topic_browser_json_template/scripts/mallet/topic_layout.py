@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+topic_layout.py
+Compute and cache the 2-D layout of a topic model's topics.
+
+pyLDAvis and dfr-browser (topic_scaled.csv) both place topics on a plane by
+scaling the Jensen-Shannon divergences between their word distributions.
+This module computes that layout once per model and stores it with the
+cached model artifacts (scripts/mallet/model_cache.py):
+
+    1. the divergence matrix is computed with vectorized NumPy, a block of
+       topics at a time, with the blocks spread over threads;
+    2. the matrix is scaled to 2-D with a selectable algorithm:
+           pcoa    principal coordinate analysis (classical MDS), the
+                   pyLDAvis and dfrtopics default
+           mmds    metric MDS (requires scikit-learn)
+           tsne    t-SNE (requires scikit-learn)
+    3. the matrix and the coordinates are saved as .npy files in the model's
+       cache directory, keyed by the model hash, so every browser generator
+       reuses the same layout.
+
+v1.0 first version: blocked divergences, selectable scaling, per-model cache
+v1.1 divergence memory budget shared by all threads, terms compared a slice at a time
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.special import xlogy
+try:
+    from scripts.mallet.model_cache import load_model
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from model_cache import load_model
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.1"
+
+## DEFAULTS
+
+algorithm       = 'pcoa'
+block_bytes     = 64 * 1024 * 1024
+random_seed     = 0
+
+
+## DIVERGENCES
+
+def jsd_matrix(dists, block_bytes=block_bytes, workers=None):
+    """Return the Jensen-Shannon divergences between every pair of rows.
+
+    Uses JSD(P, Q) = (H(P) + H(Q)) / 2 - H(M) with M = (P + Q) / 2 (natural
+    log), so only the mixture entropies are computed pairwise. Rows are
+    compared a block at a time, and each block a slice of the terms at a
+    time, so that the temporary mixture arrays of all the threads together
+    stay under block_bytes; only the upper triangle is computed.
+
+    Args:
+        dists (ndarray): row distributions (topics x terms); zeros allowed.
+        block_bytes (int): memory budget for the mixtures of all threads.
+        workers (int): threads; defaults to the number of CPUs.
+    Returns:
+        ndarray: symmetric matrix of divergences.
+    """
+    dists = np.asarray(dists, dtype=np.float64)
+    n, width = dists.shape
+    neg_entropy = xlogy(dists, dists).sum(axis=1)
+    workers = workers or os.cpu_count()
+    budget = max(1, block_bytes // workers)
+    rows = max(1, min(n, budget // max(1, n * width * 8)))
+    cols = max(1, min(width, budget // (rows * n * 8)))
+    divergences = np.zeros((n, n))
+
+    def block(start):
+        stop = min(start + rows, n)
+        mix_neg_entropy = np.zeros((stop - start, n - start))
+        for col in range(0, width, cols):
+            mix = 0.5 * (dists[start:stop, np.newaxis, col:col + cols] + dists[np.newaxis, start:, col:col + cols])
+            mix_neg_entropy += xlogy(mix, mix).sum(axis=2)
+        values = 0.5 * (neg_entropy[start:stop, np.newaxis] + neg_entropy[np.newaxis, start:]) - mix_neg_entropy
+        divergences[start:stop, start:] = np.maximum(values, 0)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(block, range(0, n, rows)))
+    upper = np.triu(divergences, 1)
+    return upper + upper.T
+
+
+## SCALING
+
+def pcoa(distances, k=2, seed=None):
+    """Principal coordinate analysis (classical, Torgerson MDS), as R's cmdscale.
+
+    The sign of each axis is fixed so that its largest coordinate is positive,
+    making the layout reproducible.
+
+    Returns:
+        ndarray: one row of k coordinates per item.
+    """
+    n = distances.shape[0]
+    centering = np.eye(n) - np.ones((n, n)) / n
+    inner = -0.5 * centering.dot(distances ** 2).dot(centering)
+    eigvals, eigvecs = np.linalg.eigh(inner)
+    top = np.argsort(eigvals)[::-1][:k]
+    coords = eigvecs[:, top] * np.sqrt(np.maximum(eigvals[top], 0))
+    signs = np.sign(coords[np.abs(coords).argmax(axis=0), np.arange(coords.shape[1])])
+    signs[signs == 0] = 1
+    return coords * signs
+
+
+def mmds(distances, k=2, seed=random_seed):
+    """Metric multidimensional scaling with scikit-learn.
+
+    Returns:
+        ndarray: one row of k coordinates per item.
+    """
+    from sklearn.manifold import MDS
+    return MDS(n_components=k, dissimilarity='precomputed', random_state=seed).fit_transform(distances)
+
+
+def tsne(distances, k=2, seed=random_seed):
+    """t-SNE with scikit-learn, with perplexity capped for small models.
+
+    Returns:
+        ndarray: one row of k coordinates per item.
+    """
+    from sklearn.manifold import TSNE
+    perplexity = min(30.0, max(1.0, (distances.shape[0] - 1) / 3.0))
+    return TSNE(n_components=k, metric='precomputed', init='random', perplexity=perplexity,
+                random_state=seed).fit_transform(distances)
+
+
+algorithms = {'pcoa': pcoa, 'mmds': mmds, 'tsne': tsne}
+
+
+def scale(distances, algorithm=algorithm, seed=random_seed):
+    """Scale a distance matrix to 2-D with the named algorithm."""
+    if algorithm not in algorithms:
+        raise ValueError('Unknown layout algorithm {!r}; use one of {}.'.format(algorithm, ', '.join(sorted(algorithms))))
+    return np.asarray(algorithms[algorithm](distances, 2, seed), dtype=np.float64)
+
+
+## MODEL LAYOUTS
+
+def topic_distributions(model, n_words=None):
+    """Return the topic-term distributions compared by the layout.
+
+    Args:
+        model (Model): cached model artifacts.
+        n_words (int): if set, compare only the n_words most frequent words of
+            the corpus, smoothed with beta and renormalized, as dfrtopics does;
+            otherwise compare the full phi, as pyLDAvis does.
+    Returns:
+        ndarray: topics x terms distributions.
+    """
+    if not n_words:
+        return np.asarray(model.phi)
+    words = np.argsort(-np.asarray(model.term_freq), kind='stable')[:n_words]
+    dists = model.topic_term_counts.tocsc()[:, words].toarray() + model.beta
+    return dists / dists.sum(axis=1)[:, np.newaxis]
+
+
+def save_array(path, array):
+    """Save an .npy file atomically, so concurrent readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.npy', dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as tmp_file:
+        np.save(tmp_file, array)
+    os.replace(tmp_path, path)
+
+
+def cached_array(path, compute):
+    """Load an .npy file, or compute and save it if missing."""
+    if os.path.isfile(path):
+        return np.load(path)
+    array = compute()
+    save_array(path, array)
+    return array
+
+
+def load_distances(model, n_words=None, workers=None):
+    """Return the topic divergence matrix, cached in the model directory."""
+    path = os.path.join(model.path, 'jsd-{}.npy'.format(n_words or 'all'))
+    return cached_array(path, lambda: jsd_matrix(topic_distributions(model, n_words), workers=workers))
+
+
+def load_layout(model, algorithm=algorithm, n_words=None, seed=random_seed, workers=None):
+    """Return the topics x 2 layout of a model, computing it on first use.
+
+    Args:
+        model (Model): cached model artifacts (model_cache.load_model).
+        algorithm (str): 'pcoa', 'mmds' or 'tsne'.
+        n_words (int): most frequent words compared; None for all.
+        seed (int): random seed for mmds and tsne.
+        workers (int): threads for the divergence matrix.
+    Returns:
+        ndarray: coordinates, one row per topic in model order.
+    """
+    seed = seed if algorithm != 'pcoa' else 0
+    path = os.path.join(model.path, 'layout-{}-{}-{}.npy'.format(algorithm, n_words or 'all', seed))
+    return cached_array(path, lambda: scale(load_distances(model, n_words, workers), algorithm, seed))
+
+
+def pyldavis_mds(model, algorithm=algorithm, seed=random_seed, workers=None):
+    """Return an mds function for pyLDAvis.prepare that uses the cached layout.
+
+    pyLDAvis passes the full topic-term distributions reordered by topic
+    size, with the original topic numbers as the DataFrame index, so the
+    cached rows are reordered to match.
+
+    Returns:
+        function: distributions -> topics x 2 coordinates.
+    """
+    def mds(topic_term_dists):
+        layout = load_layout(model, algorithm, None, seed, workers)
+        order = getattr(topic_term_dists, 'index', None)
+        if order is None:
+            return layout
+        return layout[np.asarray(order)]
+    return mds
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Compute (or load) the cached 2-D topic layout of a MALLET model.', epilog='EXAMPLE:\n  topic_layout.py -i caches/model/topic-state.gz -a pcoa -o topic_scaled.csv\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-i', '--input', default='caches/model/topic-state.gz', help='MALLET state file')
+    PARSER.add_argument('-c', '--cache', default='caches/model/cache', help='model cache root directory')
+    PARSER.add_argument('-a', '--algorithm', default=algorithm, choices=sorted(algorithms), help='scaling algorithm')
+    PARSER.add_argument('-n', '--words', type=int, default=None, help='compare only the n most frequent words')
+    PARSER.add_argument('-s', '--seed', type=int, default=random_seed, help='random seed for mmds and tsne')
+    PARSER.add_argument('-w', '--workers', type=int, default=None, help='threads for the divergence matrix')
+    PARSER.add_argument('-o', '--output', default=None, help='optional csv of x,y rows')
+
+    CL_ARGS = PARSER.parse_args()
+
+    MODEL = load_model(CL_ARGS.input, CL_ARGS.cache, verbose=True)
+    LAYOUT = load_layout(MODEL, CL_ARGS.algorithm, CL_ARGS.words, CL_ARGS.seed, CL_ARGS.workers)
+    if CL_ARGS.output:
+        np.savetxt(CL_ARGS.output, LAYOUT, delimiter=',')
+    print('{} topic layout for {} topics in {}'.format(CL_ARGS.algorithm, LAYOUT.shape[0], MODEL.path))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+ldavis_prepare.py
+Prepare pyLDAvis visualisation data with NumPy instead of pandas.
+
+pyLDAvis.prepare builds pandas DataFrames for the whole topic-term matrix and
+finds the most relevant terms of every topic with Series.nlargest, once per
+topic for each of the 101 values of lambda. This module computes the same
+payload directly from the phi and theta arrays:
+
+    1. topic sizes, term frequencies, saliency and lift are computed with
+       array arithmetic, in the same order as pyLDAvis so the floating point
+       results are identical;
+    2. the top R terms of all topics are found for each lambda with one
+       partial sort (np.partition) over the topics x terms relevance array,
+       with the lambdas spread over threads;
+    3. the mdsDat, tinfo and token.table tables are assembled as lists and
+       returned as a VisData object, which pyLDAvis.save_html, display and
+       show accept in place of pyLDAvis's PreparedData.
+
+The JSON produced is the same as pyLDAvis.prepare's for the same inputs.
+
+v1.0 first version: NumPy relevance and saliency for pyLDAvis
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+default_plot_opts = {'xlab': 'PC1', 'ylab': 'PC2'}
+
+
+## DATA
+
+class VisData(dict):
+    """The prepared visualisation data, as the dict pyLDAvis serializes.
+
+    Provides the to_dict and to_json methods pyLDAvis uses, so it can be
+    passed to pyLDAvis.save_html, pyLDAvis.display and pyLDAvis.show.
+    """
+
+    def to_dict(self):
+        """Return the data as a plain dict."""
+        return dict(self)
+
+    def to_json(self):
+        """Return the data as the JSON string embedded in the pyLDAvis HTML."""
+        return json.dumps(self.to_dict())
+
+
+## SORTING
+
+def descending_order(values, kind='quicksort'):
+    """Return the indices that sort values in decreasing order.
+
+    Ties are broken exactly as pandas' sort_values(ascending=False) does.
+    """
+    values = np.asarray(values)
+    idx = np.arange(len(values))[::-1]
+    return idx[values[::-1].argsort(kind=kind)][::-1]
+
+
+def top_terms(relevance, n):
+    """Return the n largest entries of each row, as Series.nlargest(n) does.
+
+    Ties are broken by position, and each row's terms are ordered by
+    decreasing relevance.
+
+    Args:
+        relevance (ndarray): topics x terms scores.
+        n (int): terms per topic.
+    Returns:
+        ndarray: topics x n term indices.
+    """
+    if n >= relevance.shape[1]:
+        return np.array([descending_order(row, kind='stable')[:n] for row in relevance])
+    neg = -relevance
+    kth = np.partition(neg, n - 1, axis=1)[:, n - 1]
+    result = np.empty((relevance.shape[0], n), dtype=np.intp)
+    for topic, row in enumerate(neg):
+        (candidates,) = np.nonzero(row <= kth[topic])
+        result[topic] = candidates[row[candidates].argsort(kind='stable')][:n]
+    return result
+
+
+## PREPARE
+
+def prepare(topic_term_dists, doc_topic_dists, doc_lengths, vocab, term_frequency,
+            R=30, lambda_step=0.01, mds='pcoa', n_jobs=-1, plot_opts=None,
+            sort_topics=True, start_index=1):
+    """Prepare the visualisation data; a drop-in replacement for pyLDAvis.prepare.
+
+    Args:
+        topic_term_dists (array): topics x terms distributions (phi).
+        doc_topic_dists (array): documents x topics distributions (theta).
+        doc_lengths (array): tokens per document.
+        vocab (list): the terms, in column order.
+        term_frequency (array): tokens per term. As in pyLDAvis, the
+            frequencies shown are recomputed from phi and the topic sizes.
+        R (int): terms shown per topic.
+        lambda_step (float): step between the lambda values precomputed.
+        mds (str or function): 'pcoa', 'mmds', 'tsne' (pyLDAvis's functions), or
+            a function mapping the topic-term DataFrame to topics x 2 coordinates,
+            such as topic_layout.pyldavis_mds(model).
+        n_jobs (int): threads for the relevance calculation; -1 for all CPUs.
+        plot_opts (dict): axis labels.
+        sort_topics (bool): number the topics by decreasing size.
+        start_index (int): number of the first topic.
+    Returns:
+        VisData: the data for pyLDAvis.save_html, display or show.
+    """
+    phi = np.asarray(topic_term_dists, dtype=np.float64)
+    theta = np.asarray(doc_topic_dists, dtype=np.float64)
+    doc_lengths = np.asarray(doc_lengths)
+    vocab = list(vocab)
+    if len(term_frequency) != phi.shape[1] or len(vocab) != phi.shape[1] or len(doc_lengths) != theta.shape[0]:
+        raise ValueError('Inconsistent input sizes: phi {}, theta {}, {} doc lengths, {} terms, {} term frequencies.'.format(
+            phi.shape, theta.shape, len(doc_lengths), len(vocab), len(term_frequency)))
+    num_topics, num_terms = phi.shape
+    R = min(R, num_terms)
+
+    ## topic sizes, and the topic order (reductions follow pandas' memory layout)
+    topic_freq = np.ascontiguousarray((theta * doc_lengths[:, np.newaxis]).T).sum(axis=1)
+    topic_proportion = topic_freq / topic_freq.sum()
+    order = descending_order(topic_proportion) if sort_topics else np.arange(num_topics)
+    topic_proportion = topic_proportion[order]
+    phi = phi[order]
+
+    ## token counts per topic and term, and their totals per term
+    term_topic_freq = phi * topic_freq[order][:, np.newaxis]
+    term_frequency = term_topic_freq.sum(axis=0)
+    term_proportion = term_frequency / term_frequency.sum()
+
+    ## saliency, for the default (no topic selected) view
+    topic_given_term = phi / np.ascontiguousarray(phi.T).sum(axis=1)
+    kernel = topic_given_term * np.log(topic_given_term / topic_proportion[:, np.newaxis])
+    saliency = term_proportion * kernel.sum(axis=0)
+    default_terms = descending_order(saliency)[:R]
+
+    ## relevance: the top R terms of each topic for every lambda
+    log_lift = np.log(phi / term_proportion)
+    log_ttd = np.log(phi)
+    lambda_seq = np.arange(0, 1 + lambda_step, lambda_step)
+
+    def relevant_terms(lambda_):
+        return top_terms(lambda_ * log_ttd + (1 - lambda_) * log_lift, R)
+
+    workers = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        ranked = np.concatenate(list(executor.map(relevant_terms, lambda_seq)), axis=1)
+
+    ## tinfo: the default view, then each topic's terms in order of first appearance
+    columns = {'Term': [], 'Freq': [], 'Total': [], 'Category': [], 'logprob': [], 'loglift': []}
+
+    def add_rows(terms, freq, total, category, logprob, loglift):
+        columns['Term'].extend(vocab[term] for term in terms)
+        columns['Freq'].extend(freq.tolist())
+        columns['Total'].extend(total.tolist())
+        columns['Category'].extend([category] * len(terms))
+        columns['logprob'].extend(logprob.tolist())
+        columns['loglift'].extend(loglift.tolist())
+
+    ranks = np.arange(R, 0, -1).astype(np.float64)
+    add_rows(default_terms, np.floor(term_frequency[default_terms]), np.floor(term_frequency[default_terms]),
+             'Default', ranks, ranks)
+    shown = [default_terms]
+    for topic in range(num_topics):
+        terms = pd.unique(ranked[topic])
+        shown.append(terms)
+        add_rows(terms, term_topic_freq[topic, terms], term_frequency[terms],
+                 'Topic{}'.format(topic + start_index),
+                 log_ttd[topic, terms].round(4), log_lift[topic, terms].round(4))
+
+    ## token.table: the topic distribution of every term shown, for Freq >= 0.5
+    terms = np.unique(np.concatenate(shown))
+    freq = term_topic_freq[:, terms].T
+    term_idx, topic_idx = np.nonzero(freq >= 0.5)
+    token_freq = freq[term_idx, topic_idx].round() / term_frequency[terms[term_idx]]
+    token_terms = [vocab[term] for term in terms[term_idx]]
+    token_order = sorted(range(len(token_terms)), key=token_terms.__getitem__)
+
+    ## mdsDat: topic coordinates and sizes
+    if isinstance(mds, str):
+        from pyLDAvis import _prepare
+        mds = {'pcoa': _prepare.js_PCoA, 'mmds': _prepare.js_MMDS, 'tsne': _prepare.js_TSNE}.get(mds.lower(), _prepare.js_PCoA)
+    coordinates = np.asarray(mds(pd.DataFrame(phi, index=order)))
+    if coordinates.shape != (num_topics, 2):
+        raise ValueError('mds returned shape {}, expected ({}, 2).'.format(coordinates.shape, num_topics))
+
+    return VisData([
+        ('mdsDat', {'x': coordinates[:, 0].tolist(),
+                    'y': coordinates[:, 1].tolist(),
+                    'topics': list(range(start_index, num_topics + start_index)),
+                    'cluster': [1] * num_topics,
+                    'Freq': (topic_proportion * 100).tolist()}),
+        ('tinfo', columns),
+        ('token.table', {'Topic': [int(topic_idx[i]) + start_index for i in token_order],
+                         'Freq': [float(token_freq[i]) for i in token_order],
+                         'Term': [token_terms[i] for i in token_order]}),
+        ('R', R),
+        ('lambda.step', lambda_step),
+        ('plot.opts', plot_opts or default_plot_opts),
+        ('topic.order', [int(topic) + start_index for topic in order])])
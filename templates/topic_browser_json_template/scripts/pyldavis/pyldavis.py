@@ -13,20 +13,38 @@ pyldavis.ipynb in the WhatEvery1Says Virtual Workspace environment.
 scott.kleinman@csun.edu
 
 v1.0 2018-07-24
+v1.1 read the state file once into compact arrays with state_reader.py
+v1.2 sparse phi/theta counts with model_counts.py instead of groupby and pivot
+v1.3 load phi, theta and the vocabulary from the model_cache.py cache
+v1.4 topic coordinates from the cached topic_layout.py layout
+v1.5 visualisation data prepared with ldavis_prepare.py instead of pyLDAvis.prepare
 """
 
 
 # Imports
 
-import gzip
 import os
+import sys
+import numpy as np
 import pandas as pd
+try:
+    from scripts.mallet.model_cache import load_model, load_model_state
+    from scripts.mallet.topic_layout import pyldavis_mds
+    from scripts.pyldavis.ldavis_prepare import prepare
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mallet'))
+    from model_cache import load_model, load_model_state
+    from topic_layout import pyldavis_mds
+    from ldavis_prepare import prepare
 
 
 # Configuration
 
 data_dir                                  = 'caches/model'
 topic_state_file                          = 'topic-state.gz'
+model_cache_dir                           = 'caches/model/cache'
+topic_layout                              = 'pcoa' # 'pcoa', 'mmds' or 'tsne'
 output_dir                                = '../..browser/pyldavis'
 output_file                               = 'pyLDAvis.html'
 
@@ -49,144 +67,94 @@ show_document_topic_matrix_rows           = 10
 show_smoothed_document_topic_matrix       = False
 show_smoothed_document_topic_matrix_rows  = 10
 
-# State File Functions
-
-def extract_params(statefile):
-    """Extract the alpha and beta values from the statefile.
-
-    Args:
-        statefile (str): Path to statefile produced by MALLET.
-    Returns:
-        tuple: alpha (list), beta    
-    """
-    with gzip.open(statefile, 'r') as state:
-        params = [x.decode('utf8').strip() for x in state.readlines()[1:3]]
-    return (list(params[0].split(":")[1].split(" ")), float(params[1].split(":")[1]))
-
-
-def state_to_df(statefile):
-    """Transform state file into pandas dataframe.
-    The MALLET statefile is tab-separated, and the first two rows contain the alpha and beta hypterparamters.
-    
-    Args:
-        statefile (str): Path to statefile produced by MALLET.
-    Returns:
-        datframe: topic assignment for each token in each document of the model
-    """
-    return pd.read_csv(statefile,
-                       compression='gzip',
-                       sep=' ',
-                       skiprows=[1,2]
-                       )
+
+# Load the Model Artifacts
+# The state file is parsed once into doc lengths, vocabulary, term frequencies,
+# counts, phi and theta, cached in model_cache_dir under a hash of the state
+# file. Later runs (and the other browser generators) load the cache instead.
+
+print('Loading model artifacts...')
+model = load_model(os.path.join(data_dir, topic_state_file), model_cache_dir, verbose=True)
 
 
 # Extract Hyperparameters
 
 print('Extracting hyperparameters...')
-params = extract_params(os.path.join(data_dir, topic_state_file))
-alpha = [float(x) for x in params[0][1:]]
-beta = params[1]
+alpha = model.alpha
+beta = model.beta
 if show_hyperparameters:
     print("\nHyperparameters:\n")
     print("{}, {}".format(alpha, beta))
 
 
 # Show Topic-State Format
-print('Establishing topic-state format...')
-df = state_to_df(os.path.join(data_dir, topic_state_file))
-df['type'] = df.type.astype(str)
+
 if show_topic_state_format:
-    print(df[:show_topic_state_format_rows])
+    state = load_model_state(model)
+    print(pd.DataFrame({'#doc': state.doc[:show_topic_state_format_rows],
+                        'type': [state.vocab[x] for x in state.typeindex[:show_topic_state_format_rows]],
+                        'topic': state.topic[:show_topic_state_format_rows]}))
 
 
-# Get the Document Lengths from the State File
-# Shows the first 10 documents.
+# Get the Document Lengths
+# Documents with no tokens are left out of the visualisation.
 
 print('Getting document lengths...')
-docs = df.groupby('#doc')['type'].count().reset_index(name ='doc_length')
+nonempty_docs = np.asarray(model.doc_lengths) > 0
+docs = pd.DataFrame({'#doc': np.flatnonzero(nonempty_docs), 'doc_length': model.doc_lengths[nonempty_docs]})
 if show_document_lengths:
     print(docs[:show_document_lengths_rows])
 
 
-# Get the Vocabulary and Term Frequencies from the State File 
+# Get the Vocabulary and Term Frequencies
+# The vocabulary is in alphabetical order, matching the columns of phi.
+
 print('Getting term frequencies...')
-vocab = df['type'].value_counts().reset_index()
-vocab.columns = ['type', 'term_freq']
-vocab = vocab.sort_values(by='type', ascending=True)
+vocab = pd.DataFrame({'type': model.vocab, 'term_freq': model.term_freq})
 if show_term_frequencies:
     print(vocab[:show_term_frequencies_rows])
 
 
-# Create a Topic-Term Matrix from the State File
+# Get the Topic-Term Matrix
 # https://ldavis.cpsievert.me/reviews/reviews.html
+# Word-topic counts smoothed with beta and normalized on the rows.
 
-import sklearn.preprocessing
-
-def pivot_and_smooth(df, smooth_value, rows_variable, cols_variable, values_variable):
-    """
-    Turns the pandas dataframe into a data matrix.
-    Args:
-        df (dataframe): aggregated dataframe 
-        smooth_value (float): value to add to the matrix to account for the priors
-        rows_variable (str): name of dataframe column to use as the rows in the matrix
-        cols_variable (str): name of dataframe column to use as the columns in the matrix
-        values_variable(str): name of the dataframe column to use as the values in the matrix
-    Returns:
-        dataframe: pandas matrix that has been normalized on the rows.
-    """
-    matrix = df.pivot(index=rows_variable, columns=cols_variable, values=values_variable).fillna(value=0)
-    matrix = matrix.values + smooth_value
-    
-    normed = sklearn.preprocessing.normalize(matrix, norm='l1', axis=1)
-    
-    return pd.DataFrame(normed)
-
-# Get Word-Topic Assignments
 print('Getting word-topic assignments...')
-phi_df = df.groupby(['topic', 'type'])['type'].count().reset_index(name ='token_count')
-phi_df = phi_df.sort_values(by='type', ascending=True)
-
 if show_word_topic_assignments:
-    print(phi_df[:show_word_topic_assignments_rows])
-
-print('Smoothing word-topic assignments...')
-phi = pivot_and_smooth(phi_df, beta, 'topic', 'type', 'token_count')
+    print(pd.DataFrame(model.topic_term_counts[:show_word_topic_assignments_rows].toarray(), columns=vocab['type']))
 
+phi = model.phi
 if show_smoothed_word_topic_assignments:
-    print(phi_df[:show_smoothed_word_topic_assignments_rows])
+    print(pd.DataFrame(phi[:show_smoothed_word_topic_assignments_rows], columns=vocab['type']))
 
-# Get Document-Topic Matrix
-print('Getting document-topic matrix...')
-theta_df = df.groupby(['#doc', 'topic'])['topic'].count().reset_index(name ='topic_count')
 
-if show_document_topic_matrix:
-    print(theta_df[:show_document_topic_matrix_rows])
+# Get the Document-Topic Matrix
+# Document-topic counts smoothed with alpha and normalized on the rows.
 
-print('Smoothing document-topic matrix...')
-theta = pivot_and_smooth(theta_df, alpha , '#doc', 'topic', 'topic_count')
+print('Getting document-topic matrix...')
+if show_document_topic_matrix:
+    print(pd.DataFrame(model.doc_topic_counts[nonempty_docs][:show_document_topic_matrix_rows].toarray()))
 
+theta = model.theta[nonempty_docs]
 if show_smoothed_document_topic_matrix:
-    print(theta_df[:show_smoothed_document_topic_matrix_rows])
+    print(pd.DataFrame(theta[:show_smoothed_document_topic_matrix_rows]))
 
 # Generate the Visualisation
 import pyLDAvis
 
 print('Generating the visualisation...')
-warning = """
-\nThe following warning is expected:
-
-FutureWarning: Sorting because non-concatenation axis is not aligned. 
-A future version of pandas will change to not sort by default.\n"""
-print(warning)
 
 # Prepare the Data
+# ldavis_prepare.prepare computes the same data as pyLDAvis.prepare with NumPy
+# arrays. Topic coordinates come from the layout cached with the model, shared
+# with the dfr-browser topic_scaled.csv, instead of being recomputed here.
 data = {'topic_term_dists': phi, 
         'doc_topic_dists': theta,
-        'doc_lengths': list(docs['doc_length']),
-        'vocab': list(vocab['type']),
-        'term_frequency': list(vocab['term_freq'])
+        'doc_lengths': model.doc_lengths[nonempty_docs],
+        'vocab': model.vocab,
+        'term_frequency': model.term_freq
        }
-vis_data = pyLDAvis.prepare(**data)
+vis_data = prepare(mds=pyldavis_mds(model, topic_layout), **data)
 
 # Open the Visualisation in a new window (local use only)
 if new_window == True:
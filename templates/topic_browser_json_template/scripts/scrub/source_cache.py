@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+"""
+source_cache.py
+Share imported and scrubbed articles between the projects of a workspace.
+
+Projects often import the same zips of the data folder (datafile_list in
+1_import_data.ipynb), and each one used to unzip and scrub every article into
+its own caches/json. This module keeps the articles in a content-addressed
+cache next to the workspace's projects_dir (from the settings.py at the top
+of the workspace), so a project over sources already seen imports in seconds:
+
+    1. each zip is identified by its SHA-1 (hashed once, and again only when
+       its size or time changes); its articles are extracted once to
+       raw/<zip sha1>/<member> and hard-linked into caches/json;
+    2. scrubbed articles are kept under scrubbed/<config hash>/<zip sha1>/<member>,
+       where the config hash covers scrub.py, scrub/config.py, the stop word
+       list and the scrub options; a project scrubbing an article it shares
+       with another project with the same configuration links the scrubbed
+       copy instead of scrubbing it again;
+    3. the zip and member of each file in caches/json are recorded in
+       caches/json_sources.json, for the scrub step.
+
+The cache files are read-only and only ever replaced, never rewritten in
+place, so a project can delete its links (e.g. filtered or duplicate
+articles) without changing the cache.
+
+v1.0 first version: workspace cache for extracted and scrubbed articles
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import zipfile
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+cache_name      = 'source-cache'   ## folder next to the workspace's projects_dir
+sources_file    = 'caches/json_sources.json'
+zip_index_file  = 'zips.json'
+scrub_files     = ('scripts/scrub/scrub.py', 'scripts/scrub/config.py')
+
+
+## CACHE
+
+def workspace_cache_dir(start='.', name=cache_name):
+    """Return the cache folder next to projects_dir of the workspace above start.
+
+    The workspace is the first folder above start with a settings.py and a
+    templates folder. name selects another shared folder there (e.g. the
+    article packs of scripts/dfrbrowser/article_pack.py).
+
+    Returns:
+        str: the cache folder, or None outside a workspace.
+    """
+    path = os.path.abspath(start)
+    while os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+        settings = os.path.join(path, 'settings.py')
+        if os.path.isfile(settings) and os.path.isdir(os.path.join(path, 'templates')):
+            projects_dir = runpy.run_path(settings).get('projects_dir')
+            if projects_dir:
+                return os.path.normpath(os.path.join(path, os.path.dirname(projects_dir.rstrip('/\\')), name))
+    return None
+
+
+def file_digest(path, block_size=1 << 20):
+    """Return the SHA-1 of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_json(path, default):
+    """Return the contents of a JSON file, or default if it does not exist."""
+    if not os.path.isfile(path):
+        return default
+    with io.open(path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def write_json(path, obj):
+    """Write a JSON file atomically."""
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with io.open(tmp, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(obj, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def zip_digests(zip_paths, cache_dir):
+    """Return the SHA-1 of each zip, reusing the hashes of unchanged zips.
+
+    Returns:
+        list: one SHA-1 per zip.
+    """
+    index_path = os.path.join(cache_dir, zip_index_file)
+    index = read_json(index_path, {})
+    digests, changed = [], False
+    for path in zip_paths:
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        known = index.get(key)
+        if not (known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns):
+            known = index[key] = [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+            changed = True
+        digests.append(known[2])
+    if changed:
+        ## projects importing at the same time may each add hashes; a lost one is computed again
+        write_json(index_path, dict(read_json(index_path, {}), **index))
+    return digests
+
+
+def link_file(source, target):
+    """Hard-link source to target, replacing target; copy if linking fails."""
+    tmp = '{}.{}.tmp'.format(target, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+
+
+def store_file(data, path):
+    """Write bytes to a read-only cache file atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as out:
+        out.write(data)
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, path)
+
+
+## IMPORT
+
+def extract_zip(zip_path, entry_dir):
+    """Extract the files of a zip, without their folders, to a cache entry."""
+    parent = os.path.dirname(entry_dir)
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix='.' + os.path.basename(entry_dir) + '-', dir=parent)
+    os.chmod(build_dir, 0o755)
+    try:
+        with zipfile.ZipFile(zip_path) as zfile:
+            for info in zfile.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name:
+                    continue
+                store_file(zfile.read(info), os.path.join(build_dir, name))
+        os.rename(build_dir, entry_dir)
+    except OSError:
+        ## another project extracted the same zip first
+        shutil.rmtree(build_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            raise
+
+
+def import_zips(zip_paths, json_dir='caches/json', cache_dir=None, verbose=True):
+    """Put the articles of zips in json_dir, extracting each zip only once per workspace.
+
+    As `unzip -j -o`, folders in the zips are ignored and a file overwrites
+    one of the same name from an earlier zip.
+
+    Args:
+        zip_paths (list): zip files to import.
+        json_dir (str): folder for the articles.
+        cache_dir (str): cache folder; defaults to workspace_cache_dir().
+    Returns:
+        dict: file name -> [zip sha1, member], also written to sources_file.
+    """
+    cache_dir = cache_dir or workspace_cache_dir()
+    if cache_dir is None:
+        raise ValueError('No workspace settings.py with projects_dir found above ' + os.getcwd())
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(json_dir, exist_ok=True)
+    sources, extracted = {}, 0
+    for zip_path, digest in zip(zip_paths, zip_digests(zip_paths, cache_dir)):
+        entry_dir = os.path.join(cache_dir, 'raw', digest)
+        if not os.path.isdir(entry_dir):
+            extract_zip(zip_path, entry_dir)
+            extracted += 1
+        for name in sorted(os.listdir(entry_dir)):
+            link_file(os.path.join(entry_dir, name), os.path.join(json_dir, name))
+            sources[name] = [digest, name]
+    os.makedirs(os.path.dirname(sources_file), exist_ok=True)
+    write_json(sources_file, sources)
+    if verbose:
+        print('Imported {} articles from {} zips ({} extracted, {} from the cache in {})'.format(
+            len(sources), len(zip_paths), extracted, len(zip_paths) - extracted, cache_dir))
+    return sources
+
+
+## SCRUB
+
+def scrub_config_hash(stopwords_file=None, options=None):
+    """Return a hash of everything that decides the scrubbed text.
+
+    Args:
+        stopwords_file (str): the stop word list scrub.py reads (its stopwords_location).
+        options (dict): scrub options that change the output (e.g. deleting
+            the original content).
+    """
+    digest = hashlib.sha1()
+    for path in scrub_files + ((stopwords_file,) if stopwords_file else ()):
+        if os.path.isfile(path):
+            digest.update(file_digest(path).encode('ascii'))
+    digest.update(json.dumps(options or {}, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def scrub_articles(scrub, json_dir='caches/json', cache_dir=None, stopwords_file=None, rescrub=False, delete_original_content=True, verbose=True):
+    """Add content_scrubbed to the articles of json_dir, reusing scrubbed articles from the cache.
+
+    The article files are replaced, not rewritten, so the raw articles in
+    the cache they are linked to are left as they are.
+
+    Args:
+        scrub (function): scrub.scrub.
+        stopwords_file (str): the stop word list scrub uses.
+        rescrub (bool): scrub articles that already have content_scrubbed.
+        delete_original_content (bool): drop content once it is scrubbed.
+    Returns:
+        dict: number of articles 'scrubbed', 'cached' and 'unchanged'.
+    """
+    cache_dir = cache_dir or workspace_cache_dir()
+    sources = read_json(sources_file, {}) if cache_dir else {}
+    config = scrub_config_hash(stopwords_file, {'rescrub': rescrub, 'delete_original_content': delete_original_content})
+    counts = {'scrubbed': 0, 'cached': 0, 'unchanged': 0}
+    for filename in sorted(name for name in os.listdir(json_dir) if name.endswith('.json')):
+        path = os.path.join(json_dir, filename)
+        source = sources.get(filename)
+        entry = os.path.join(cache_dir, 'scrubbed', config, source[0], source[1]) if source else None
+        if entry and os.path.isfile(entry):
+            link_file(entry, path)
+            counts['cached'] += 1
+            continue
+        with io.open(path, 'r', encoding='utf-8') as fin:
+            article = json.load(fin)
+        changed = False
+        if 'content' in article and ('content_scrubbed' not in article or rescrub):
+            article['content_scrubbed'] = scrub(article['content'])
+            changed = True
+        if delete_original_content and 'content_scrubbed' in article and 'content' in article:
+            article.pop('content', None)
+            changed = True
+        if not changed:
+            counts['unchanged'] += 1
+            continue
+        data = json.dumps(article).encode('utf-8')
+        if entry:
+            store_file(data, entry)
+            link_file(entry, path)
+        else:
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'wb') as out:
+                out.write(data)
+            os.replace(tmp, path)
+        counts['scrubbed'] += 1
+        ## progress indicator
+        if counts['scrubbed'] % 100 == 0 and verbose:
+            print('. ', end='')
+    if verbose:
+        print('Scrubbed {scrubbed} files, {cached} from the cache, {unchanged} unchanged.'.format(**counts))
+    return counts
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Import the articles of zips into a project through the workspace source cache.', epilog='EXAMPLE:\n  source_cache.py -o caches/json /home/jovyan/work/data/data-new/6742_thenewyorktimes.zip\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('zips', nargs='+', help='zip files to import')
+    PARSER.add_argument('-o', '--output', default='caches/json', help='folder for the articles')
+    PARSER.add_argument('-c', '--cache', default=None, help='cache folder (default: next to projects_dir of the workspace settings.py)')
+
+    CL_ARGS = PARSER.parse_args()
+
+    import_zips(CL_ARGS.zips, CL_ARGS.output, CL_ARGS.cache)
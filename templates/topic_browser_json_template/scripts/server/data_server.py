@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+"""
+data_server.py
+Serve a topic browser and its data files from Python, with asyncio.
+
+A small HTTP/1.1 static file server for browser/, the topic bubbles and the
+pyLDAvis pages, so a project can be published without an external web server:
+
+1.  Text files (json, csv, js, css, html, svg, txt) are sent gzip or brotli
+      compressed when the client accepts it. Compressed copies are written
+      next to each file (e.g. tw.json.gz, tw.json.br) once, by precompress()
+      or on first request, and reused until the file changes.
+2.  Every response has an ETag built from the file's size and modification
+      time; If-None-Match requests get 304 Not Modified.
+3.  Single byte-range requests (Range: bytes=a-b) get 206 Partial Content.
+4.  Connections are kept alive and files are sent with loop.sendfile, so one
+      process handles hundreds of concurrent viewers.
+5.  Requests for files missing from a directory that holds an article pack
+      (articles.json, scripts/dfrbrowser/article_pack.py) are answered from
+      the pack, e.g. browser/json/<filename>.
+6.  With an overlay file (scripts/dfrbrowser/browser_config.py), info.json
+      is sent with the overlay merged in, so customizations show on reload.
+
+Brotli is used if the brotli package is installed; otherwise only gzip.
+
+v1.0 first version: asyncio server with precompression, ETags and ranges
+v1.1 articles served from article packs
+v1.2 info.json merged with the browser overlay file
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import asyncio
+import email.utils
+import gzip
+import json
+import mimetypes
+import os
+import sys
+import tempfile
+import threading
+import urllib.parse
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from scripts.dfrbrowser.article_pack import ArticlePack, pack_name
+    from scripts.dfrbrowser.browser_config import base_info_file, merged_info
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dfrbrowser'))
+    from article_pack import ArticlePack, pack_name
+    from browser_config import base_info_file, merged_info
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+host              = '0.0.0.0'
+port              = 10003  ## 10001 is the static server of the Browser LIVE links
+compressible      = ('.json', '.csv', '.js', '.css', '.html', '.htm', '.svg', '.txt', '.xml', '.tsv')
+min_compress_size = 1024
+keepalive_timeout = 15
+max_header_bytes  = 16384
+encodings         = (('br', '.br'), ('gzip', '.gz'))
+reasons           = {200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+                     403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+                     416: 'Range Not Satisfiable'}
+
+mimetypes.add_type('application/json', '.json')
+mimetypes.add_type('text/csv', '.csv')
+
+
+## COMPRESSION
+
+def is_compressible(path):
+    """Return True if a file should be sent compressed."""
+    return path.lower().endswith(compressible)
+
+
+def compress_file(path, suffix):
+    """Write a compressed copy of path (path + suffix) if it is missing or stale.
+
+    Returns:
+        str: the compressed file, or None if the encoding is unavailable.
+    """
+    target = path + suffix
+    if suffix == '.br' and brotli is None:
+        return None
+    if os.path.isfile(target) and os.stat(target).st_mtime_ns >= os.stat(path).st_mtime_ns:
+        return target
+    with open(path, 'rb') as source:
+        data = source.read()
+    data = brotli.compress(data) if suffix == '.br' else gzip.compress(data, 9)
+    ## a temporary file of its own, as threads may compress the same file at once
+    handle, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(target) + '-', suffix='.tmp', dir=os.path.dirname(target) or '.')
+    with os.fdopen(handle, 'wb') as out:
+        out.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, target)
+    return target
+
+
+def precompress(root, verbose=True):
+    """Write gzip (and brotli) copies of every compressible file under root.
+
+    Returns:
+        int: number of files compressed or already up to date.
+    """
+    count = 0
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if is_compressible(path) and os.path.getsize(path) >= min_compress_size:
+                for _encoding, suffix in encodings:
+                    compress_file(path, suffix)
+                count += 1
+    if verbose:
+        print('Precompressed {} files under {}'.format(count, root))
+    return count
+
+
+## HTTP
+
+def etag_for(stat, encoding=None):
+    """Return a strong ETag for a file version and content encoding."""
+    tag = '{:x}-{:x}'.format(stat.st_size, stat.st_mtime_ns)
+    return '"{}{}"'.format(tag, '-' + encoding if encoding else '')
+
+
+def parse_range(header, size):
+    """Parse a single 'bytes=' range.
+
+    Returns:
+        tuple: (start, end) inclusive, None if the header is absent or not a
+            single byte range, or False if the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, _, end = header[6:].strip().partition('-')
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        elif end:
+            start, end = max(0, size - int(end)), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+def accepted(header, encoding):
+    """Return True if an Accept-Encoding header allows the encoding."""
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip() in (encoding, '*'):
+            quality = params.replace(' ', '').partition('q=')[2]
+            try:
+                return not quality or float(quality) > 0
+            except ValueError:
+                return False
+    return False
+
+
+class DataServer:
+    """Static file server for a directory.
+
+    Args:
+        root (str): directory to serve.
+        compress (bool): send gzip/brotli copies of text files.
+        cache_control (str): Cache-Control header value.
+        overlay (str): browser customization file merged into info.json.
+    """
+
+    def __init__(self, root, compress=True, cache_control='no-cache', overlay=None):
+        self.root = os.path.realpath(root)
+        self.compress = compress
+        self.cache_control = cache_control
+        self.overlay = overlay
+        self.packs = {}
+
+    def local_path(self, target):
+        """Map a request target to a path under root, or None if it is outside."""
+        path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+        full = os.path.realpath(os.path.join(self.root, path.lstrip('/')))
+        if full != self.root and not full.startswith(self.root + os.sep):
+            return None
+        return full
+
+    def resolve(self, target):
+        """Map a request target to a file under root, or None."""
+        full = self.local_path(target)
+        if full and os.path.isdir(full):
+            full = os.path.join(full, 'index.html')
+        return full if full and os.path.isfile(full) else None
+
+    def pack_for(self, directory):
+        """Return the article pack of a directory, or None."""
+        index = os.path.join(directory, pack_name + '.json')
+        if not os.path.isfile(index):
+            return None
+        stamp = os.stat(index).st_mtime_ns
+        if directory not in self.packs or self.packs[directory][0] != stamp:
+            if directory in self.packs:
+                self.packs[directory][1].close()
+            self.packs[directory] = (stamp, ArticlePack(directory))
+        return self.packs[directory][1]
+
+    def respond_article(self, writer, method, target, headers):
+        """Answer a request from an article pack.
+
+        Returns:
+            bool: False if no pack holds the requested file.
+        """
+        full = self.local_path(target)
+        pack = self.pack_for(os.path.dirname(full)) if full else None
+        data = pack.raw(os.path.basename(full)) if pack else None
+        if data is None:
+            return False
+        offset = pack.articles[os.path.basename(full)][0]
+        encoding = 'gzip' if accepted(headers.get('accept-encoding'), 'gzip') else None
+        etag = '"{}-{:x}{}"'.format(pack.key[:16], offset, '-gzip' if encoding else '')
+        response = {'ETag': etag, 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding',
+                    'Content-Type': mimetypes.guess_type(full)[0] or 'application/octet-stream'}
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            self.write_head(writer, 304, response)
+            return True
+        if encoding:
+            response['Content-Encoding'] = encoding
+        else:
+            data = gzip.decompress(data)
+        response['Content-Length'] = str(len(data))
+        self.write_head(writer, 200, response)
+        if method == 'GET':
+            writer.write(data)
+        return True
+
+    def respond_info(self, writer, method, path, headers):
+        """Answer a request for info.json with the overlay merged in."""
+        stamps = [os.stat(path)]
+        for other in (os.path.join(os.path.dirname(path), base_info_file), self.overlay):
+            if os.path.isfile(other):
+                stamps.append(os.stat(other))
+        etag = '"{}"'.format('-'.join('{:x}-{:x}'.format(stat.st_size, stat.st_mtime_ns) for stat in stamps))
+        response = {'ETag': etag, 'Cache-Control': self.cache_control, 'Content-Type': 'application/json'}
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return self.write_head(writer, 304, response)
+        data = json.dumps(merged_info(path, self.overlay), indent=2, ensure_ascii=False).encode('utf-8')
+        response['Content-Length'] = str(len(data))
+        self.write_head(writer, 200, response)
+        if method == 'GET':
+            writer.write(data)
+        return None
+
+    async def representation(self, path, headers):
+        """Choose the file to send: a compressed copy if accepted, else path.
+
+        Returns:
+            tuple: (file to send, content encoding or None)
+        """
+        if not self.compress or 'range' in headers or not is_compressible(path) \
+                or os.path.getsize(path) < min_compress_size:
+            return path, None
+        loop = asyncio.get_running_loop()
+        for encoding, suffix in encodings:
+            if accepted(headers.get('accept-encoding'), encoding):
+                compressed = await loop.run_in_executor(None, compress_file, path, suffix)
+                if compressed:
+                    return compressed, encoding
+        return path, None
+
+    async def respond(self, writer, method, target, headers):
+        """Write the response to one request."""
+        if method not in ('GET', 'HEAD'):
+            return self.write_head(writer, 405, {'Allow': 'GET, HEAD', 'Content-Length': '0'})
+        path = self.resolve(target)
+        if path is None:
+            if not self.respond_article(writer, method, target, headers):
+                self.write_head(writer, 404, {'Content-Length': '0'})
+            return None
+        if self.overlay and os.path.basename(path) == 'info.json':
+            return self.respond_info(writer, method, path, headers)
+        send_path, encoding = await self.representation(path, headers)
+        stat = os.stat(path)
+        etag = etag_for(stat, encoding)
+        response = {'ETag': etag,
+                    'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True),
+                    'Cache-Control': self.cache_control,
+                    'Accept-Ranges': 'bytes',
+                    'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream'}
+        if is_compressible(path):
+            response['Vary'] = 'Accept-Encoding'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return self.write_head(writer, 304, response)
+
+        size = os.path.getsize(send_path)
+        status, start, length = 200, 0, size
+        byte_range = parse_range(headers.get('range'), size)
+        if byte_range is not None and headers.get('if-range', etag) == etag:
+            if byte_range is False:
+                response['Content-Range'] = 'bytes */{}'.format(size)
+                response['Content-Length'] = '0'
+                return self.write_head(writer, 416, response)
+            status, start, length = 206, byte_range[0], byte_range[1] - byte_range[0] + 1
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(byte_range[0], byte_range[1], size)
+        response['Content-Length'] = str(length)
+        self.write_head(writer, status, response)
+        if method == 'GET' and length:
+            await writer.drain()
+            with open(send_path, 'rb') as body:
+                await asyncio.get_running_loop().sendfile(writer.transport, body, start, length)
+        return None
+
+    @staticmethod
+    def write_head(writer, status, headers):
+        """Write the status line and headers."""
+        lines = ['HTTP/1.1 {} {}'.format(status, reasons.get(status, ''))]
+        lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    async def handle(self, reader, writer):
+        """Serve requests on one connection until it closes or idles."""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    self.write_head(writer, 400, {'Content-Length': '0', 'Connection': 'close'})
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                await self.respond(writer, method, target, headers)
+                await writer.drain()
+                connection = headers.get('connection', '').lower()
+                if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            ## the server is stopping (serve_in_thread's stop)
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host=host, port=port):
+        """Start listening and return the asyncio server."""
+        return await asyncio.start_server(self.handle, host, port, limit=max_header_bytes, backlog=1024)
+
+
+def serve(root, host=host, port=port, compress=True, overlay=None):
+    """Serve root until interrupted."""
+    async def main():
+        server = await DataServer(root, compress, overlay=overlay).start(host, port)
+        print('Serving {} on http://{}:{}/'.format(root, host, port))
+        async with server:
+            await server.serve_forever()
+    asyncio.run(main())
+
+
+def serve_in_thread(root, host=host, port=port, compress=True, overlay=None):
+    """Serve root from a background thread, e.g. from a notebook.
+
+    Returns:
+        function: call it to stop the server.
+    """
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(DataServer(root, compress, overlay=overlay).start(host, port))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def shutdown():
+        ## stop listening, then end the open connections before the loop stops
+        server.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await server.wait_closed()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    return stop
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Serve a topic browser directory over HTTP with gzip/brotli, ETags and range requests.', epilog='EXAMPLE:\n  data_server.py -d browser -p 10003 --precompress\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-d', '--directory', default='browser', help='directory to serve')
+    PARSER.add_argument('-H', '--host', default=host, help='address to listen on')
+    PARSER.add_argument('-p', '--port', type=int, default=port, help='port')
+    PARSER.add_argument('--precompress', action='store_true', help='compress every text file before serving')
+    PARSER.add_argument('--no-compress', action='store_true', help='always send files uncompressed')
+    PARSER.add_argument('-c', '--config', default=None, help='browser customization file merged into info.json')
+
+    CL_ARGS = PARSER.parse_args()
+
+    if CL_ARGS.precompress and not CL_ARGS.no_compress:
+        precompress(CL_ARGS.directory)
+    serve(CL_ARGS.directory, CL_ARGS.host, CL_ARGS.port, not CL_ARGS.no_compress, CL_ARGS.config)
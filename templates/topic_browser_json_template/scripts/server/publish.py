@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+publish.py
+Publish a site directory (topic bubbles, a browser) by copying only what changed.
+
+The publish folders (e.g. /home/jovyan/work/view/topic-bubbles/<project>/)
+used to be refreshed with cp -rf, copying the d3 and jszip libraries and all
+the data on every publish. This module syncs a source directory to a
+destination by content hash:
+
+    1. the destination holds a manifest (.publish.json) with the size,
+       modification time and SHA-1 of every file it was last published from;
+       files whose size and time have not changed are not read again;
+    2. only files whose hash differs from the manifest are written, each to
+       a temporary file that is then renamed over the old one, so a viewer
+       never loads a half-written file;
+    3. files under lib/ are kept once in an object store next to the
+       published sites (e.g. view/topic-bubbles/.objects/) and hard-linked
+       into each site, so every project shares one copy of each library;
+    4. files published before but no longer in the source are removed.
+
+v1.0 first version: content-hash sync with shared hard-linked libraries
+"""
+
+#pylint: disable=line-too-long
+
+## IMPORT
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+
+## INFO
+
+__copyright__ = "copyright 2018, The WE1S Project"
+__license__ = "GPL"
+__version__ = "1.0"
+
+## DEFAULTS
+
+manifest_file   = '.publish.json'
+objects_dir     = '.objects'
+shared_dirs     = ('lib/',)
+ignored_names   = (manifest_file, '.ipynb_checkpoints', '__pycache__', '.DS_Store')
+
+
+## HASHING
+
+def file_digest(path, block_size=1 << 20):
+    """Return the SHA-1 of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan(source, previous=None):
+    """Hash the files of a directory, reusing the hashes of unchanged files.
+
+    Args:
+        source (str): directory to scan.
+        previous (dict): a manifest from an earlier scan.
+    Returns:
+        dict: relative path (with '/') -> [size, mtime_ns, sha1].
+    """
+    previous = previous or {}
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = sorted(name for name in dirnames if name not in ignored_names and not name.startswith('.'))
+        for name in sorted(filenames):
+            if name in ignored_names:
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, source).replace(os.sep, '/')
+            stat = os.stat(path)
+            known = previous.get(rel)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                files[rel] = known
+            else:
+                files[rel] = [stat.st_size, stat.st_mtime_ns, file_digest(path)]
+    return files
+
+
+## WRITING
+
+def read_manifest(dest):
+    """Return the manifest of a published directory, or an empty one."""
+    path = os.path.join(dest, manifest_file)
+    if not os.path.isfile(path):
+        return {'source': None, 'files': {}}
+    with io.open(path, 'r', encoding='utf-8') as manifest:
+        return json.load(manifest)
+
+
+def write_manifest(dest, manifest):
+    """Write a manifest atomically."""
+    path = os.path.join(dest, manifest_file)
+    with io.open(path + '.tmp', 'w', encoding='utf-8') as out:
+        out.write(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(path + '.tmp', path)
+
+
+def copy_atomic(source, target):
+    """Copy source to target through a temporary file in the target's directory."""
+    tmp = '{}.{}.tmp'.format(target, os.getpid())
+    shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+
+
+def link_atomic(source, target):
+    """Hard-link source to target, replacing target atomically; copy if linking fails."""
+    tmp = '{}.{}.tmp'.format(target, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+
+
+def store_object(store, source, digest):
+    """Add a file to the object store under its hash, if it is not there.
+
+    Returns:
+        str: the stored object.
+    """
+    obj = os.path.join(store, digest[:2], digest)
+    if not os.path.isfile(obj):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        copy_atomic(source, obj)
+    return obj
+
+
+def publish(source, dest, store=None, shared=shared_dirs, verbose=True):
+    """Sync source to dest by content hash.
+
+    Args:
+        source (str): directory to publish (e.g. scripts/topic-bubbles).
+        dest (str): published directory.
+        store (str): object store for shared files; defaults to .objects in
+            dest's parent directory, shared by all the sites published there.
+        shared (tuple): path prefixes of files kept in the store and
+            hard-linked; () to copy every file.
+        verbose (bool): print a summary.
+    Returns:
+        dict: number of files copied, linked, unchanged and removed.
+    """
+    dest = os.path.abspath(dest)
+    store = store or os.path.join(os.path.dirname(dest), objects_dir)
+    manifest = read_manifest(dest)
+    published = manifest['files']
+    files = scan(source, published if manifest.get('source') == os.path.abspath(source) else None)
+    stats = {'copied': 0, 'linked': 0, 'unchanged': 0, 'removed': 0}
+
+    for rel, (_size, _mtime, digest) in files.items():
+        target = os.path.join(dest, rel)
+        if rel in published and published[rel][2] == digest and os.path.isfile(target):
+            stats['unchanged'] += 1
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        path = os.path.join(source, rel)
+        if rel.startswith(tuple(shared)):
+            link_atomic(store_object(store, path, digest), target)
+            stats['linked'] += 1
+        else:
+            copy_atomic(path, target)
+            stats['copied'] += 1
+
+    ## only files this module published are removed
+    for rel in set(published) - set(files):
+        target = os.path.join(dest, rel)
+        if os.path.isfile(target):
+            os.remove(target)
+            stats['removed'] += 1
+            parent = os.path.dirname(target)
+            while parent != dest and not os.listdir(parent):
+                os.rmdir(parent)
+                parent = os.path.dirname(parent)
+
+    write_manifest(dest, {'source': os.path.abspath(source), 'files': files})
+    if verbose:
+        print('Published {} to {}: {copied} copied, {linked} linked, {unchanged} unchanged, {removed} removed'.format(source, dest, **stats))
+    return stats
+
+
+## ENTRY POINT
+
+if __name__ == '__main__':
+
+    PARSER = argparse.ArgumentParser(description='Publish a site directory by content hash, copying only changed files and hard-linking shared libraries.', epilog='EXAMPLE:\n  publish.py -s scripts/topic-bubbles -d /home/jovyan/work/view/topic-bubbles/myproject\n \n', formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('-s', '--source', default='scripts/topic-bubbles', help='directory to publish')
+    PARSER.add_argument('-d', '--dest', required=True, help='published directory')
+    PARSER.add_argument('--store', default=None, help='object store for shared files (default: .objects next to the published directory)')
+    PARSER.add_argument('--no-links', action='store_true', help='copy every file instead of hard-linking libraries')
+
+    CL_ARGS = PARSER.parse_args()
+
+    publish(CL_ARGS.source, CL_ARGS.dest, CL_ARGS.store, () if CL_ARGS.no_links else shared_dirs)
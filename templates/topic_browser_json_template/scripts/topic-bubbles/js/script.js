@@ -4,6 +4,7 @@ var files = {
         meta: "meta.csv.zip",
         dt: "dt.json.zip",
         tw: "tw.json",
+        clouds: "clouds.json",
         topic_scaled: "topic_scaled.csv"
 };
 
@@ -38,6 +39,8 @@ function load_data(e, t) {
 
     return d3.text(e).then(function(data) {
         return t(e, data)
+    }, function(error) {
+        return t(error, undefined)
     })
 };
 
@@ -267,6 +270,21 @@ function draw() {
             .text(d => {
                 let fontSizeScale = d3.scaleSqrt().domain([0, 1]).range([5, 25]);
 
+                // word positions precomputed by scripts/dfrbrowser/word_clouds.py,
+                // scaled from the layout's box to this cloud's box
+                if (data.clouds !== undefined && data.clouds.topics[d.idx] !== undefined) {
+                    var scale = (centerY - 10) / data.clouds.width;
+                    var cloudLayer = wordCloudLayer.filter((l,i) => l.idx == d.idx);
+                    data.clouds.topics[d.idx].forEach(w => {
+                        cloudLayer.append('text')
+                            .style('font-size', (w[3] * scale) + "px")
+                            .style('cursor', 'default')
+                            .attr("transform", "translate(" + [w[1] * scale, 20 + w[2] * scale] + ")")
+                            .text(w[0]);
+                    });
+                    return d.name;
+                }
+
                 var maxWeight = d.words[0].weight;
                 var words_frequency = d.words.slice(0, 50).map(w => {
                     return {
@@ -463,6 +481,21 @@ function load() {
         }
     });
 
+    // load the precomputed word clouds before tw.json, which draws the bubbles
+    load_data(data_folder[0] + files.clouds, function(e, i) {
+        if (typeof i === "string") {
+            data.clouds = JSON.parse(i);
+        } else {
+            console.log("Unable to load a file " + files.clouds + " -- word clouds are laid out in the browser")
+        }
+        load_tw();
+    });
+
+    //window.addEventListener("resize", draw);
+    addGui();
+};
+
+function load_tw() {
     load_data(data_folder[0] + files.tw, function(e, i) {
     
         if (typeof i === "string") {
@@ -471,9 +504,6 @@ function load() {
             console.log("Unable to load a file " + files.tw)
         }
     });
-
-    //window.addEventListener("resize", draw);
-    addGui();
 };
 
 function addGui() {
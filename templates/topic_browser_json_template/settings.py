@@ -8,6 +8,7 @@ metadata_file_reorder = 'caches/metadata/metadata-dfrb.csv'
 model_dir             = 'caches/model'
 text_files_dir        = 'caches/text_files'
 text_files_clean_dir  = 'caches/text_files_clean'
+source_cache_dir      = 'auto'  # articles shared by projects: 'auto' (source-cache next to the workspace projects_dir), a folder, or None
 
 
 ## scripts
@@ -16,6 +17,8 @@ scrub                 = 'scrub.py'
 dedup_dir             = 'scripts/deduplicate'
 dedup                 = 'corpus_compare.py'
 dedup_name            = 'corpus_compare'
+fingerprint           = 'fingerprint.py'
+fingerprint_name      = 'fingerprint'
 
 
 ## model settings
@@ -24,6 +27,11 @@ model_num_topics      = '50'
 model_random_seed     = '10'
 use_random_seed       = True
 generate_diagnostics  = False
+model_num_threads     = None  # None = all available cores
+model_engine          = 'mallet'  # 'mallet', 'gibbs', 'variational', or 'auto' (in-process for small corpora)
+model_sweep_topics    = []    # e.g. [25, 50, 100] -- trains one model per count and seed
+model_sweep_seeds     = []    # e.g. [10, 11, 12]  -- defaults to model_random_seed
+model_sweep_cpus      = None  # None = all available cores
 
 
 ## model resources
@@ -32,6 +40,9 @@ model_state           = 'topic-state.gz'
 model_keys            = 'keys.txt'
 model_composition     = 'composition.txt'
 model_counts          = 'topic_counts.txt'
+model_cache_dir       = 'caches/model/cache'
+model_top_docs        = 100     # documents kept per topic in the top-document index
+topic_layout          = 'pcoa'  # 'pcoa', 'mmds' or 'tsne' -- shared by pyLDAvis and the browsers
 stopwords_dir         = 'scripts/scrub'
 stopwords_file        = 'stopwords.txt'
 
@@ -40,3 +51,9 @@ stopwords_file        = 'stopwords.txt'
 dfb_script     = 'scripts/dfrbrowser/js/dfb.min.js.custom'
 dfb_output_dir = 'browser'
 dfb_zip_file   = 'browser.zip'
+dfb_html_file  = 'browser.html'  # single-file browser, opens without a server
+dfb_source_dir = '/opt/conda/lib/R/library/dfrtopics/dfr-browser'
+dfb_shards     = False  # also write per-topic, per-year and metadata shards for large models
+dfb_overlay    = 'browser-config.json'  # browser customizations from 5_customize_browser.ipynb, merged into info.json
+dfb_articles   = 'auto'  # article pack store: 'auto' (article-packs next to the workspace projects_dir, shared by projects) or a folder
+dfb_pack_only  = False  # True: browser/json holds only the article pack, served by the local data server (scripts/server/data_server.py)